@@ -11,6 +11,7 @@ from ui.styling import apply_executive_styling
 from services.app_state import AppStateManager
 from services.model_service import ModelService
 from services.conversation_service import ConversationService
+from services.endpoint_monitor import monitor
 from auth_utils import setup_request_context
 
 class DatabricksIntelligenceApp:
@@ -51,6 +52,10 @@ class DatabricksIntelligenceApp:
         # Initialize application state
         self.state_manager.initialize()
         
+        # Keep endpoint readiness fresh for every session
+        endpoints, _ = self.model_service.get_available_endpoints()
+        monitor.start([m["id"] for m in endpoints])
+        
         # Render UI components
         self.sidebar_renderer.render()
         self.main_content_renderer.render()
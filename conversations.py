@@ -1,6 +1,9 @@
 # conversations.py
+import re
 import json
-from typing import Dict, List
+import math
+from collections import Counter
+from typing import Any, Dict, List, Tuple
 
 from model_serving_utils import query_endpoint_with_usage
 import db
@@ -15,10 +18,72 @@ def default_title_from_prompt(prompt: str) -> str:
         title += "…"
     return title
 
+_STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further get got had has
+have having he her here hers herself him himself his how i if in into is it its itself just let like me
+might more most must my myself no nor not now of off on once only or other our ours ourselves out over
+own please same she should so some such than that the their theirs them themselves then there these
+they this those through to too under until up us very was we were what when where which while who whom
+why will with would you your yours yourself yourselves tell give show explain help need want know make
+using use summarize summarise describe write create find list thanks thank hi hello hey ok okay sure yes file document user assistant
+""".split())
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9+#.\-]*[A-Za-z0-9+#]|[A-Za-z]")
+
+def _title_terms(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall(text) if len(w) > 2 and w.lower() not in _STOPWORDS]
+
+def _without_attachment(message: Dict) -> Dict:
+    """A user message without the attached document text ("<document>\n\nUser: <question>")"""
+    content = message.get("content") or ""
+    if message.get("role") == "user" and "\n\nUser: " in content:
+        return {**message, "content": content.rsplit("\n\nUser: ", 1)[-1]}
+    return message
+
+def extractive_title(messages: List[Dict], max_words: int = 6) -> Tuple[str, int]:
+    """Build a title locally from the highest-scoring keywords of the first turns
+
+    Terms are weighted by TF-IDF across the sentences of the first turns,
+    with words from the user's question counting triple. Attached document
+    text is left out, so a large upload cannot outweigh the question.
+    Keywords keep the order they first appear in. Returns (title, keyword
+    count); the count is 0 when nothing useful was found.
+    """
+    turns = [_without_attachment(m) for m in messages[:4]]
+    question = next((m.get("content") or "" for m in turns if m.get("role") == "user"), "")
+    rest = " ".join(m.get("content") or "" for m in turns)
+
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+|\n+", rest) if s.strip()] or [rest]
+    df = Counter()
+    for sentence in sentences:
+        df.update({w.lower() for w in _title_terms(sentence)})
+
+    tf = Counter(w.lower() for w in _title_terms(rest))
+    for w in _title_terms(question):
+        tf[w.lower()] += 3
+
+    def score(term: str) -> float:
+        return tf[term] * (1.0 + math.log((1 + len(sentences)) / (1 + df[term])))
+
+    keywords = sorted(tf, key=score, reverse=True)[:max_words]
+    if not keywords:
+        return "", 0
+
+    # Present keywords in reading order, keeping the user's original casing
+    order, display = {}, {}
+    for i, w in enumerate(_title_terms(question + " " + rest)):
+        order.setdefault(w.lower(), i)
+        display.setdefault(w.lower(), w)
+    keywords.sort(key=lambda k: order.get(k, len(order)))
+    words = [display[k] if not display[k].islower() else display[k].capitalize() for k in keywords]
+    return " ".join(words)[:60], len(keywords)
+
 def generate_auto_title(endpoint: str, messages: List[Dict], fallback: str) -> str:
     try:
         sys_prompt = {"role": "system", "content": "Generate a concise title (<= 6 words) for this conversation. Return title only."}
-        last, _ = query_endpoint_with_usage(endpoint_name=endpoint, messages=[sys_prompt] + messages[:4], max_tokens=16)
+        turns = [_without_attachment(m) for m in messages[:4]]
+        last, _ = query_endpoint_with_usage(endpoint_name=endpoint, messages=[sys_prompt] + turns, max_tokens=16)
         title = (last.get("content") or "").strip()
         title = title.strip('"').strip("'")
         if title:
@@ -27,6 +92,52 @@ def generate_auto_title(endpoint: str, messages: List[Dict], fallback: str) -> s
         pass
     return fallback[:60]
 
+def summarize_turns(endpoint: str, previous_summary: str, turns: List[Dict], max_tokens: int = 600) -> Tuple[str, Dict[str, Any]]:
+    """Fold conversation turns into a running summary; returns (summary, usage)"""
+    instructions = (
+        "You maintain a running summary of a conversation. Extend the existing summary with the new turns. "
+        "Keep facts, decisions, open questions and details from attached documents the user may refer to later. "
+        "Be concise. Return the updated summary only."
+    )
+    transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in turns)
+    prompt = f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    last, usage = query_endpoint_with_usage(
+        endpoint_name=endpoint,
+        messages=[{"role": "system", "content": instructions}, {"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+    )
+    return (last.get("content") or "").strip(), usage
+
+def summarize_document_chunk(endpoint: str, name: str, chunk: str, part: int, parts: int,
+                             max_tokens: int = 800) -> Tuple[str, Dict[str, Any]]:
+    """Summarize one part of a long document; returns (summary, usage)"""
+    instructions = (
+        f"You are summarizing part {part} of {parts} of the document \"{name}\". "
+        "Capture its key facts, figures, names, definitions and conclusions so that questions about the "
+        "whole document can be answered from the summaries alone. Return the summary only."
+    )
+    last, usage = query_endpoint_with_usage(
+        endpoint_name=endpoint,
+        messages=[{"role": "system", "content": instructions}, {"role": "user", "content": chunk}],
+        max_tokens=max_tokens,
+    )
+    return (last.get("content") or "").strip(), usage
+
+def combine_document_summaries(endpoint: str, name: str, summaries: List[str],
+                               max_tokens: int = 800) -> Tuple[str, Dict[str, Any]]:
+    """Merge consecutive part summaries of a document into one; returns (summary, usage)"""
+    instructions = (
+        f"Combine these consecutive partial summaries of the document \"{name}\" into a single summary. "
+        "Keep the document's order and the specific facts and figures; drop repetition. Return the summary only."
+    )
+    prompt = "\n\n".join(f"[Part {i + 1}]\n{text}" for i, text in enumerate(summaries))
+    last, usage = query_endpoint_with_usage(
+        endpoint_name=endpoint,
+        messages=[{"role": "system", "content": instructions}, {"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+    )
+    return (last.get("content") or "").strip(), usage
+
 def export_conversation_json(conv_id: str) -> str:
     meta = db.fetch_conversation_meta(conv_id)
     msgs = db.fetch_conversation_messages(conv_id)
@@ -20,7 +20,10 @@ CREATE TABLE IF NOT EXISTS shared.app.messages (
     message_index INT,
     role STRING,
     content STRING,
-    timestamp TIMESTAMP
+    timestamp TIMESTAMP,
+    -- Token count of content and the tokenizer that produced it (PERSIST_TOKEN_COUNTS=1)
+    token_count INT,
+    token_counter STRING
 )
 CLUSTER BY AUTO;
 
@@ -46,6 +49,17 @@ CREATE TABLE IF NOT EXISTS shared.app.titles (
 COMMENT 'Stores generated or user-defined titles for conversations'
 CLUSTER BY AUTO;
 
+CREATE TABLE IF NOT EXISTS shared.app.conversation_summaries (
+  conversation_id STRING NOT NULL,
+  summary STRING,
+  covered_messages INT,
+  updated_at TIMESTAMP
+)
+COMMENT 'Rolling summaries of earlier conversation turns used to compact long chats'
+CLUSTER BY AUTO;
+
+-- Existing installs created before token_count/token_counter: run
+-- migrations/001_add_message_token_counts.sql once
 
 -- Volume for file storage (optional future enhancement)
 CREATE VOLUME IF NOT EXISTS shared.app.uploads;
@@ -2,7 +2,7 @@
 import os
 import uuid
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from contextlib import contextmanager
 
 from databricks import sql
@@ -20,6 +20,32 @@ CATALOG = os.getenv("CATALOG", "shared")
 SCHEMA = os.getenv("SCHEMA", "app")
 PRICE_PROMPT_PER_1K = float(os.getenv("PRICE_PROMPT_PER_1K", "0") or "0")
 PRICE_COMPLETION_PER_1K = float(os.getenv("PRICE_COMPLETION_PER_1K", "0") or "0")
+# Prompt tokens served from the endpoint's prompt cache (default: 10% of prompt price)
+PRICE_CACHED_PROMPT_PER_1K = float(os.getenv("PRICE_CACHED_PROMPT_PER_1K", "") or PRICE_PROMPT_PER_1K * 0.1)
+# Prompt tokens written to the prompt cache, as a multiple of the prompt price
+PRICE_CACHE_WRITE_MULTIPLIER = float(os.getenv("PRICE_CACHE_WRITE_MULTIPLIER", "1.25") or "1.25")
+
+def _parse_model_prices(csv: str) -> Dict[str, Tuple[float, float, float]]:
+    """Parse "endpoint=prompt:completion[:cached],..." per-1K token prices"""
+    prices = {}
+    for token in [x.strip() for x in csv.split(",") if x.strip()]:
+        if "=" not in token:
+            continue
+        name, value = token.split("=", 1)
+        try:
+            parts = [float(x) for x in value.split(":")]
+        except ValueError:
+            continue
+        if len(parts) < 2:
+            continue
+        cached = parts[2] if len(parts) > 2 else parts[0] * 0.1
+        prices[name.strip()] = (parts[0], parts[1], cached)
+    return prices
+
+MODEL_PRICES = _parse_model_prices(os.getenv("MODEL_PRICES", ""))
+
+# Store each message's token count (needs the token_count/token_counter columns)
+PERSIST_TOKEN_COUNTS = os.getenv("PERSIST_TOKEN_COUNTS", "0") == "1"
 
 def fqn(table_name: str) -> str:
     """Generate fully qualified table name"""
@@ -107,9 +133,15 @@ def get_db_connection():
             except Exception as e:
                 logger.warning(f"Error closing connection: {e}")
 
-def execute_sql(statement: str, params: Dict[str, Any] = None) -> None:
-    """Execute SQL statement with proper error handling"""
+def execute_sql(statement: str, params: Dict[str, Any] = None, raise_errors: bool = False) -> None:
+    """Execute SQL statement with proper error handling
+
+    Failures are logged and swallowed unless raise_errors is set, in which
+    case they (and a missing configuration) raise DatabaseError.
+    """
     if not _connection_available():
+        if raise_errors:
+            raise DatabaseError("Database connection not available - check WAREHOUSE_ID and ENABLE_LOGGING")
         logger.warning("SQL execution skipped - database not configured")
         return
     
@@ -123,8 +155,9 @@ def execute_sql(statement: str, params: Dict[str, Any] = None) -> None:
                 logger.debug(f"Executed SQL: {statement[:100]}...")
     except Exception as e:
         logger.error(f"SQL execution failed: {e}")
+        if raise_errors:
+            raise DatabaseError(f"SQL execution failed: {e}")
         # Don't raise exception to prevent app crashes
-        pass
 
 def query_sql(query: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
     """Execute SQL query and return results as list of dictionaries"""
@@ -263,22 +296,71 @@ def update_conversation_title(conv_id: str, new_title: str):
     execute_sql(sql)
     logger.debug(f"Updated conversation title: {conv_id} -> {new_title}")
 
+def upsert_conversation_summary(conv_id: str, summary: str, covered_messages: int):
+    """Store the rolling summary of a conversation's earlier turns"""
+    if not _connection_available():
+        return
+    
+    sql = f"""
+    MERGE INTO {fqn('conversation_summaries')} AS target
+    USING (
+        SELECT 
+            {_escape_sql_string(conv_id)} as conversation_id,
+            {_escape_sql_string(summary)} as summary,
+            {int(covered_messages)} as covered_messages,
+            current_timestamp() as updated_at
+    ) AS source
+    ON target.conversation_id = source.conversation_id
+    WHEN MATCHED THEN
+        UPDATE SET summary = source.summary, covered_messages = source.covered_messages, updated_at = source.updated_at
+    WHEN NOT MATCHED THEN
+        INSERT (conversation_id, summary, covered_messages, updated_at)
+        VALUES (source.conversation_id, source.summary, source.covered_messages, source.updated_at)
+    """
+    execute_sql(sql)
+    logger.debug(f"Updated conversation summary: {conv_id} covers {covered_messages} messages")
+
+def fetch_conversation_summary(conv_id: str) -> Dict[str, Any]:
+    """Fetch the rolling summary of a conversation"""
+    if not _connection_available():
+        return {}
+    
+    query = f"""
+    SELECT summary, covered_messages
+    FROM {fqn('conversation_summaries')}
+    WHERE conversation_id = {_escape_sql_string(conv_id)}
+    LIMIT 1
+    """
+    
+    results = query_sql(query)
+    return results[0] if results else {}
+
 def log_message(
     conv_id: str, 
     role: str, 
     content: str, 
     tokens_in: int = 0, 
     tokens_out: int = 0, 
-    status: str = "ok"
+    status: str = "ok",
+    token_count: Optional[int] = None,
+    token_counter: Optional[str] = None
 ):
-    """Log a message to the database"""
+    """Log a message to the database
+    
+    token_count is the message's own token count under token_counter (the
+    tokenizer name); it is stored only when PERSIST_TOKEN_COUNTS is enabled.
+    """
     if not _connection_available():
         return
         
     message_id = str(uuid.uuid4())
+    count_columns, count_values = "", ""
+    if PERSIST_TOKEN_COUNTS and token_count is not None:
+        count_columns = ", token_count, token_counter"
+        count_values = f", {int(token_count)}, {_escape_sql_string(token_counter)}"
     sql = f"""
     INSERT INTO {fqn('messages')} 
-    (message_id, conversation_id, role, content, tool_invocations, tokens_in, tokens_out, created_at, status)
+    (message_id, conversation_id, role, content, tool_invocations, tokens_in, tokens_out, created_at, status{count_columns})
     VALUES (
         {_escape_sql_string(message_id)},
         {_escape_sql_string(conv_id)},
@@ -288,12 +370,91 @@ def log_message(
         {tokens_in},
         {tokens_out},
         current_timestamp(),
-        {_escape_sql_string(status)}
+        {_escape_sql_string(status)}{count_values}
     )
     """
     execute_sql(sql)
     logger.debug(f"Logged message: {role} in {conv_id}")
 
+def model_prices(model: Optional[str] = None) -> Tuple[float, float, float]:
+    """Prompt, completion and cached-prompt prices per 1K tokens for an endpoint
+    
+    MODEL_PRICES overrides the global PRICE_* settings per endpoint.
+    """
+    if model and model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    return PRICE_PROMPT_PER_1K, PRICE_COMPLETION_PER_1K, PRICE_CACHED_PROMPT_PER_1K
+
+def estimate_cost(tokens_in: int, tokens_out: int, cached_tokens: int = 0, model: Optional[str] = None,
+                  cache_write_tokens: int = 0) -> float:
+    """Estimate the cost of a model call from its token usage
+    
+    tokens_in counts every prompt token, as normalized by
+    model_serving_utils.usage_breakdown: cached_tokens of them were read
+    from the prompt cache and cache_write_tokens written to it.
+    """
+    prompt_price, completion_price, cached_price = model_prices(model)
+    uncached = max(0, tokens_in - cached_tokens - cache_write_tokens)
+    return (
+        (uncached / 1000.0) * prompt_price
+        + (cached_tokens / 1000.0) * cached_price
+        + (cache_write_tokens / 1000.0) * prompt_price * PRICE_CACHE_WRITE_MULTIPLIER
+        + (tokens_out / 1000.0) * completion_price
+    )
+
+def _usage_values(
+    conv_id: str,
+    user_id: str,
+    model: str,
+    tokens_in: int,
+    tokens_out: int,
+    email: Optional[str] = None,
+    sql_user: Optional[str] = None,
+    cache_hit: bool = False,
+    cached_tokens: int = 0,
+    meta: Optional[Dict[str, Any]] = None,
+    cache_write_tokens: int = 0,
+    estimated: bool = False
+) -> Tuple[str, float]:
+    """Build the VALUES tuple for one usage event and return it with its cost"""
+    # Calculate cost
+    if cache_hit:
+        cost = 0.0
+    else:
+        cost = estimate_cost(tokens_in, tokens_out, cached_tokens, model=model, cache_write_tokens=cache_write_tokens)
+    
+    # Build metadata
+    meta_parts = []
+    if email:
+        meta_parts.append(f"'email', {_escape_sql_string(email)}")
+    if sql_user:
+        meta_parts.append(f"'sql_user', {_escape_sql_string(sql_user)}")
+    if cache_hit:
+        meta_parts.append("'cache_hit', 'true'")
+    if cached_tokens:
+        meta_parts.append(f"'cached_tokens', '{int(cached_tokens)}'")
+    if cache_write_tokens:
+        meta_parts.append(f"'cache_write_tokens', '{int(cache_write_tokens)}'")
+    if estimated:
+        meta_parts.append("'usage_estimated', 'true'")
+    for key, value in (meta or {}).items():
+        meta_parts.append(f"{_escape_sql_string(str(key))}, {_escape_sql_string(str(value))}")
+    
+    meta_expr = f"map({', '.join(meta_parts)})" if meta_parts else "map()"
+    
+    values = f"""(
+            {_escape_sql_string(str(uuid.uuid4()))},
+            {_escape_sql_string(conv_id)},
+            {_escape_sql_string(user_id)},
+            {_escape_sql_string(model)},
+            {int(tokens_in)},
+            {int(tokens_out)},
+            {cost},
+            current_timestamp(),
+            {meta_expr}
+        )"""
+    return values, cost
+
 def log_usage(
     conv_id: str, 
     user_id: str, 
@@ -301,40 +462,32 @@ def log_usage(
     tokens_in: int, 
     tokens_out: int, 
     email: Optional[str] = None, 
-    sql_user: Optional[str] = None
+    sql_user: Optional[str] = None,
+    cache_hit: bool = False,
+    cached_tokens: int = 0,
+    cache_write_tokens: int = 0,
+    estimated: bool = False
 ):
-    """Log usage metrics to the database"""
+    """Log usage metrics to the database
+    
+    Replies served from the response cache are logged as zero-cost events;
+    prompt tokens read from the endpoint's prompt cache are priced at the
+    cached-prompt rate (see model_prices). Token counts estimated locally,
+    for endpoints that report no usage, are tagged usage_estimated.
+    """
     if not _connection_available():
         return
         
     try:
-        # Calculate cost
-        cost = (tokens_in / 1000.0) * PRICE_PROMPT_PER_1K + (tokens_out / 1000.0) * PRICE_COMPLETION_PER_1K
-        
-        # Build metadata
-        meta_parts = []
-        if email:
-            meta_parts.append(f"'email', {_escape_sql_string(email)}")
-        if sql_user:
-            meta_parts.append(f"'sql_user', {_escape_sql_string(sql_user)}")
-        
-        meta_expr = f"map({', '.join(meta_parts)})" if meta_parts else "map()"
-        
-        event_id = str(uuid.uuid4())
+        values, cost = _usage_values(
+            conv_id, user_id, model, tokens_in, tokens_out,
+            email=email, sql_user=sql_user, cache_hit=cache_hit, cached_tokens=cached_tokens,
+            cache_write_tokens=cache_write_tokens, estimated=estimated,
+        )
         sql = f"""
         INSERT INTO {fqn('usage_events')} 
         (event_id, conversation_id, user_id, model, tokens_in, tokens_out, cost, created_at, meta)
-        VALUES (
-            {_escape_sql_string(event_id)},
-            {_escape_sql_string(conv_id)},
-            {_escape_sql_string(user_id)},
-            {_escape_sql_string(model)},
-            {tokens_in},
-            {tokens_out},
-            {cost},
-            current_timestamp(),
-            {meta_expr}
-        )
+        VALUES {values}
         """
         execute_sql(sql)
         logger.debug(f"Logged usage: {tokens_in}+{tokens_out} tokens, ${cost:.4f}")
@@ -342,6 +495,35 @@ def log_usage(
     except Exception as e:
         logger.error(f"Failed to log usage: {e}")
 
+def log_usage_batch(events: List[Dict[str, Any]], chunk_size: int = 500) -> int:
+    """Log many usage events with multi-row INSERTs
+    
+    Each event has the keyword arguments of log_usage plus an optional
+    "meta" dict of extra string tags. Stops at the first chunk that fails
+    and returns the number of events written, so a result below
+    len(events) means only that many leading events were stored.
+    """
+    if not _connection_available() or not events:
+        return 0
+    
+    written = 0
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        try:
+            rows = [_usage_values(**event)[0] for event in chunk]
+            sql = f"""
+            INSERT INTO {fqn('usage_events')} 
+            (event_id, conversation_id, user_id, model, tokens_in, tokens_out, cost, created_at, meta)
+            VALUES {", ".join(rows)}
+            """
+            execute_sql(sql, raise_errors=True)
+            written += len(chunk)
+        except Exception as e:
+            logger.error(f"Failed to log usage batch: {e}")
+            break
+    logger.debug(f"Logged {written} usage events in bulk")
+    return written
+
 def list_conversations(
     user_id: Optional[str], 
     search: str = "", 
@@ -424,8 +606,9 @@ def fetch_conversation_messages(conv_id: str) -> List[Dict[str, Any]]:
     if not _connection_available():
         return []
     
+    count_columns = ", token_count, token_counter" if PERSIST_TOKEN_COUNTS else ""
     query = f"""
-    SELECT role, content, created_at, tokens_in, tokens_out, status
+    SELECT role, content, created_at, tokens_in, tokens_out, status{count_columns}
     FROM {fqn('messages')}
     WHERE conversation_id = {_escape_sql_string(conv_id)}
     ORDER BY created_at ASC
@@ -456,6 +639,7 @@ def delete_conversation(conv_id: str):
     try:
         # Delete in order due to foreign key constraints
         execute_sql(f"DELETE FROM {fqn('usage_events')} WHERE conversation_id = {_escape_sql_string(conv_id)}")
+        execute_sql(f"DELETE FROM {fqn('conversation_summaries')} WHERE conversation_id = {_escape_sql_string(conv_id)}")
         execute_sql(f"DELETE FROM {fqn('messages')} WHERE conversation_id = {_escape_sql_string(conv_id)}")
         execute_sql(f"DELETE FROM {fqn('conversations')} WHERE conversation_id = {_escape_sql_string(conv_id)}")
         
@@ -0,0 +1,4 @@
+-- One-off migration: per-message token counts (PERSIST_TOKEN_COUNTS=1)
+-- Run once on installs whose shared.app.messages table predates these
+-- columns; new installs get them from databricks_schema.sql.
+ALTER TABLE shared.app.messages ADD COLUMNS (token_count INT, token_counter STRING);
@@ -1,6 +1,272 @@
 # model_serving_utils.py
-from typing import List, Dict, Any, Tuple
-from mlflow.deployments import get_deploy_client
+import os
+import json
+import time
+import random
+import logging
+import threading
+import weakref
+from typing import List, Dict, Any, Tuple, Iterable, Iterator, Optional, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from databricks.sdk.core import Config
+
+import response_cache
+from serving_limiter import limiter, QueueTimeout
+
+logger = logging.getLogger(__name__)
+
+# HTTP client configuration
+CONNECT_TIMEOUT = float(os.getenv("MODEL_CONNECT_TIMEOUT", "10") or "10")
+READ_TIMEOUT = float(os.getenv("MODEL_READ_TIMEOUT", "120") or "120")
+POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", "10") or "10")
+
+# Optional base URL of a local OpenAI/Databricks-compatible server (e.g.
+# tools/mock_serving_endpoint.py); requests then skip workspace auth
+SERVING_BASE_URL = os.getenv("SERVING_BASE_URL", "").rstrip("/")
+
+# Prompt caching: endpoints that accept cache-control hints (default: Claude)
+PROMPT_CACHE_ENDPOINTS = {x.strip() for x in os.getenv("PROMPT_CACHE_ENDPOINTS", "").split(",") if x.strip()}
+PROMPT_CACHE_MIN_CHARS = int(os.getenv("PROMPT_CACHE_MIN_CHARS", "4096") or "4096")
+PROMPT_CACHE_MAX_BREAKPOINTS = 4
+
+# Retries on throttling and transient failures
+MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "2") or "2")
+BACKOFF_BASE_SECONDS = float(os.getenv("MODEL_BACKOFF_BASE", "0.5") or "0.5")
+BACKOFF_MAX_SECONDS = float(os.getenv("MODEL_BACKOFF_MAX", "8") or "8")
+
+# Process-wide workspace config and per-endpoint keep-alive sessions
+_config: Optional[Config] = None
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+class EndpointError(Exception):
+    """Raised when a serving endpoint returns an error response"""
+
+    def __init__(self, endpoint_name: str, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{endpoint_name} returned {status_code}: {message}")
+        self.endpoint_name = endpoint_name
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check if an error is transient (throttling, server error, timeout)"""
+    if isinstance(error, EndpointError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+def _get_config() -> Config:
+    """Resolve workspace host and credentials once per process"""
+    global _config
+    if _config is None:
+        with _lock:
+            if _config is None:
+                _config = Config()
+    return _config
+
+def _base_url_and_headers() -> Tuple[str, Dict[str, str]]:
+    """Resolve the serving base URL and auth headers for a request"""
+    if SERVING_BASE_URL:
+        return SERVING_BASE_URL, {}
+    config = _get_config()
+    return config.host.rstrip("/"), config.authenticate()
+
+def _get_session(endpoint_name: str) -> requests.Session:
+    """Get the pooled keep-alive session for an endpoint"""
+    session = _sessions.get(endpoint_name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(endpoint_name)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[endpoint_name] = session
+    return session
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+def _post_invocation(endpoint_name: str, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+    """POST a payload to an endpoint's invocations API"""
+    base_url, headers = _base_url_and_headers()
+    url = f"{base_url}/serving-endpoints/{endpoint_name}/invocations"
+    resp = _get_session(endpoint_name).post(
+        url,
+        json=payload,
+        headers=headers,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        stream=stream,
+    )
+    if resp.status_code >= 400:
+        try:
+            body = resp.json()
+            message = body.get("message") or body.get("error") or resp.text
+        except ValueError:
+            message = resp.text
+        resp.close()
+        raise EndpointError(endpoint_name, resp.status_code, str(message)[:500],
+                            retry_after=_parse_retry_after(resp.headers.get("Retry-After")))
+    return resp
+
+def get_endpoint_state(endpoint_name: str) -> Dict[str, Any]:
+    """Fetch an endpoint's readiness and served entity states"""
+    base_url, headers = _base_url_and_headers()
+    url = f"{base_url}/api/2.0/serving-endpoints/{endpoint_name}"
+    resp = _get_session(endpoint_name).get(url, headers=headers, timeout=(CONNECT_TIMEOUT, CONNECT_TIMEOUT))
+    if resp.status_code >= 400:
+        raise EndpointError(endpoint_name, resp.status_code, resp.text[:500])
+    return resp.json()
+
+def _should_retry(error: Exception) -> bool:
+    """Retry throttling, server errors and failed connections (not read timeouts)"""
+    if isinstance(error, EndpointError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, requests.ConnectionError)
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> Optional[float]:
+    """Exponential backoff with full jitter, honoring Retry-After when given
+
+    Returns None when the server asks for a longer wait than
+    BACKOFF_MAX_SECONDS, so the caller fails (and fails over) instead of
+    blocking the session.
+    """
+    if retry_after is not None:
+        if retry_after > BACKOFF_MAX_SECONDS:
+            return None
+        return min(BACKOFF_MAX_SECONDS, retry_after + random.uniform(0, BACKOFF_BASE_SECONDS))
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+class AdmissionSlot:
+    """An endpoint slot taken from the limiter, released exactly once"""
+
+    def __init__(self, endpoint_name: str):
+        self.endpoint_name = endpoint_name
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        limiter.release(self.endpoint_name)
+
+def _invoke(endpoint_name: str, payload: Dict[str, Any],
+            stream: bool = False) -> Tuple[requests.Response, Optional[AdmissionSlot]]:
+    """POST through the endpoint's admission queue, retrying transient errors
+
+    For streams the endpoint slot is returned with the response; release it
+    when the body has been read or abandoned. Garbage collection of the
+    response only releases it as a backstop.
+    """
+    attempt = 0
+    while True:
+        try:
+            limiter.acquire(endpoint_name)
+        except QueueTimeout as e:
+            raise EndpointError(endpoint_name, 429, str(e))
+        slot = AdmissionSlot(endpoint_name)
+        
+        try:
+            resp = _post_invocation(endpoint_name, payload, stream=stream)
+        except Exception as e:
+            slot.release()
+            if attempt >= MAX_RETRIES or not _should_retry(e):
+                raise
+            delay = _backoff_delay(attempt, getattr(e, "retry_after", None))
+            if delay is None:
+                raise
+            logger.warning(f"Retrying {endpoint_name} in {delay:.2f}s after: {e}")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        
+        if not stream:
+            slot.release()
+            return resp, None
+        weakref.finalize(resp, slot.release)
+        return resp, slot
+
+def _iter_sse_chunks(resp: requests.Response, slot: Optional[AdmissionSlot] = None) -> Iterator[Dict[str, Any]]:
+    """Decode server-sent event chunks from a streaming response"""
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            yield json.loads(data)
+    finally:
+        resp.close()
+        if slot is not None:
+            slot.release()
+
+def supports_prompt_caching(endpoint_name: str) -> bool:
+    """Check if an endpoint accepts prompt cache-control hints"""
+    if PROMPT_CACHE_ENDPOINTS:
+        return "*" in PROMPT_CACHE_ENDPOINTS or endpoint_name in PROMPT_CACHE_ENDPOINTS
+    return "claude" in endpoint_name.lower()
+
+def _apply_cache_control(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Mark stable prefixes (system prompt, attached documents) as cacheable
+
+    Large system and user messages are tagged as cache breakpoints, most
+    recent first, up to the endpoint's breakpoint limit. The latest message
+    is included, so the turn that uploads a document writes the cache and
+    later turns, which resend it unchanged, read it.
+    """
+    marked = [dict(m) for m in messages]
+    breakpoints = 0
+    for m in reversed(marked):
+        if breakpoints >= PROMPT_CACHE_MAX_BREAKPOINTS:
+            break
+        content = m.get("content")
+        if m.get("role") in ("system", "user") and isinstance(content, str) and len(content) >= PROMPT_CACHE_MIN_CHARS:
+            m["content"] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+            breakpoints += 1
+    return marked
+
+def usage_breakdown(usage: Dict[str, Any]) -> Tuple[int, int, int, int]:
+    """(uncached prompt, cache read, cache write, completion) tokens of endpoint usage
+
+    OpenAI-style usage counts cache reads and writes inside prompt_tokens;
+    Anthropic-style usage has no prompt_tokens, and its input_tokens leave
+    out cache_read_input_tokens and cache_creation_input_tokens.
+    """
+    if not isinstance(usage, dict):
+        return 0, 0, 0, 0
+    details = usage.get("prompt_tokens_details") or {}
+    read = int(details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0)
+    write = int(usage.get("cache_creation_input_tokens") or 0)
+    out = int(usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+    if "prompt_tokens" in usage:
+        uncached = max(0, int(usage.get("prompt_tokens") or 0) - read - write)
+    else:
+        uncached = int(usage.get("input_tokens") or 0)
+    return uncached, read, write, out
+
+def _normalize_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite endpoint usage in one shape: prompt_tokens includes cached_tokens and cache_write_tokens"""
+    if not isinstance(usage, dict):
+        return {}
+    uncached, read, write, out = usage_breakdown(usage)
+    return {
+        **usage,
+        "prompt_tokens": uncached + read + write,
+        "completion_tokens": out,
+        "cached_tokens": read,
+        "cache_write_tokens": write,
+    }
+
+def _request_messages(endpoint_name: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return _apply_cache_control(messages) if supports_prompt_caching(endpoint_name) else messages
 
 def _parse_last_message(res: Dict[str, Any]) -> Dict[str, Any]:
     if isinstance(res, dict):
@@ -12,9 +278,113 @@ def _parse_last_message(res: Dict[str, Any]) -> Dict[str, Any]:
             return {"role":"assistant","content":res["output_text"]}
     return {"role":"assistant","content":str(res)}
 
-def query_endpoint_with_usage(endpoint_name: str, messages: List[Dict[str, Any]], max_tokens: int = 400) -> Tuple[Dict[str, Any], Dict[str, Any]]:
-    client = get_deploy_client("databricks")
-    res = client.predict(endpoint=endpoint_name, inputs={"messages": messages, "max_tokens": max_tokens})
+def _parse_delta(chunk: Dict[str, Any]) -> str:
+    """Extract the text delta from a streaming chat completion chunk"""
+    if not isinstance(chunk, dict) or not chunk.get("choices"):
+        return ""
+    delta = chunk["choices"][0].get("delta") or {}
+    content = delta.get("content")
+    if isinstance(content, list):
+        # Some endpoints stream content as a list of typed parts
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content or ""
+
+class ResponseStream:
+    """Iterable of text deltas from a chat completion.
+
+    Iterate it (e.g. with ``st.write_stream``) to consume the reply. Once
+    exhausted, ``text`` holds the full reply and ``usage`` the token usage
+    reported by the endpoint in the final chunk. If the endpoint reports
+    none, ``estimate_usage(text)``, when set, fills it in with an estimate
+    flagged "estimated". Call ``close`` on a stream that may not be read
+    to the end, so its endpoint slot is returned.
+    """
+
+    def __init__(self, chunks: Iterable[Dict[str, Any]],
+                 on_complete: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 on_close: Optional[Callable[[], None]] = None):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self.endpoint_name = ""
+        self.routing_reason = ""
+        self.prompt_chars = 0
+        self.estimate_usage: Optional[Callable[[str], Dict[str, Any]]] = None
+        self.text = ""
+        self.usage: Dict[str, Any] = {}
+
+    @classmethod
+    def from_reply(cls, text: str, usage: Dict[str, Any]) -> "ResponseStream":
+        """Wrap an already completed reply as a single-chunk stream"""
+        return cls([{"choices": [{"delta": {"content": text}}], "usage": usage}])
+
+    def __iter__(self) -> Iterator[str]:
+        parts = []
+        for chunk in self._chunks:
+            if isinstance(chunk, dict) and chunk.get("usage"):
+                self.usage = _normalize_usage(chunk["usage"])
+            delta = _parse_delta(chunk)
+            if delta:
+                parts.append(delta)
+                yield delta
+        self.text = "".join(parts)
+        if not self.usage and self.estimate_usage:
+            self.usage = self.estimate_usage(self.text)
+        if self._on_complete:
+            self._on_complete(self.text, self.usage)
+
+    def close(self):
+        """Stop reading the reply and release the connection and endpoint slot"""
+        if hasattr(self._chunks, "close"):
+            self._chunks.close()
+        # A generator that never started skips its finally block, so release directly too
+        if self._on_close:
+            self._on_close()
+
+def query_endpoint_with_usage(endpoint_name: str, messages: List[Dict[str, Any]], max_tokens: int = 400,
+                              use_cache: bool = True) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    cache_key = None
+    if use_cache and response_cache.is_enabled(endpoint_name):
+        cache_key = response_cache.make_key(endpoint_name, messages, {"max_tokens": max_tokens})
+        cached = response_cache.cache.get(cache_key)
+        if cached is not None:
+            return dict(cached), response_cache.cached_usage()
+    
+    resp, _ = _invoke(endpoint_name, {"messages": _request_messages(endpoint_name, messages), "max_tokens": max_tokens})
+    res = resp.json()
     last = _parse_last_message(res)
-    usage = res.get("usage", {}) if isinstance(res, dict) else {}
+    usage = _normalize_usage(res.get("usage", {})) if isinstance(res, dict) else {}
+    if cache_key:
+        response_cache.cache.put(cache_key, dict(last))
     return last, usage
+
+def stream_endpoint_with_usage(endpoint_name: str, messages: List[Dict[str, Any]], max_tokens: int = 400) -> ResponseStream:
+    """Query an endpoint through its streaming chat API.
+
+    The request is sent immediately so HTTP errors surface here; the body
+    is read as the returned stream is iterated.
+    """
+    on_complete = None
+    if response_cache.is_enabled(endpoint_name):
+        cache_key = response_cache.make_key(endpoint_name, messages, {"max_tokens": max_tokens})
+        cached = response_cache.cache.get(cache_key)
+        if cached is not None:
+            stream = ResponseStream.from_reply(cached.get("content", ""), response_cache.cached_usage())
+            stream.endpoint_name = endpoint_name
+            return stream
+        
+        def on_complete(text: str, usage: Dict[str, Any]):
+            response_cache.cache.put(cache_key, {"role": "assistant", "content": text})
+    
+    # OpenAI-compatible endpoints only send a usage chunk when asked
+    payload = {"messages": _request_messages(endpoint_name, messages), "max_tokens": max_tokens, "stream": True,
+               "stream_options": {"include_usage": True}}
+    resp, slot = _invoke(endpoint_name, payload, stream=True)
+
+    def on_close():
+        resp.close()
+        slot.release()
+
+    stream = ResponseStream(_iter_sse_chunks(resp, slot), on_complete=on_complete, on_close=on_close)
+    stream.endpoint_name = endpoint_name
+    return stream
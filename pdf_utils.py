@@ -0,0 +1,120 @@
+# pdf_utils.py - Page-parallel PDF text extraction
+#
+# Kept free of Streamlit and services imports: pool workers import this
+# module on start-up.
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Extraction processes (0 = one per CPU, at most 4)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0") or "0") or min(4, os.cpu_count() or 1)
+# Pages extracted per task
+PDF_PAGE_BATCH = int(os.getenv("PDF_PAGE_BATCH", "8") or "8")
+# Smaller documents are extracted in-process
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32") or "32")
+
+def _extract_pages(path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) of the PDF at path (runs in a pool worker)
+
+    The document is opened per task, which is cheap next to get_text, so no
+    worker keeps the temporary file open after it has been removed.
+    """
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    # Not plain fork: the app process runs many threads. A fork server
+    # preloading this module makes later worker starts cheap.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context)
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def iter_pdf_pages(file, stats: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """Yield the text of each page of an uploaded PDF, in order
+
+    The upload is spooled to a temporary file that pool workers open
+    themselves, and at most two batches per worker are in flight ahead of
+    the consumer. Closing the generator early (e.g. once a token budget is
+    met) cancels the remaining pages. stats, if given, receives pages,
+    total_pages, seconds and pages_per_s.
+    """
+    started = time.monotonic()
+    pages = total = 0
+    pending: Deque[Future] = deque()
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(file, out, 1 << 20)
+
+        with fitz.open(path) as doc:
+            total = doc.page_count
+            if total < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+                for page in doc:
+                    yield page.get_text()
+                    pages += 1
+                return
+
+        try:
+            pool = _get_pool()
+            batches = iter(range(0, total, PDF_PAGE_BATCH))
+            for start in batches:
+                pending.append(pool.submit(_extract_pages, path, start, min(start + PDF_PAGE_BATCH, total)))
+                if len(pending) >= 2 * PDF_WORKERS:
+                    break
+            while pending:
+                texts = pending.popleft().result()
+                start = next(batches, None)
+                if start is not None:
+                    pending.append(pool.submit(_extract_pages, path, start, min(start + PDF_PAGE_BATCH, total)))
+                for text in texts:
+                    yield text
+                    pages += 1
+        except Exception as e:
+            # A broken pool (e.g. a worker killed) falls back to the remaining pages in-process
+            if pages >= total:
+                raise
+            logger.warning(f"Parallel PDF extraction failed, continuing in-process: {e}")
+            for future in pending:
+                future.cancel()
+            pending.clear()
+            _reset_pool()
+            with fitz.open(path) as doc:
+                for i in range(pages, total):
+                    yield doc[i].get_text()
+                    pages += 1
+    finally:
+        for future in pending:
+            future.cancel()
+        os.remove(path)
+        if stats is not None:
+            seconds = time.monotonic() - started
+            stats.update(pages=pages, total_pages=total, seconds=seconds,
+                         pages_per_s=pages / seconds if seconds > 0 else 0.0)
@@ -0,0 +1,83 @@
+# response_cache.py - Opt-in exact-match cache for model responses
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Comma-separated endpoint names to cache, or "*" for every endpoint
+CACHE_ENDPOINTS = {x.strip() for x in os.getenv("RESPONSE_CACHE_ENDPOINTS", "").split(",") if x.strip()}
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512") or "512")
+CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600") or "3600")
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry time-to-live"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a live entry and mark it most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: Any):
+        """Store an entry, evicting expired then least recently used ones"""
+        with self._lock:
+            now = time.monotonic()
+            self._entries[key] = (now + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            for k in [k for k, (expires, _) in self._entries.items() if expires < now]:
+                del self._entries[k]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# Process-wide cache shared by all sessions
+cache = ResponseCache(CACHE_SIZE, CACHE_TTL_SECONDS)
+
+def is_enabled(endpoint_name: str) -> bool:
+    """Check if responses from an endpoint may be cached"""
+    return "*" in CACHE_ENDPOINTS or endpoint_name in CACHE_ENDPOINTS
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return content.replace("\r\n", "\n").strip()
+    return content
+
+def make_key(endpoint_name: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    """Build a cache key from the endpoint, normalized messages and generation parameters"""
+    payload = {
+        "endpoint": endpoint_name,
+        "messages": [
+            {"role": str(m.get("role", "")).lower(), "content": _normalize_content(m.get("content"))}
+            for m in messages
+        ],
+        "params": params,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def cached_usage() -> Dict[str, Any]:
+    """Usage reported for a reply served from the cache"""
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0, "cache_hit": True}
@@ -1,5 +1,6 @@
 # services/app_state.py - Centralized application state management
 import uuid
+from concurrent.futures import Future
 from typing import Dict, Any, List, Optional
 import streamlit as st
 
@@ -15,6 +16,8 @@ class AppStateManager:
         self._init_conversation_state()
         self._init_navigation_state()
         self._init_model_endpoints()
+        self.apply_pending_title()
+        self.apply_pending_summary()
     
     def _init_conversation_state(self):
         """Initialize conversation-related state"""
@@ -24,6 +27,17 @@ class AppStateManager:
             self.state.conv_id = str(uuid.uuid4())
         if "chat_title" not in self.state:
             self.state.chat_title = ""
+        if "pending_title" not in self.state:
+            self.state.pending_title = None
+        if "summary" not in self.state:
+            self.state.summary = {"text": "", "covered": 0}
+        if "pending_summary" not in self.state:
+            self.state.pending_summary = None
+        if "document_index" not in self.state:
+            self.state.document_index = None
+            self.state.document_upload_key = ""
+        if "upload_generation" not in self.state:
+            self.state.upload_generation = 0
     
     def _init_navigation_state(self):
         """Initialize navigation state"""
@@ -57,15 +71,27 @@ class AppStateManager:
         """Get conversation messages"""
         return self.state.messages
     
-    def add_message(self, role: str, content: str):
-        """Add a message to the conversation"""
-        self.state.messages.append({"role": role, "content": content})
+    def add_message(self, role: str, content: str, **details: Any):
+        """Add a message to the conversation
+        
+        Extra details (e.g. served_by, routing_reason) are kept for display
+        only; the model sees role and content. A user message's
+        retrieved_context is sent with it on its own turn only.
+        """
+        message = {"role": role, "content": content}
+        message.update({k: v for k, v in details.items() if v})
+        self.state.messages.append(message)
     
     def clear_conversation(self):
         """Clear current conversation"""
         self.state.messages = []
         self.state.conv_id = str(uuid.uuid4())
         self.state.chat_title = ""
+        self.state.pending_title = None
+        self.state.summary = {"text": "", "covered": 0}
+        self.state.pending_summary = None
+        self.clear_document_index()
+        self.state.compare_runs = []
     
     def get_conversation_id(self) -> str:
         """Get current conversation ID"""
@@ -83,13 +109,90 @@ class AppStateManager:
         """Set chat title"""
         self.state.chat_title = title
     
-    def load_conversation(self, conv_id: str, title: str, messages: List[Dict[str, Any]]):
+    def load_conversation(self, conv_id: str, title: str, messages: List[Dict[str, Any]],
+                          summary: Optional[Dict[str, Any]] = None):
         """Load a conversation from history"""
         self.state.conv_id = conv_id
         self.state.chat_title = title
         self.state.messages = messages
+        self.state.pending_title = None
+        self.state.summary = summary or {"text": "", "covered": 0}
+        self.state.pending_summary = None
+        self.state.compare_runs = []
         self.navigate_to("chat")
     
+    def set_pending_title(self, conv_id: str, future: Future):
+        """Track a title being generated in the background"""
+        self.state.pending_title = {"conv_id": conv_id, "future": future}
+    
+    def has_pending_title(self) -> bool:
+        """Check if a background title is still being generated"""
+        return self.state.pending_title is not None
+    
+    def apply_pending_title(self) -> bool:
+        """Apply a finished background title to the current conversation"""
+        pending = self.state.get("pending_title")
+        if not pending or not pending["future"].done():
+            return False
+        
+        self.state.pending_title = None
+        if pending["conv_id"] != self.state.conv_id or pending["future"].exception():
+            return False
+        
+        self.state.chat_title = pending["future"].result()
+        return True
+    
+    def get_summary(self) -> Dict[str, Any]:
+        """Get the rolling summary of earlier turns ({"text", "covered"})"""
+        return self.state.summary
+    
+    def set_pending_summary(self, conv_id: str, future: Future):
+        """Track a summary being updated in the background"""
+        self.state.pending_summary = {"conv_id": conv_id, "future": future}
+    
+    def has_pending_summary(self) -> bool:
+        """Check if the rolling summary is still being updated"""
+        return self.state.pending_summary is not None
+    
+    def apply_pending_summary(self) -> bool:
+        """Apply a finished background summary to the current conversation"""
+        pending = self.state.get("pending_summary")
+        if not pending or not pending["future"].done():
+            return False
+        
+        self.state.pending_summary = None
+        if pending["conv_id"] != self.state.conv_id or pending["future"].exception():
+            return False
+        
+        self.state.summary = pending["future"].result()
+        return True
+    
+    # Document retrieval methods
+    def get_document_index(self):
+        """Get the retrieval index of the uploaded document, if any"""
+        return self.state.get("document_index")
+    
+    def set_document_index(self, index, upload_key: str = ""):
+        """Answer the following questions from passages of this document index
+        
+        upload_key is the session flag marking the upload as processed.
+        """
+        self.state.document_index = index
+        self.state.document_upload_key = upload_key
+    
+    def clear_document_index(self):
+        """Stop retrieving from the uploaded document; a file still in the uploader is indexed again"""
+        if self.state.get("document_upload_key"):
+            self.state.pop(self.state.document_upload_key, None)
+        self.state.document_index = None
+        self.state.document_upload_key = ""
+    
+    def reset_upload(self):
+        """Forget the uploaded document and empty the file uploader"""
+        self.clear_document_index()
+        self.state.pop("file_context", None)
+        self.state.upload_generation = self.state.get("upload_generation", 0) + 1
+    
     # Model endpoint methods
     def get_selected_endpoint(self) -> str:
         """Get currently selected model endpoint"""
@@ -110,19 +213,8 @@ class AppStateManager:
     
     def is_new_conversation(self) -> bool:
         """Check if this is a new conversation"""
-        return self.state.chat_title == "New Conversation" and len(self.state.messages) >= 2
-    
-    def get_model_key(self) -> str:
-        """Get simplified model identifier for token context handling"""
-        endpoint = self.get_selected_endpoint().lower()
-
-        if "claude" in endpoint:
-            return "claude"
-        elif "gemma" in endpoint:
-            return "gemma"
-        elif "llama" in endpoint:
-            return "llama"
-        elif "gpt" in endpoint:
-            return "gpt"
-        else:
-            return "default"
+        return (
+            self.state.chat_title in ("", "New Conversation") and
+            len(self.state.messages) >= 2 and
+            not self.has_pending_title()
+        )
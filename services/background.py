@@ -0,0 +1,59 @@
+# services/background.py - Shared background task executor
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Process-wide pool for work that must not block a Streamlit rerun
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BACKGROUND_WORKERS", "4") or "4"),
+    thread_name_prefix="background",
+)
+
+def submit(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run a function in the background pool
+
+    The caller's script run context is attached to the worker thread so that
+    session-scoped helpers (e.g. forwarded auth headers) keep working.
+    """
+    ctx = get_script_run_ctx()
+
+    def run():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    return _executor.submit(run)
+
+def spawn(fn: Callable[..., Any], *args, name: str = "background-task", **kwargs) -> threading.Thread:
+    """Run a long call (e.g. a model generation) on its own daemon thread
+
+    Unlike submit, this does not occupy a pool worker, so concurrent chat
+    turns are never queued behind titles and summaries.
+    """
+    ctx = get_script_run_ctx()
+
+    def run():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        fn(*args, **kwargs)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def executor(max_workers: int, thread_name_prefix: str = "background") -> ThreadPoolExecutor:
+    """A dedicated pool for a bounded fan-out (e.g. one call per document chunk)
+
+    Its threads carry the caller's script run context, as with submit.
+    """
+    ctx = get_script_run_ctx()
+
+    def attach():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    return ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=thread_name_prefix,
+                              initializer=attach)
@@ -0,0 +1,87 @@
+# services/context_builder.py - Token-budgeted context window construction
+import os
+from typing import Any, Dict, List
+
+from services.token_truncation import (
+    MODEL_TOKEN_LIMITS,
+    count_tokens,
+    count_tokens_batch,
+    model_key_for_endpoint,
+    truncate_head_tail,
+)
+
+# Approximate per-message overhead for role and chat template tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _parse_budgets(csv: str) -> Dict[str, int]:
+    """Parse "endpoint=tokens,endpoint2=tokens" budget overrides"""
+    budgets = {}
+    for token in [x.strip() for x in csv.split(",") if x.strip()]:
+        if "=" in token:
+            name, value = token.split("=", 1)
+            try:
+                budgets[name.strip()] = int(value)
+            except ValueError:
+                continue
+    return budgets
+
+def context_budget(endpoint_name: str, max_tokens: int = 400) -> int:
+    """Prompt token budget for an endpoint, leaving room for the reply"""
+    budgets = _parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", ""))
+    if endpoint_name in budgets:
+        return budgets[endpoint_name]
+    limit = MODEL_TOKEN_LIMITS.get(model_key_for_endpoint(endpoint_name), MODEL_TOKEN_LIMITS["default"])
+    return max(0, limit - max_tokens)
+
+def message_tokens(message: Dict[str, Any], model_key: str = "default") -> int:
+    """Token cost of a single chat message"""
+    return count_tokens(str(message.get("content") or ""), model_key) + MESSAGE_OVERHEAD_TOKENS
+
+def build_context_window(messages: List[Dict[str, Any]], endpoint_name: str,
+                         max_tokens: int = 400) -> List[Dict[str, Any]]:
+    """Pack the most recent turns into the endpoint's token budget
+
+    System messages are always kept first and the latest user message is
+    always included. Older messages are sent whole while they fit; one that
+    does not fit and is larger than CONTEXT_OLD_MESSAGE_TOKENS (typically a
+    file attachment) is cut to its head and tail before any turn is dropped.
+    MAX_TURNS, when set, caps the turn count.
+    """
+    budget = context_budget(endpoint_name, max_tokens)
+    model_key = model_key_for_endpoint(endpoint_name)
+    old_message_cap = int(os.getenv("CONTEXT_OLD_MESSAGE_TOKENS", "4000") or "4000")
+    max_turns = int(os.getenv("MAX_TURNS", "0") or "0")
+
+    system = [{"role": m["role"], "content": m["content"]} for m in messages if m.get("role") == "system"]
+    turns = [m for m in messages if m.get("role") != "system"]
+    if max_turns > 0:
+        turns = turns[-max_turns:]
+
+    used = sum(message_tokens(m, model_key) for m in system)
+    window: List[Dict[str, Any]] = []
+
+    # Uncached turns are encoded in one batch; repeated turns hit the count cache
+    counts = count_tokens_batch([str(m.get("content") or "") for m in turns], model_key)
+
+    for i in range(len(turns) - 1, -1, -1):
+        message = {"role": turns[i]["role"], "content": str(turns[i].get("content") or "")}
+        is_latest = i == len(turns) - 1
+        tokens = counts[i] + MESSAGE_OVERHEAD_TOKENS
+
+        if not is_latest and used + tokens > budget:
+            if tokens - MESSAGE_OVERHEAD_TOKENS > old_message_cap:
+                message["content"] = truncate_head_tail(message["content"], old_message_cap, model_key=model_key)
+                tokens = message_tokens(message, model_key)
+            if used + tokens > budget:
+                break
+
+        window.append(message)
+        used += tokens
+
+    window.reverse()
+
+    # The window must open with a user turn
+    while len(window) > 1 and window[0]["role"] == "assistant":
+        window.pop(0)
+
+    return system + window
@@ -0,0 +1,78 @@
+# services/context_meter.py - Fast prompt-size estimate for the chat context meter
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import db
+from services.context_builder import MESSAGE_OVERHEAD_TOKENS, build_context_window, context_budget
+from services.token_truncation import count_tokens_batch, model_key_for_endpoint
+from services.tokenizer_registry import DEFAULT_CHARS_PER_TOKEN, get_tokenizer
+
+# Above this fraction of the limit the estimate is replaced by an exact count
+EXACT_COUNT_THRESHOLD = float(os.getenv("CONTEXT_METER_EXACT_THRESHOLD", "0.85") or "0.85")
+
+class EndpointCalibration:
+    """Characters-per-token ratio per endpoint, learned from reported prompt_tokens"""
+
+    def __init__(self, weight: float = 0.2):
+        self.weight = weight
+        self._ratios: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ratio(self, endpoint_name: str) -> float:
+        default = DEFAULT_CHARS_PER_TOKEN.get(model_key_for_endpoint(endpoint_name), DEFAULT_CHARS_PER_TOKEN["default"])
+        return self._ratios.get(endpoint_name, default)
+
+    def observe(self, endpoint_name: str, prompt_chars: int, prompt_tokens: int):
+        """Fold in one request's characters sent and prompt_tokens reported"""
+        if prompt_chars <= 0 or prompt_tokens <= 0:
+            return
+        with self._lock:
+            current = self.ratio(endpoint_name)
+            self._ratios[endpoint_name] = current + self.weight * (prompt_chars / prompt_tokens - current)
+
+        # Keep the fallback estimator used for truncation in step as well
+        tokenizer = get_tokenizer(model_key_for_endpoint(endpoint_name))
+        if not tokenizer.cacheable:
+            tokenizer.observe(prompt_chars, prompt_tokens, self.weight)
+
+# Process-wide calibration shared by all sessions
+calibration = EndpointCalibration()
+
+def estimate_tokens(texts: List[str], chars_per_token: float) -> np.ndarray:
+    """Vectorized per-message token estimate, including message overhead"""
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    return np.ceil(lengths / chars_per_token).astype(np.int64) + MESSAGE_OVERHEAD_TOKENS
+
+def measure(endpoint_name: str, messages: List[Dict[str, Any]], attachment: Optional[str] = None,
+            max_tokens: int = 400) -> Dict[str, Any]:
+    """Estimated prompt tokens, limit and projected cost of the next request
+
+    The history goes through build_context_window first, so older turns are
+    capped and dropped exactly as they will be when sent; "trimmed" tells
+    whether anything was. The attachment (or an empty question) is the
+    next user message. The estimate is exact (tokenized) only when it
+    comes close to the limit.
+    """
+    pending = list(messages) + [{"role": "user", "content": attachment or ""}]
+    window = build_context_window(pending, endpoint_name, max_tokens)
+    texts = [str(m.get("content") or "") for m in window]
+    trimmed = sum(map(len, texts)) < sum(len(str(m.get("content") or "")) for m in pending)
+
+    limit = context_budget(endpoint_name, max_tokens)
+    tokens = int(estimate_tokens(texts, calibration.ratio(endpoint_name)).sum()) if texts else 0
+    exact = False
+    if limit and tokens >= EXACT_COUNT_THRESHOLD * limit:
+        counts = count_tokens_batch(texts, model_key_for_endpoint(endpoint_name))
+        tokens = sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(texts)
+        exact = get_tokenizer(model_key_for_endpoint(endpoint_name)).cacheable
+
+    return {
+        "tokens": tokens,
+        "limit": limit,
+        "exact": exact,
+        "trimmed": trimmed,
+        "cost": db.estimate_cost(tokens, max_tokens, model=endpoint_name),
+    }
@@ -1,8 +1,19 @@
 # services/conversation_service.py - Conversation management service
 import os
-from typing import List, Dict, Any, Optional
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
 import db
-from conversations import default_title_from_prompt, generate_auto_title
+from services import background
+from services.context_builder import message_tokens
+from services.token_truncation import (
+    count_tokens_batch,
+    model_key_for_endpoint,
+    remember_token_count,
+    tokenizer_name,
+    truncate_head_tail,
+)
+from services.tokenizer_registry import get_tokenizer
+from conversations import default_title_from_prompt, extractive_title, generate_auto_title, summarize_turns
 from analytics_utils import build_analytics_frames
 from auth_utils import get_user_identity
 
@@ -10,7 +21,9 @@ class ConversationService:
     """Handles conversation operations and database interactions"""
     
     def log_conversation(self, conv_id: str, messages: List[Dict[str, Any]], 
-                        endpoint: str, tokens_in: int, tokens_out: int):
+                        endpoint: str, tokens_in: int, tokens_out: int,
+                        cache_hit: bool = False, cached_tokens: int = 0, cache_write_tokens: int = 0,
+                        estimated: bool = False):
         """Log conversation messages and usage to database"""
         if not os.getenv("DATABRICKS_WAREHOUSE_ID"):
             return
@@ -37,10 +50,13 @@ class ConversationService:
                 user_msg = messages[-2]
                 assistant_msg = messages[-1]
                 
+                user_count, assistant_count, counter = self._token_counts(endpoint, user_msg, assistant_msg)
                 db.log_message(conv_id, user_msg["role"], user_msg["content"], 
-                              tokens_in=0, tokens_out=0, status="ok")
+                              tokens_in=0, tokens_out=0, status="ok",
+                              token_count=user_count, token_counter=counter)
                 db.log_message(conv_id, assistant_msg["role"], assistant_msg["content"], 
-                              tokens_in=tokens_in, tokens_out=tokens_out, status="ok")
+                              tokens_in=tokens_in, tokens_out=tokens_out, status="ok",
+                              token_count=assistant_count, token_counter=counter)
                 
                 # Log usage
                 db.log_usage(
@@ -51,16 +67,119 @@ class ConversationService:
                     tokens_out,
                     email=user_identity.get("email"),
                     sql_user=user_identity.get("sql_user"),
+                    cache_hit=cache_hit,
+                    cached_tokens=cached_tokens,
+                    cache_write_tokens=cache_write_tokens,
+                    estimated=estimated,
                 )
         except Exception as e:
             raise Exception(f"Failed to log conversation: {e}")
     
+    def ensure_conversation(self, conv_id: str, endpoint: str, title: str = "New Conversation"):
+        """Create the conversation row if needed, for usage logged without chat messages"""
+        if not os.getenv("DATABRICKS_WAREHOUSE_ID"):
+            return
+        
+        user_identity = get_user_identity()
+        db.ensure_conversation(
+            conv_id,
+            user_identity.get("user_id", "unknown_user"),
+            endpoint,
+            title=title,
+            email=user_identity.get("email"),
+            sql_user=user_identity.get("sql_user"),
+        )
+    
+    def log_usage_event(self, conv_id: str, endpoint: str, tokens_in: int, tokens_out: int,
+                        cache_hit: bool = False, cached_tokens: int = 0, cache_write_tokens: int = 0,
+                        estimated: bool = False):
+        """Log usage of an auxiliary model call that produces no chat message"""
+        if not os.getenv("DATABRICKS_WAREHOUSE_ID"):
+            return
+        
+        user_identity = get_user_identity()
+        db.log_usage(
+            conv_id,
+            user_identity.get("user_id", "unknown_user"),
+            endpoint,
+            tokens_in,
+            tokens_out,
+            email=user_identity.get("email"),
+            sql_user=user_identity.get("sql_user"),
+            cache_hit=cache_hit,
+            cached_tokens=cached_tokens,
+            cache_write_tokens=cache_write_tokens,
+            estimated=estimated,
+        )
+    
+    def summarize_history(self, conv_id: str, endpoint: str, messages: List[Dict[str, Any]],
+                          summary: Dict[str, Any]) -> Dict[str, Any]:
+        """Fold older turns into the rolling summary once they exceed the threshold
+        
+        Compaction is enabled by SUMMARY_TRIGGER_TOKENS; the most recent
+        SUMMARY_KEEP_MESSAGES messages are always left verbatim. Returns the
+        summary state ({"text", "covered"}), unchanged if nothing was folded.
+        """
+        trigger = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "0") or "0")
+        keep = int(os.getenv("SUMMARY_KEEP_MESSAGES", "6") or "6")
+        covered = summary.get("covered", 0)
+        
+        # Fold up to a user turn so the verbatim tail starts with the user
+        end = len(messages) - max(keep, 1)
+        while end > covered and messages[end]["role"] != "user":
+            end -= 1
+        if trigger <= 0 or end <= covered:
+            return summary
+        
+        pending = messages[covered:end]
+        if sum(message_tokens(m) for m in pending) < trigger:
+            return summary
+        
+        cap = int(os.getenv("CONTEXT_OLD_MESSAGE_TOKENS", "4000") or "4000")
+        turns = [{"role": m["role"], "content": truncate_head_tail(str(m["content"]), cap)} for m in pending]
+        text, usage = summarize_turns(endpoint, summary.get("text", ""), turns)
+        if not text:
+            return summary
+        
+        if os.getenv("DATABRICKS_WAREHOUSE_ID"):
+            db.upsert_conversation_summary(conv_id, text, end)
+            self.log_usage_event(
+                conv_id,
+                endpoint,
+                int(usage.get("prompt_tokens", 0) or 0),
+                int(usage.get("completion_tokens", 0) or 0),
+            )
+        return {"text": text, "covered": end}
+    
+    def summarize_history_async(self, conv_id: str, endpoint: str, messages: List[Dict[str, Any]],
+                                summary: Dict[str, Any]) -> Future:
+        """Run summarize_history in the background; resolves to the summary state"""
+        return background.submit(self.summarize_history, conv_id, endpoint, list(messages), dict(summary))
+    
+    def load_conversation_summary(self, conv_id: str) -> Dict[str, Any]:
+        """Load the stored rolling summary of a conversation"""
+        row = db.fetch_conversation_summary(conv_id)
+        if not row or not row.get("summary"):
+            return {"text": "", "covered": 0}
+        return {"text": row["summary"], "covered": int(row.get("covered_messages") or 0)}
+    
     def generate_title(self, endpoint: str, messages: List[Dict[str, Any]]) -> str:
-        """Generate an automatic title for the conversation"""
+        """Generate an automatic title for the conversation
+        
+        Titles come from local keyword extraction. TITLE_ENDPOINT, when set,
+        is asked only if fewer than TITLE_MIN_KEYWORDS keywords were found;
+        "chat" means the conversation's own endpoint.
+        """
         try:
             fallback_title = default_title_from_prompt(messages[0].get("content", ""))
-            auto_title = generate_auto_title(endpoint, messages, fallback=fallback_title)
-            return auto_title
+            title, keywords = extractive_title(messages)
+            
+            title_endpoint = os.getenv("TITLE_ENDPOINT", "").strip()
+            if title_endpoint == "chat":
+                title_endpoint = endpoint
+            if title_endpoint and keywords < int(os.getenv("TITLE_MIN_KEYWORDS", "2") or "2"):
+                return generate_auto_title(title_endpoint, messages, fallback=title or fallback_title)
+            return title or fallback_title
         except Exception:
             # Fallback to simple title generation
             if messages:
@@ -69,6 +188,19 @@ class ConversationService:
                 return " ".join(words) + ("..." if len(content.split()) > 6 else "")
             return "New Conversation"
     
+    def generate_title_async(self, conv_id: str, endpoint: str, messages: List[Dict[str, Any]]) -> Future:
+        """Generate and persist a conversation title off the request path
+        
+        The returned future resolves to the new title.
+        """
+        def task() -> str:
+            title = self.generate_title(endpoint, messages)
+            if os.getenv("DATABRICKS_WAREHOUSE_ID"):
+                db.update_conversation_title(conv_id, title)
+            return title
+        
+        return background.submit(task)
+    
     def get_conversations(self, search: str = "", include_content: bool = False, 
                          limit: int = 50) -> List[Dict[str, Any]]:
         """Get list of conversations for current user"""
@@ -86,10 +218,25 @@ class ConversationService:
         )
     
     def load_conversation_messages(self, conv_id: str) -> List[Dict[str, Any]]:
-        """Load messages for a specific conversation"""
+        """Load messages for a specific conversation, reusing stored token counts"""
         messages = db.fetch_conversation_messages(conv_id)
+        for m in messages:
+            if m.get("token_count") is not None and m.get("token_counter"):
+                remember_token_count(m["content"], m["token_count"], m["token_counter"])
         return [{"role": m["role"], "content": m["content"]} for m in messages]
     
+    def _token_counts(self, endpoint: str, *messages: Dict[str, Any]) -> Tuple:
+        """Token counts of messages for storage, plus the tokenizer name
+        
+        Returns Nones unless PERSIST_TOKEN_COUNTS is on and the endpoint's
+        tokenizer is exact (estimates are not worth storing).
+        """
+        model_key = model_key_for_endpoint(endpoint)
+        if not db.PERSIST_TOKEN_COUNTS or not get_tokenizer(model_key).cacheable:
+            return tuple([None] * len(messages)) + (None,)
+        counts = count_tokens_batch([str(m.get("content") or "") for m in messages], model_key)
+        return tuple(counts) + (tokenizer_name(model_key),)
+    
     def delete_conversation(self, conv_id: str):
         """Delete a conversation and all related data"""
         db.delete_conversation(conv_id)
@@ -0,0 +1,95 @@
+# services/document_digest.py - Map-reduce summaries of documents beyond the model context
+import os
+from concurrent.futures import Future, as_completed
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from services import background
+from services.token_truncation import count_tokens_batch, model_key_for_endpoint, model_token_limit, split_by_tokens
+from conversations import combine_document_summaries, summarize_document_chunk
+
+# Concurrent summary calls per document (the serving limiter still applies per endpoint)
+DIGEST_PARALLELISM = int(os.getenv("DOCUMENT_DIGEST_PARALLELISM", "4") or "4")
+# Tokens of document text per summary call, capped by the model's context
+DIGEST_CHUNK_TOKENS = int(os.getenv("DOCUMENT_DIGEST_CHUNK_TOKENS", "8000") or "8000")
+# Response budget of each summary call
+DIGEST_SUMMARY_TOKENS = int(os.getenv("DOCUMENT_DIGEST_SUMMARY_TOKENS", "800") or "800")
+
+# Room left for instructions and part headers in each call
+_PROMPT_OVERHEAD_TOKENS = 500
+
+ProgressFn = Callable[[str, int, int], None]
+UsageFn = Callable[[Dict[str, Any]], None]
+
+def chunk_budget(endpoint: str) -> int:
+    """Tokens of input per summary call on an endpoint"""
+    limit = model_token_limit(model_key_for_endpoint(endpoint)) - DIGEST_SUMMARY_TOKENS - _PROMPT_OVERHEAD_TOKENS
+    return max(2 * DIGEST_SUMMARY_TOKENS, min(DIGEST_CHUNK_TOKENS, limit))
+
+def _group(summaries: List[str], budget: int, model_key: str) -> List[List[str]]:
+    """Pack consecutive summaries into groups that fit one combine call, at least two per group"""
+    groups: List[List[str]] = []
+    used = 0
+    for text, n in zip(summaries, count_tokens_batch(summaries, model_key)):
+        if groups and (len(groups[-1]) < 2 or used + n <= budget):
+            groups[-1].append(text)
+            used += n
+        else:
+            groups.append([text])
+            used = n
+    # A trailing single summary joins the previous group rather than costing a call
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        groups[-2].extend(groups.pop())
+    return groups
+
+def _run_all(pool, calls: List[Callable[[], Tuple[str, Dict[str, Any]]]], stage: str,
+             on_progress: Optional[ProgressFn], on_usage: Optional[UsageFn]) -> List[str]:
+    """Run calls on the pool; results keep call order, callbacks fire as calls complete"""
+    futures: Dict[Future, int] = {pool.submit(call): i for i, call in enumerate(calls)}
+    results: List[str] = [""] * len(calls)
+    try:
+        for done, future in enumerate(as_completed(futures), start=1):
+            text, usage = future.result()
+            results[futures[future]] = text
+            if on_usage:
+                on_usage(usage)
+            if on_progress:
+                on_progress(stage, done, len(calls))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
+
+def digest_document(endpoint: str, name: str, pieces: Union[str, Iterable[str]],
+                    on_progress: Optional[ProgressFn] = None,
+                    on_usage: Optional[UsageFn] = None) -> Tuple[str, int]:
+    """Summarize a document of any size into one digest that fits the context
+
+    The text is cut into chunk_budget-sized parts which are summarized
+    concurrently (DOCUMENT_DIGEST_PARALLELISM calls at a time). The part
+    summaries are then combined in groups, level by level, until one is
+    left. on_progress(stage, done, total) and on_usage(usage) are called in
+    the caller's thread as each call finishes. Returns (digest, part count).
+    """
+    model_key = model_key_for_endpoint(endpoint)
+    budget = chunk_budget(endpoint)
+    chunks = list(split_by_tokens(pieces, budget, model_key))
+    if not chunks:
+        return "", 0
+
+    with background.executor(DIGEST_PARALLELISM, "digest") as pool:
+        summaries = _run_all(
+            pool,
+            [partial(summarize_document_chunk, endpoint, name, chunk, i + 1, len(chunks), DIGEST_SUMMARY_TOKENS)
+             for i, chunk in enumerate(chunks)],
+            "Summarizing parts", on_progress, on_usage,
+        )
+        while len(summaries) > 1:
+            summaries = _run_all(
+                pool,
+                [partial(combine_document_summaries, endpoint, name, group, DIGEST_SUMMARY_TOKENS)
+                 for group in _group(summaries, budget, model_key)],
+                "Combining summaries", on_progress, on_usage,
+            )
+    return summaries[0], len(chunks)
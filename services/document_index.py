@@ -0,0 +1,109 @@
+# services/document_index.py - In-memory BM25 retrieval over an uploaded document
+import os
+import re
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Passage size and overlap in characters (about 4 characters per token)
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1600") or "1600")
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200") or "200")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6") or "6")
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+def _terms(text: str) -> List[str]:
+    return [t for t in _TERM_RE.findall(text.lower()) if len(t) > 1]
+
+def chunk_text(pieces: Iterable[str], size: int = RETRIEVAL_CHUNK_CHARS,
+               overlap: int = RETRIEVAL_CHUNK_OVERLAP) -> List[str]:
+    """Split streamed text into overlapping passages cut at whitespace"""
+    chunks = []
+    carry = ""
+    for piece in pieces:
+        text = carry + piece if carry else piece
+        start = 0
+        while len(text) - start >= size:
+            limit = start + size
+            cut = max(text.rfind("\n", start + size // 2, limit), text.rfind(" ", start + size // 2, limit))
+            end = cut if cut > start else limit
+            chunks.append(text[start:end].strip())
+            # Step back by the overlap, to a word boundary
+            space = text.find(" ", max(end - overlap, start + 1), end)
+            start = space + 1 if space >= 0 else end
+        carry = text[start:]
+    if carry.strip():
+        chunks.append(carry.strip())
+    return [c for c in chunks if c]
+
+class DocumentIndex:
+    """BM25 index over the passages of one document
+
+    Postings are kept as NumPy arrays per term, so scoring a question is a
+    few vectorized updates per query term.
+    """
+
+    def __init__(self, name: str, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.name = name
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+
+        docs: Dict[str, List[int]] = {}
+        freqs: Dict[str, List[int]] = {}
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            counts = Counter(_terms(chunk))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                docs.setdefault(term, []).append(i)
+                freqs.setdefault(term, []).append(tf)
+
+        n = len(chunks)
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if n else 0.0
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {
+            term: (
+                np.asarray(docs[term], dtype=np.int32),
+                np.asarray(freqs[term], dtype=np.float32),
+                math.log(1.0 + (n - len(docs[term]) + 0.5) / (len(docs[term]) + 0.5)),
+            )
+            for term in docs
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[Tuple[int, float]]:
+        """Top-k (passage index, score) pairs for a question, best first"""
+        if not self.chunks:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_len / max(self.avg_len, 1.0))
+        for term in set(_terms(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs, idf = posting
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm[docs])
+
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def context_for(self, query: str, k: int = RETRIEVAL_TOP_K) -> str:
+        """Prompt context with the passages most relevant to a question
+
+        Passages are given in document order. Without any match the start
+        of the document is used.
+        """
+        hits = sorted(i for i, _ in self.search(query, k))
+        header = f"Relevant excerpts from {self.name}"
+        if not hits:
+            hits = list(range(min(k, len(self.chunks))))
+            header = f"Opening excerpts from {self.name} (no passage matched the question)"
+        passages = "\n\n".join(f"[Passage {i + 1} of {len(self.chunks)}]\n{self.chunks[i]}" for i in hits)
+        return f"{header}:\n\n{passages}"
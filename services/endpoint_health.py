@@ -0,0 +1,70 @@
+# services/endpoint_health.py - Rolling per-endpoint health statistics
+import os
+import time
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Samples older than the window no longer count, so a degraded endpoint is retried
+HEALTH_WINDOW_SECONDS = float(os.getenv("HEALTH_WINDOW_SECONDS", "300") or "300")
+HEALTH_MAX_SAMPLES = int(os.getenv("HEALTH_MAX_SAMPLES", "100") or "100")
+FAILOVER_MIN_SAMPLES = int(os.getenv("FAILOVER_MIN_SAMPLES", "3") or "3")
+FAILOVER_MIN_SUCCESS_RATE = float(os.getenv("FAILOVER_MIN_SUCCESS_RATE", "0.5") or "0.5")
+FAILOVER_MAX_P95_SECONDS = float(os.getenv("FAILOVER_MAX_P95_SECONDS", "0") or "0")
+
+class EndpointHealth:
+    """Thread-safe rolling success rate and latency percentiles per endpoint"""
+
+    def __init__(self, window_seconds: float, max_samples: int):
+        self.window_seconds = window_seconds
+        self._samples: Dict[str, Deque[Tuple[float, bool, float]]] = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint_name: str, ok: bool, latency_s: float):
+        """Record the outcome of one call"""
+        with self._lock:
+            self._samples[endpoint_name].append((time.monotonic(), ok, latency_s))
+
+    def _recent(self, endpoint_name: str):
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            return [s for s in self._samples.get(endpoint_name, ()) if s[0] >= cutoff]
+
+    def success_rate(self, endpoint_name: str) -> float:
+        samples = self._recent(endpoint_name)
+        if not samples:
+            return 1.0
+        return sum(1 for _, ok, _ in samples if ok) / len(samples)
+
+    def latency_percentile(self, endpoint_name: str, pct: float) -> Optional[float]:
+        """Latency percentile (0-100) of successful calls in the window"""
+        latencies = sorted(lat for _, ok, lat in self._recent(endpoint_name) if ok)
+        if not latencies:
+            return None
+        idx = min(len(latencies) - 1, max(0, int(round(pct / 100.0 * len(latencies))) - 1))
+        return latencies[idx]
+
+    def is_degraded(self, endpoint_name: str) -> bool:
+        """Check if recent errors or latency cross the failover thresholds"""
+        samples = self._recent(endpoint_name)
+        if len(samples) < FAILOVER_MIN_SAMPLES:
+            return False
+        if self.success_rate(endpoint_name) < FAILOVER_MIN_SUCCESS_RATE:
+            return True
+        if FAILOVER_MAX_P95_SECONDS > 0:
+            p95 = self.latency_percentile(endpoint_name, 95)
+            return p95 is not None and p95 > FAILOVER_MAX_P95_SECONDS
+        return False
+
+    def snapshot(self, endpoint_name: str) -> Dict[str, Any]:
+        """Summary statistics for display"""
+        return {
+            "samples": len(self._recent(endpoint_name)),
+            "success_rate": self.success_rate(endpoint_name),
+            "p50_s": self.latency_percentile(endpoint_name, 50),
+            "p95_s": self.latency_percentile(endpoint_name, 95),
+            "degraded": self.is_degraded(endpoint_name),
+        }
+
+# Process-wide statistics shared by all sessions
+health = EndpointHealth(HEALTH_WINDOW_SECONDS, HEALTH_MAX_SAMPLES)
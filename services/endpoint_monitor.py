@@ -0,0 +1,129 @@
+# services/endpoint_monitor.py - Background endpoint readiness monitor
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import db
+from model_serving_utils import get_endpoint_state, query_endpoint_with_usage
+from services import background
+
+logger = logging.getLogger(__name__)
+
+MONITOR_INTERVAL_SECONDS = float(os.getenv("ENDPOINT_MONITOR_INTERVAL", "60") or "60")
+PREWARM_ENABLED = os.getenv("ENDPOINT_PREWARM", "1") == "1"
+PREWARM_COOLDOWN_SECONDS = float(os.getenv("ENDPOINT_PREWARM_COOLDOWN", "300") or "300")
+# Pre-warm calls are billed, so their usage is logged under this system conversation
+PREWARM_CONVERSATION_ID = "system-prewarm"
+
+def _parse_state(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a serving endpoint description to the fields the UI needs
+
+    scale_to_zero marks a ready endpoint with a deployed served entity that
+    has scale_to_zero_enabled, i.e. one that may be cold after idling. The
+    API reports no replica count, so whether it is cold right now is not
+    known; the free-text state messages are only shown, never parsed.
+    """
+    state = res.get("state") or {}
+    entities = (res.get("config") or {}).get("served_entities") or (res.get("config") or {}).get("served_models") or []
+    ready = state.get("ready") == "READY"
+
+    scale_to_zero = False
+    messages = []
+    for entity in entities:
+        entity_state = entity.get("state") or {}
+        message = entity_state.get("deployment_state_message") or ""
+        if message:
+            messages.append(message)
+        if entity.get("scale_to_zero_enabled") and entity_state.get("deployment") == "DEPLOYMENT_READY":
+            scale_to_zero = True
+
+    return {
+        "ready": ready,
+        "config_update": state.get("config_update", ""),
+        "scale_to_zero": ready and scale_to_zero,
+        "message": "; ".join(messages),
+    }
+
+def _prewarm_call(endpoint_name: str):
+    """Send the smallest possible request and log what it cost"""
+    _, usage = query_endpoint_with_usage(
+        endpoint_name=endpoint_name,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=1,
+        use_cache=False,
+    )
+    db.log_usage_batch([{
+        "conv_id": PREWARM_CONVERSATION_ID,
+        "user_id": "system",
+        "model": endpoint_name,
+        "tokens_in": int(usage.get("prompt_tokens", 0) or 0),
+        "tokens_out": int(usage.get("completion_tokens", 0) or 0),
+        "cached_tokens": int(usage.get("cached_tokens", 0) or 0),
+        "cache_write_tokens": int(usage.get("cache_write_tokens", 0) or 0),
+        "meta": {"source": "prewarm"},
+    }])
+
+class EndpointMonitor:
+    """Periodically probes endpoint readiness and caches it for all sessions"""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._endpoints: List[str] = []
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._prewarmed_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, endpoint_names: List[str]):
+        """Watch the given endpoints, starting the probe thread once per process"""
+        if self.interval_seconds <= 0:
+            return
+        with self._lock:
+            self._endpoints = [e for e in endpoint_names if e]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="endpoint-monitor", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                endpoints = list(self._endpoints)
+            for endpoint_name in endpoints:
+                self._status[endpoint_name] = self.probe(endpoint_name)
+            time.sleep(self.interval_seconds)
+
+    def probe(self, endpoint_name: str) -> Dict[str, Any]:
+        """Check an endpoint's readiness now"""
+        try:
+            status = _parse_state(get_endpoint_state(endpoint_name))
+            status["error"] = None
+        except Exception as e:
+            logger.warning(f"Endpoint probe failed for {endpoint_name}: {e}")
+            status = {"ready": False, "config_update": "", "scale_to_zero": False, "message": "", "error": str(e)}
+        status["checked_at"] = time.time()
+        return status
+
+    def status(self, endpoint_name: str) -> Optional[Dict[str, Any]]:
+        """Last known status of an endpoint, or None before the first probe"""
+        return self._status.get(endpoint_name)
+
+    def prewarm(self, endpoint_name: str) -> bool:
+        """Wake a scale-to-zero endpoint with a tiny background request, at most once per cooldown"""
+        status = self.status(endpoint_name)
+        if not PREWARM_ENABLED or not status or not status.get("scale_to_zero"):
+            return False
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._prewarmed_at.get(endpoint_name, -PREWARM_COOLDOWN_SECONDS) < PREWARM_COOLDOWN_SECONDS:
+                return False
+            self._prewarmed_at[endpoint_name] = now
+
+        logger.info(f"Pre-warming scale-to-zero endpoint {endpoint_name}")
+        background.submit(_prewarm_call, endpoint_name)
+        return True
+
+# Process-wide monitor shared by all sessions
+monitor = EndpointMonitor(MONITOR_INTERVAL_SECONDS)
@@ -0,0 +1,54 @@
+# services/endpoint_router.py - Size- and cost-aware endpoint selection for "auto"
+import os
+from typing import List, Tuple
+
+import db
+from services.context_builder import context_budget
+from services.endpoint_health import health
+
+# Pseudo-endpoint id that asks ModelService to pick an endpoint per request
+AUTO_ENDPOINT = "auto"
+
+# Dollars one second of median latency is worth when ranking endpoints
+ROUTER_LATENCY_WEIGHT = float(os.getenv("ROUTER_LATENCY_WEIGHT", "0.001") or "0.001")
+
+def is_enabled() -> bool:
+    """Check if the "auto" endpoint choice is offered"""
+    return os.getenv("ENABLE_AUTO_ROUTING", "0") == "1"
+
+def largest_context(candidates: List[str], max_tokens: int = 400) -> str:
+    """Candidate with the largest prompt budget"""
+    candidates = [c for c in candidates if c and c != AUTO_ENDPOINT]
+    if not candidates:
+        raise ValueError("No endpoints available for automatic routing")
+    return max(candidates, key=lambda e: context_budget(e, max_tokens))
+
+def choose_endpoint(candidates: List[str], prompt_tokens: int, max_tokens: int = 400) -> Tuple[str, str]:
+    """Pick the cheapest, fastest endpoint whose context fits the prompt
+
+    Each endpoint that fits is scored by its expected cost (MODEL_PRICES)
+    plus ROUTER_LATENCY_WEIGHT times its observed median latency. Degraded
+    endpoints rank last; when scores tie the smaller context window wins.
+    If nothing fits, the endpoint with the largest context is used.
+    Returns (endpoint, reason).
+    """
+    candidates = [c for c in candidates if c and c != AUTO_ENDPOINT]
+    if not candidates:
+        raise ValueError("No endpoints available for automatic routing")
+
+    scored = []
+    for endpoint_name in candidates:
+        budget = context_budget(endpoint_name, max_tokens)
+        if budget < prompt_tokens:
+            continue
+        prompt_price, completion_price, _ = db.model_prices(endpoint_name)
+        cost = (prompt_tokens / 1000.0) * prompt_price + (max_tokens / 1000.0) * completion_price
+        p50 = health.latency_percentile(endpoint_name, 50)
+        score = cost + ROUTER_LATENCY_WEIGHT * (p50 or 0.0)
+        scored.append((health.is_degraded(endpoint_name), score, budget, endpoint_name, cost))
+
+    if not scored:
+        return largest_context(candidates, max_tokens), f"{prompt_tokens:,} tokens exceeds every context; using the largest"
+
+    _, _, _, chosen, cost = min(scored)
+    return chosen, f"{prompt_tokens:,} tokens, est. ${cost:.4f}"
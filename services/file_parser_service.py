@@ -1,44 +1,110 @@
 # services/file_parser_service.py
-import fitz  # PyMuPDF
+import os
+import codecs
+from typing import Any, Dict, Iterable, Iterator, Optional
+
 import pandas as pd
-from services.token_truncation import truncate_to_model_context
+from pdf_utils import iter_pdf_pages
+from services.parse_cache import ParseCache, content_hash, parse_cache
+from services.table_profile import TABLE_DISTINCT_CAP, TABLE_SAMPLE_ROWS, profile_csv, profile_excel
+from services.token_truncation import TRUNCATION_CHUNK_CHARS, model_token_limit, truncate_stream
+from services.tokenizer_registry import registry as tokenizer_registry
+
+# Bytes read per step from plain-text uploads
+READ_BLOCK_BYTES = 1 << 20
+
+# Bump when extraction output changes so cached parse results are not reused
+PARSER_VERSION = 1
+
+def _output_settings() -> tuple:
+    # Everything besides the bytes that shapes parsed text; cached results embed the file name
+    return (
+        _tabular_format(),
+        TABLE_SAMPLE_ROWS,
+        TABLE_DISTINCT_CAP,
+        TRUNCATION_CHUNK_CHARS,
+        sorted(tokenizer_registry.sources.items()),
+        tokenizer_registry.directory,
+    )
+
+def cache_key(file, *parts) -> str:
+    """Parse cache key of an upload: content hash, name, parser version and settings"""
+    return ParseCache.key(content_hash(file), file.name, PARSER_VERSION, _output_settings(), *parts)
 
-def parse_file(file, model_key="default") -> tuple[str, bool]:
-    """Detect file type and parse with token limit awareness."""
+def parse_file(file, model_key="default", stats: Optional[Dict[str, Any]] = None) -> tuple[str, bool]:
+    """Detect file type and parse with token limit awareness.
+
+    Text is extracted lazily (PDF pages, text blocks) and extraction stops
+    once the model's token limit is reached. UPLOAD_TRUNCATION_MODE=head_tail
+    keeps the start and end of oversized files instead of just the start.
+    PDF extraction statistics are written to stats, if given. Results are
+    kept in the shared parse cache, keyed by content, model and settings.
+    """
+    mode = os.getenv("UPLOAD_TRUNCATION_MODE", "head") or "head"
+    key = cache_key(file, "text", model_key, mode)
+    cached = parse_cache.get(key)
+    if cached is not None:
+        if stats is not None:
+            stats["cached"] = True
+        return cached["text"], cached["truncated"]
+
+    pieces = extract_text(file, stats)
+    try:
+        text, truncated = truncate_stream(pieces, model_token_limit(model_key), model_key, mode=mode)
+    finally:
+        # Stop any extraction still running past the budget
+        if hasattr(pieces, "close"):
+            pieces.close()
+    parse_cache.put(key, {"text": text, "truncated": truncated})
+    return text, truncated
+
+def extract_text(file, stats: Optional[Dict[str, Any]] = None) -> Iterable[str]:
+    """Extract an upload's text as a lazy sequence of pieces (pages, blocks)"""
     content_type = file.type
     file_name = file.name.lower()
 
     if content_type == "application/pdf":
-        raw = _parse_pdf(file)
+        return _parse_pdf(file, stats)
     elif content_type == "text/plain" or file_name.endswith((".txt", ".py", ".md")):
-        raw = _parse_txt(file)
+        return _parse_txt(file)
     elif content_type == "text/csv":
-        raw = _parse_csv(file)
+        return [_parse_csv(file, file.name)]
     elif content_type in (
         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         "application/vnd.ms-excel"
     ):
-        raw = _parse_xlsx(file)
-    else:
-        raw = ""
-
-    truncated = truncate_to_model_context(raw, model_key)
-    was_truncated = len(truncated) < len(raw)
-
-    return truncated, was_truncated
+        return [_parse_xlsx(file, file.name)]
+    return []
 
+def _parse_pdf(file, stats: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    pages = iter_pdf_pages(file, stats)
+    try:
+        for i, text in enumerate(pages):
+            yield ("\n" if i else "") + text
+    finally:
+        pages.close()
 
-def _parse_pdf(file) -> str:
-    doc = fitz.open(stream=file.read(), filetype="pdf")
-    return "\n".join(page.get_text() for page in doc)
+def _parse_txt(file) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    while True:
+        block = file.read(READ_BLOCK_BYTES)
+        if not block:
+            break
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
 
-def _parse_txt(file) -> str:
-    return file.read().decode("utf-8", errors="ignore")
+def _tabular_format() -> str:
+    # "profile" (schema, statistics, sampled rows) or "text" (every row of the first sheet)
+    return os.getenv("TABULAR_UPLOAD_FORMAT", "profile") or "profile"
 
-def _parse_csv(file) -> str:
+def _parse_csv(file, name: str) -> str:
+    if _tabular_format() == "profile":
+        return profile_csv(file, name)
     df = pd.read_csv(file)
     return df.to_string(index=False)
 
-def _parse_xlsx(file) -> str:
+def _parse_xlsx(file, name: str) -> str:
+    if _tabular_format() == "profile":
+        return profile_excel(file, name)
     df = pd.read_excel(file)
     return df.to_string(index=False)
@@ -0,0 +1,110 @@
+# services/inflight.py - Coalesces concurrent identical generation requests
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from response_cache import make_key
+from services import background
+
+# How long a finished turn stays available to reruns that asked for it late
+INFLIGHT_RESULT_TTL_SECONDS = float(os.getenv("INFLIGHT_RESULT_TTL_SECONDS", "300") or "300")
+
+class InflightTurn:
+    """One model generation shared by every script run that requests it
+
+    The generation runs on its own thread, so a rerun that interrupts the
+    run which started it simply reattaches and keeps streaming.
+    """
+
+    def __init__(self):
+        self.deltas: List[str] = []
+        self.text = ""
+        self.usage: Dict[str, Any] = {}
+        self.endpoint_name = ""
+        self.routing_reason = ""
+        self.error: Optional[Exception] = None
+        self.log_error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+
+    def append(self, delta: str):
+        with self._cond:
+            self.deltas.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[Exception] = None):
+        with self._cond:
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def iter_deltas(self) -> Iterator[str]:
+        """Yield every delta from the start, waiting for new ones until finished"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.deltas) and not self.done:
+                    self._cond.wait()
+                pending = self.deltas[index:]
+                finished = self.done
+            for delta in pending:
+                yield delta
+            index += len(pending)
+            if finished and index >= len(self.deltas):
+                return
+
+    def wait(self):
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+
+class InflightRegistry:
+    """Per-conversation registry of running and recently finished turns"""
+
+    def __init__(self, result_ttl_seconds: float):
+        self.result_ttl_seconds = result_ttl_seconds
+        self._turns: Dict[str, InflightTurn] = {}
+        self._lock = threading.Lock()
+
+    def start(self, key: str, generate: Callable[[InflightTurn], None]) -> Tuple[InflightTurn, bool]:
+        """Join the turn for key, starting generate(turn) if none exists
+
+        Returns (turn, started). Failed turns are forgotten as soon as they
+        finish so that the request can be retried.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for k in [k for k, t in self._turns.items()
+                      if t.done and (t.error or now - t.finished_at > self.result_ttl_seconds)]:
+                del self._turns[k]
+            turn = self._turns.get(key)
+            if turn is not None:
+                return turn, False
+            turn = InflightTurn()
+            self._turns[key] = turn
+
+        background.spawn(self._run, turn, generate, name="inflight-turn")
+        return turn, True
+
+    def _run(self, turn: InflightTurn, generate: Callable[[InflightTurn], None]):
+        try:
+            generate(turn)
+        except Exception as e:
+            turn.finish(e)
+            return
+        turn.finish()
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+def turn_key(conv_id: str, endpoint_name: str, messages: List[Dict[str, Any]]) -> str:
+    """Identity of a generation request: conversation, endpoint and history"""
+    return make_key(endpoint_name, messages, {"conversation_id": conv_id})
+
+# Process-wide registry, so a second tab on the same conversation joins too
+inflight = InflightRegistry(INFLIGHT_RESULT_TTL_SECONDS)
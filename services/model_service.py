@@ -1,7 +1,18 @@
 # services/model_service.py - Model endpoint management service
 import os
-from typing import List, Dict, Tuple, Any
-from model_serving_utils import query_endpoint_with_usage
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Any, Optional, Iterator, Callable
+from model_serving_utils import query_endpoint_with_usage, stream_endpoint_with_usage, ResponseStream, is_retryable_error
+from services.context_builder import build_context_window, message_tokens
+from services.endpoint_health import health
+from services.endpoint_router import AUTO_ENDPOINT, choose_endpoint, largest_context
+from services.context_meter import calibration
+from services.token_truncation import count_tokens, model_key_for_endpoint
+
+def _window_chars(window: List[Dict[str, Any]]) -> int:
+    return sum(len(str(m.get("content") or "")) for m in window)
 
 class ModelService:
     """Handles model endpoint operations"""
@@ -36,6 +47,7 @@ class ModelService:
         """Test if an endpoint is working"""
         if not endpoint_name:
             return False, "No endpoint specified"
+        endpoint_name, _ = self.resolve_endpoint(endpoint_name, [{"role": "user", "content": "Reply with OK"}])
         
         try:
             last, _ = query_endpoint_with_usage(
@@ -48,24 +60,234 @@ class ModelService:
         except Exception as e:
             return False, str(e)
     
-    def generate_response(self, endpoint_name: str, messages: List[Dict[str, Any]]) -> Tuple[str, int, int]:
+    def generate_response(self, endpoint_name: str, messages: List[Dict[str, Any]],
+                          summary: Optional[Dict[str, Any]] = None) -> Tuple[str, int, int]:
         """Generate a response from the model"""
         if not endpoint_name:
             raise ValueError("No endpoint configured")
+        endpoint_name, _ = self.resolve_endpoint(endpoint_name, messages, summary)
         
-        # Prepare context window
-        max_turns = int(os.getenv("MAX_TURNS", "12") or "12")
-        window = messages[-max_turns:] if max_turns > 0 else messages
+        def call(candidate: str):
+            window = self._context_window(candidate, messages, summary)
+            reply_msg, usage = query_endpoint_with_usage(
+                endpoint_name=candidate,
+                messages=window,
+                max_tokens=400,
+            )
+            self._calibrate(candidate, _window_chars(window), usage)
+            return reply_msg, usage
         
-        # Call endpoint
-        reply_msg, usage = query_endpoint_with_usage(
-            endpoint_name=endpoint_name,
-            messages=window,
-            max_tokens=400,
-        )
+        # Call endpoint, failing over along the fallback chain
+        _, (reply_msg, usage) = self._call_with_failover(endpoint_name, call)
         
         reply_text = reply_msg.get("content", "") if isinstance(reply_msg, dict) else str(reply_msg)
-        tokens_in = int(usage.get("prompt_tokens", 0)) if isinstance(usage, dict) else 0
-        tokens_out = int(usage.get("completion_tokens", 0)) if isinstance(usage, dict) else 0
+        tokens_in, tokens_out = self.usage_tokens(usage)
+        
+        return reply_text, tokens_in, tokens_out
+    
+    def stream_response(self, endpoint_name: str, messages: List[Dict[str, Any]],
+                        summary: Optional[Dict[str, Any]] = None, failover: bool = True) -> ResponseStream:
+        """Stream a response from the model as text deltas
+        
+        Falls back to a single-chunk stream when STREAM_RESPONSES is disabled.
+        Token usage is available on the stream once it has been consumed, and
+        ``endpoint_name`` on the stream names the endpoint that served it.
+        """
+        if not endpoint_name:
+            raise ValueError("No endpoint configured")
+        endpoint_name, routing_reason = self.resolve_endpoint(endpoint_name, messages, summary)
+        
+        def call(candidate: str) -> ResponseStream:
+            window = self._context_window(candidate, messages, summary)
+            if os.getenv("STREAM_RESPONSES", "1") == "1":
+                stream = stream_endpoint_with_usage(
+                    endpoint_name=candidate,
+                    messages=window,
+                    max_tokens=400,
+                )
+                stream.prompt_chars = _window_chars(window)
+                stream.estimate_usage = lambda text: self._estimate_usage(candidate, window, text)
+                return stream
+            
+            reply_msg, usage = query_endpoint_with_usage(
+                endpoint_name=candidate,
+                messages=window,
+                max_tokens=400,
+            )
+            reply_text = reply_msg.get("content", "") if isinstance(reply_msg, dict) else str(reply_msg)
+            stream = ResponseStream.from_reply(reply_text, usage)
+            stream.endpoint_name = candidate
+            stream.prompt_chars = _window_chars(window)
+            return stream
+        
+        if not failover:
+            stream = call(endpoint_name)
+        else:
+            _, stream = self._call_with_failover(endpoint_name, call)
+        stream.routing_reason = routing_reason
+        return stream
+    
+    def calibrate(self, stream: ResponseStream):
+        """Learn the endpoint's characters per token from a consumed stream"""
+        self._calibrate(stream.endpoint_name, stream.prompt_chars, stream.usage)
+    
+    def _calibrate(self, endpoint_name: str, prompt_chars: int, usage: Dict[str, Any]):
+        if endpoint_name and isinstance(usage, dict) and not usage.get("cache_hit") and not usage.get("estimated"):
+            calibration.observe(endpoint_name, prompt_chars, int(usage.get("prompt_tokens", 0) or 0))
+    
+    def _estimate_usage(self, endpoint_name: str, window: List[Dict[str, Any]], text: str) -> Dict[str, Any]:
+        """Local token counts for a stream whose endpoint reported no usage"""
+        model_key = model_key_for_endpoint(endpoint_name)
+        tokens_in = sum(message_tokens(m, model_key) for m in window)
+        tokens_out = count_tokens(text, model_key)
+        return {"prompt_tokens": tokens_in, "completion_tokens": tokens_out, "total_tokens": tokens_in + tokens_out,
+                "cached_tokens": 0, "cache_write_tokens": 0, "estimated": True}
+    
+    def resolve_endpoint(self, endpoint_name: str, messages: List[Dict[str, Any]],
+                         summary: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """Concrete endpoint for a request; returns (endpoint, routing reason)
+        
+        The "auto" choice is routed by prompt size, context limits, price and
+        latency across ROUTER_ENDPOINTS (default: the configured endpoints).
+        """
+        if endpoint_name != AUTO_ENDPOINT:
+            return endpoint_name, ""
+        
+        # Sized with the default tokenizer since the model family is not known yet
+        prompt_tokens = sum(message_tokens(m) for m in self._with_summary(messages, summary))
+        return choose_endpoint(self._router_candidates(), prompt_tokens, max_tokens=400)
+    
+    def upload_endpoint(self, endpoint_name: str) -> str:
+        """Endpoint whose context limit applies to an upload
+        
+        An upload is parsed before the turn is routed, so "auto" is sized for
+        the largest context it could be routed to.
+        """
+        if endpoint_name != AUTO_ENDPOINT:
+            return endpoint_name
+        return largest_context(self._router_candidates())
+    
+    def _router_candidates(self) -> List[str]:
+        """Endpoints "auto" may route to: ROUTER_ENDPOINTS, else the configured endpoints"""
+        candidates = [x.strip() for x in os.getenv("ROUTER_ENDPOINTS", "").split(",") if x.strip()]
+        if not candidates:
+            endpoints, _ = self.get_available_endpoints()
+            candidates = [m["id"] for m in endpoints if m["id"]]
+        return candidates
+    
+    def failover_chain(self, endpoint_name: str) -> List[str]:
+        """Endpoints to try for a request, healthy ones first
+        
+        The chain is the selected endpoint followed by FALLBACK_ENDPOINTS
+        (default: the other configured endpoints). Set ENABLE_FAILOVER=0 to
+        only ever use the selected endpoint.
+        """
+        if os.getenv("ENABLE_FAILOVER", "1") != "1":
+            return [endpoint_name]
+        
+        fallbacks = [x.strip() for x in os.getenv("FALLBACK_ENDPOINTS", "").split(",") if x.strip()]
+        if not fallbacks:
+            endpoints, _ = self.get_available_endpoints()
+            fallbacks = [m["id"] for m in endpoints if m["id"]]
+        
+        chain = [endpoint_name] + [e for e in fallbacks if e != endpoint_name]
+        healthy = [e for e in chain if not health.is_degraded(e)]
+        return healthy + [e for e in chain if e not in healthy]
+    
+    def _call_with_failover(self, endpoint_name: str, call: Callable[[str], Any]) -> Tuple[str, Any]:
+        """Run a call along the failover chain; returns (served endpoint, result)
         
-        return reply_text, tokens_in, tokens_out
\ No newline at end of file
+        Throttling, server errors and timeouts move on to the next endpoint;
+        other errors are raised immediately.
+        """
+        last_error: Optional[Exception] = None
+        for candidate in self.failover_chain(endpoint_name):
+            start = time.monotonic()
+            try:
+                result = call(candidate)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                health.record(candidate, False, time.monotonic() - start)
+                last_error = e
+                continue
+            # For streams this is the time until the response started
+            health.record(candidate, True, time.monotonic() - start)
+            return candidate, result
+        raise last_error
+    
+    def compare_responses(self, endpoint_names: List[str], messages: List[Dict[str, Any]]) -> Iterator[Tuple[str, str, Any]]:
+        """Stream the same request from several endpoints in parallel
+        
+        Yields ("delta", endpoint, text) events as tokens arrive and one
+        ("done", endpoint, result) event per endpoint, where result holds the
+        full text, token usage, latency and any error. Wall time is bounded by
+        the slowest endpoint.
+        """
+        events: "queue.Queue[Tuple[str, str, Any]]" = queue.Queue()
+        
+        def worker(endpoint_name: str):
+            start = time.monotonic()
+            first_token_s = None
+            stream = None
+            try:
+                stream = self.stream_response(endpoint_name, messages, failover=False)
+                for delta in stream:
+                    if first_token_s is None:
+                        first_token_s = time.monotonic() - start
+                    events.put(("delta", endpoint_name, delta))
+                stream.close()
+                self.calibrate(stream)
+                tokens_in, tokens_out = self.usage_tokens(stream.usage)
+                result = {
+                    "text": stream.text,
+                    "tokens_in": tokens_in,
+                    "tokens_out": tokens_out,
+                    "cached_tokens": int(stream.usage.get("cached_tokens", 0) or 0),
+                    "cache_write_tokens": int(stream.usage.get("cache_write_tokens", 0) or 0),
+                    "estimated": bool(stream.usage.get("estimated")),
+                    "cache_hit": bool(stream.usage.get("cache_hit")),
+                    "error": None,
+                }
+            except Exception as e:
+                if stream is not None:
+                    stream.close()
+                result = {"text": "", "tokens_in": 0, "tokens_out": 0, "cached_tokens": 0,
+                          "cache_write_tokens": 0, "estimated": False, "cache_hit": False, "error": str(e)}
+            result["latency_s"] = time.monotonic() - start
+            result["first_token_s"] = first_token_s
+            events.put(("done", endpoint_name, result))
+        
+        with ThreadPoolExecutor(max_workers=max(1, len(endpoint_names)), thread_name_prefix="compare") as pool:
+            for endpoint_name in endpoint_names:
+                pool.submit(worker, endpoint_name)
+            
+            remaining = len(endpoint_names)
+            while remaining:
+                event = events.get()
+                if event[0] == "done":
+                    remaining -= 1
+                yield event
+    
+    def usage_tokens(self, usage: Dict[str, Any]) -> Tuple[int, int]:
+        """Extract prompt (including cached) and completion token counts from normalized endpoint usage"""
+        if not isinstance(usage, dict):
+            return 0, 0
+        return int(usage.get("prompt_tokens", 0) or 0), int(usage.get("completion_tokens", 0) or 0)
+    
+    def _context_window(self, endpoint_name: str, messages: List[Dict[str, Any]],
+                        summary: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Prepare the token-budgeted context window sent to the model
+        
+        When a rolling summary is available, the turns it covers are replaced
+        by a single system message carrying the summary.
+        """
+        return build_context_window(self._with_summary(messages, summary), endpoint_name, max_tokens=400)
+    
+    def _with_summary(self, messages: List[Dict[str, Any]],
+                      summary: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        if summary and summary.get("text") and summary.get("covered", 0) > 0:
+            return [
+                {"role": "system", "content": f"Summary of the earlier conversation:\n{summary['text']}"}
+            ] + messages[summary["covered"]:]
+        return messages
\ No newline at end of file
@@ -0,0 +1,125 @@
+# services/parse_cache.py - Disk-backed cache of parsed uploads shared by all sessions
+import os
+import json
+import gzip
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "") or os.path.join(tempfile.gettempdir(), "chat-app-parse-cache")
+# Total size of cached entries; 0 disables the cache
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "512") or "512")
+
+_SUFFIX = ".json.gz"
+
+def content_hash(file) -> str:
+    """SHA-256 of an upload's bytes, leaving its read position at the start"""
+    digest = hashlib.sha256()
+    if hasattr(file, "getbuffer"):
+        digest.update(file.getbuffer())
+    else:
+        file.seek(0)
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+class ParseCache:
+    """Size-bounded LRU of JSON values stored as gzip files in one directory
+
+    Recency is the file's modification time, refreshed on every hit, so the
+    cache survives restarts and is shared by processes using the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached value and mark it most recently used"""
+        if not self.enabled():
+            return None
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable parse cache entry {key}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a value, then evict least recently used entries over the size limit"""
+        if not self.enabled():
+            return
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written under a temporary name and renamed, so readers never see partial entries
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=3) as f:
+                f.write(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write parse cache entry {key}: {e}")
+            if tmp:
+                self._remove(tmp)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(_SUFFIX):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Process-wide cache shared by all sessions
+parse_cache = ParseCache(PARSE_CACHE_DIR, int(PARSE_CACHE_MAX_MB * 1024 * 1024))
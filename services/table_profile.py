@@ -0,0 +1,217 @@
+# services/table_profile.py - Compact profiles of CSV and Excel uploads
+import os
+import math
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Rows kept as a uniform random sample of the whole table
+TABLE_SAMPLE_ROWS = int(os.getenv("TABLE_SAMPLE_ROWS", "20") or "20")
+# Distinct values tracked per column before the count is reported as "N+"
+TABLE_DISTINCT_CAP = int(os.getenv("TABLE_DISTINCT_CAP", "1000") or "1000")
+# Bytes per CSV read block / rows per Excel chunk
+TABLE_READ_BLOCK_BYTES = int(os.getenv("TABLE_READ_BLOCK_BYTES", str(4 << 20)) or str(4 << 20))
+TABLE_CHUNK_ROWS = 50_000
+
+# Sample values are shortened to keep wide text columns cheap
+_MAX_CELL_CHARS = 80
+
+class ColumnProfile:
+    """Running statistics of one column, updated chunk by chunk"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.dtypes: List[str] = []
+        self.count = 0
+        self.nulls = 0
+        self.distinct: set = set()
+        self.distinct_capped = False
+        self.top: Counter = Counter()
+        # Numeric: Chan's parallel mean/variance; datetime: min/max only
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.numeric_count = 0
+        self.min: Any = None
+        self.max: Any = None
+
+    def update(self, values: pd.Series):
+        dtype = str(values.dtype)
+        if dtype not in self.dtypes:
+            self.dtypes.append(dtype)
+        present = values.dropna()
+        self.count += len(values)
+        self.nulls += len(values) - len(present)
+        if present.empty:
+            return
+
+        if not self.distinct_capped:
+            self.distinct.update(present.unique().tolist())
+            if len(self.distinct) > TABLE_DISTINCT_CAP:
+                self.distinct_capped = True
+                self.distinct = set()
+
+        if pd.api.types.is_numeric_dtype(present) and not pd.api.types.is_bool_dtype(present):
+            data = present.to_numpy(dtype=np.float64)
+            n, mean = len(data), float(data.mean())
+            m2 = float(((data - mean) ** 2).sum())
+            total = self.numeric_count + n
+            delta = mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += m2 + delta * delta * self.numeric_count * n / total
+            self.numeric_count = total
+            self._bounds(data.min(), data.max())
+        elif pd.api.types.is_datetime64_any_dtype(present) and not self.numeric_count:
+            self._bounds(present.min(), present.max())
+        else:
+            self.top.update(present.astype(str).tolist())
+            if self.distinct_capped and len(self.top) > TABLE_DISTINCT_CAP:
+                # Past the cap only the most frequent values are kept, so top counts become approximate
+                self.top = Counter(dict(self.top.most_common(TABLE_DISTINCT_CAP)))
+
+    def _bounds(self, low, high):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def describe(self) -> str:
+        dtype = "|".join(self.dtypes) or "empty"
+        distinct = f"{TABLE_DISTINCT_CAP:,}+" if self.distinct_capped else f"{len(self.distinct):,}"
+        parts = [f"{self.nulls:,} nulls", f"{distinct} distinct"]
+        if self.numeric_count:
+            std = math.sqrt(self.m2 / (self.numeric_count - 1)) if self.numeric_count > 1 else 0.0
+            parts.append(f"min {_num(self.min)}, max {_num(self.max)}, mean {_num(self.mean)}, std {_num(std)}")
+        elif self.min is not None:
+            parts.append(f"from {self.min} to {self.max}")
+        elif self.top:
+            present = max(self.count - self.nulls, 1)
+            label = "top (approx.)" if self.distinct_capped else "top"
+            parts.append(f"{label}: " + ", ".join(
+                f"{_cell(value)} ({100 * n / present:.0f}%)" for value, n in self.top.most_common(3)
+            ))
+        return f"- {self.name} ({dtype}): " + "; ".join(parts)
+
+def _num(value) -> str:
+    return f"{float(value):.6g}"
+
+def _cell(value) -> str:
+    text = str(value)
+    return text if len(text) <= _MAX_CELL_CHARS else text[:_MAX_CELL_CHARS - 1] + "…"
+
+class TableProfile:
+    """Schema, per-column statistics and a reservoir sample of rows for one table"""
+
+    def __init__(self, name: str, sample_rows: int = TABLE_SAMPLE_ROWS, seed: int = 0):
+        self.name = name
+        self.rows = 0
+        self.columns: Dict[str, ColumnProfile] = {}
+        self.sample_rows = sample_rows
+        self.sample: List[Dict[str, Any]] = []
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, chunk: pd.DataFrame):
+        for column in chunk.columns:
+            key = str(column)
+            if key not in self.columns:
+                self.columns[key] = ColumnProfile(key)
+            self.columns[key].update(chunk[column])
+        self._sample(chunk)
+        self.rows += len(chunk)
+
+    def _sample(self, chunk: pd.DataFrame):
+        # Algorithm R, vectorized per chunk: row i (0-based overall) replaces slot j < k with j ~ U[0, i]
+        k = self.sample_rows
+        if k <= 0 or chunk.empty:
+            return
+        take = max(0, min(k - self.rows, len(chunk)))
+        if take:
+            self.sample.extend(chunk.iloc[:take].to_dict("records"))
+        if take == len(chunk):
+            return
+        positions = np.arange(self.rows + take, self.rows + len(chunk))
+        slots = (self._rng.random(len(positions)) * (positions + 1)).astype(np.int64)
+        for i in np.nonzero(slots < k)[0]:
+            self.sample[slots[i]] = chunk.iloc[take + i].to_dict()
+
+    def render(self) -> str:
+        lines = [f"Table {self.name}: {self.rows:,} rows x {len(self.columns)} columns", "Columns:"]
+        lines += [c.describe() for c in self.columns.values()]
+        if self.sample:
+            sample = pd.DataFrame(self.sample, columns=list(self.columns)).astype(object)
+            sample = sample.where(sample.notna(), "").apply(lambda col: col.map(_cell))
+            shown = "all" if len(sample) == self.rows else f"random sample of {len(sample)}"
+            lines += [f"Rows ({shown}, CSV):", sample.to_csv(index=False).strip()]
+        return "\n".join(lines)
+
+def _csv_chunks_arrow(file) -> Iterator[pd.DataFrame]:
+    import pyarrow.csv as pacsv
+
+    reader = pacsv.open_csv(file, read_options=pacsv.ReadOptions(block_size=TABLE_READ_BLOCK_BYTES))
+    empty = True
+    for batch in reader:
+        empty = False
+        yield batch.to_pandas()
+    if empty:
+        # Header-only file: keep the columns
+        yield reader.schema.empty_table().to_pandas()
+
+def _csv_chunks_pandas(file) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(file, chunksize=TABLE_CHUNK_ROWS)
+
+def profile_csv(file, name: str) -> str:
+    """Profile a CSV upload, streamed in blocks with pyarrow (pandas if that fails)"""
+    try:
+        profile = _profile_chunks(name, _csv_chunks_arrow(file))
+    except Exception:
+        # e.g. a column whose type changes after the first block
+        file.seek(0)
+        profile = _profile_chunks(name, _csv_chunks_pandas(file))
+    return profile.render()
+
+def _excel_sheets_calamine(file) -> List[Tuple[str, Iterable[pd.DataFrame]]]:
+    sheets = pd.read_excel(file, sheet_name=None, engine="calamine")
+    return [(str(sheet), [df]) for sheet, df in sheets.items()]
+
+def _excel_sheets_openpyxl(file) -> Iterator[Tuple[str, Iterator[pd.DataFrame]]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, _sheet_chunks(sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+def _sheet_chunks(rows: Iterable[tuple]) -> Iterator[pd.DataFrame]:
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [str(c) if c is not None else f"column_{i + 1}" for i, c in enumerate(header)]
+    chunk = []
+    emitted = False
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= TABLE_CHUNK_ROWS:
+            yield pd.DataFrame(chunk, columns=columns).infer_objects()
+            chunk = []
+            emitted = True
+    if chunk or not emitted:
+        yield pd.DataFrame(chunk, columns=columns).infer_objects()
+
+def profile_excel(file, name: str) -> str:
+    """Profile every sheet of an Excel upload (calamine if installed, else streaming openpyxl)"""
+    try:
+        sheets = _excel_sheets_calamine(file)
+    except (ImportError, ValueError):
+        # python-calamine not installed, or pandas older than 2.2
+        file.seek(0)
+        sheets = _excel_sheets_openpyxl(file)
+    profiles = [_profile_chunks(f"{name} [sheet {sheet}]", chunks).render() for sheet, chunks in sheets]
+    return "\n\n".join(profiles)
+
+def _profile_chunks(name: str, chunks: Iterable[pd.DataFrame]) -> TableProfile:
+    profile = TableProfile(name)
+    for chunk in chunks:
+        profile.update(chunk)
+    return profile
@@ -1,7 +1,16 @@
-from transformers import GPT2TokenizerFast
+import os
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from itertools import chain
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple, Union
 
-# Load GPT2 tokenizer (token count approximation)
-tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+from services.tokenizer_registry import get_tokenizer
+
+# Text is tokenized in pieces of about this many characters, cut at whitespace
+TRUNCATION_CHUNK_CHARS = int(os.getenv("TRUNCATION_CHUNK_CHARS", "65536") or "65536")
+
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "50000") or "50000")
 
 # Max context limits per supported model
 MODEL_TOKEN_LIMITS = {
@@ -12,9 +21,226 @@ MODEL_TOKEN_LIMITS = {
     "default": 30_000
 }
 
-def truncate_to_model_context(text: str, model_key: str) -> str:
-    limit = MODEL_TOKEN_LIMITS.get(model_key.lower(), MODEL_TOKEN_LIMITS["default"])
-    tokens = tokenizer.encode(text)
-    if len(tokens) > limit:
-        return tokenizer.decode(tokens[:limit])
-    return text
+def model_key_for_endpoint(endpoint: str) -> str:
+    """Map an endpoint name to its model family key"""
+    endpoint = (endpoint or "").lower()
+    for key in ("claude", "gemma", "llama", "gpt"):
+        if key in endpoint:
+            return key
+    return "default"
+
+class TokenCountCache:
+    """Bounded LRU of token counts keyed by tokenizer and content hash
+
+    Only the hash is kept, so large documents are not held in memory.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tokenizer_name: str, text: str) -> Tuple[str, str]:
+        return tokenizer_name, hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, key: Tuple[str, str]) -> Optional[int]:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._counts.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def put(self, key: Tuple[str, str], count: int):
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+# Process-wide token counts shared by context building, summaries and uploads
+token_counts = TokenCountCache(TOKEN_COUNT_CACHE_SIZE)
+
+def count_tokens(text: str, model_key: str = "default") -> int:
+    """Count tokens in a text, memoized per content hash and tokenizer"""
+    return count_tokens_batch([text], model_key)[0]
+
+def count_tokens_batch(texts: List[str], model_key: str = "default") -> List[int]:
+    """Count tokens for many texts, encoding only uncached ones in one batch"""
+    tokenizer = get_tokenizer(model_key)
+    if not tokenizer.cacheable:
+        return tokenizer.count_batch(texts)
+
+    counts: List[Optional[int]] = []
+    missing: List[int] = []
+    for i, text in enumerate(texts):
+        count = token_counts.get(TokenCountCache.key(tokenizer.name, text)) if text else 0
+        counts.append(count)
+        if count is None:
+            missing.append(i)
+
+    if missing:
+        for i, count in zip(missing, tokenizer.count_batch([texts[i] for i in missing])):
+            counts[i] = count
+            token_counts.put(TokenCountCache.key(tokenizer.name, texts[i]), count)
+    return counts
+
+def remember_token_count(text: str, count: int, tokenizer_name: str):
+    """Seed the cache with a count computed earlier (e.g. loaded from the database)"""
+    if text and count is not None and count >= 0:
+        token_counts.put(TokenCountCache.key(tokenizer_name, text), int(count))
+
+def tokenizer_name(model_key: str = "default") -> str:
+    """Name of the tokenizer used for a model family, as stored with counts"""
+    return get_tokenizer(model_key).name
+
+def _chunks(pieces: Iterable[str], size: int) -> Iterator[str]:
+    """Re-cut a stream of text pieces into chunks of about `size` characters"""
+    carry = ""
+    for piece in pieces:
+        text = carry + piece if carry else piece
+        start = 0
+        while len(text) - start >= size:
+            end = start + size
+            cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+            if cut > start:
+                end = cut + 1
+            yield text[start:end]
+            start = end
+        carry = text[start:]
+    if carry:
+        yield carry
+
+def _tail_chars(text: str, limit: int, tokenizer) -> int:
+    """Characters covering the last `limit` tokens, reading backwards in chunks"""
+    pos, used = len(text), 0
+    while pos > 0:
+        start = max(0, pos - TRUNCATION_CHUNK_CHARS)
+        cut = text.find(" ", start, pos) if start else -1
+        if cut > start:
+            start = cut
+        chunk = text[start:pos]
+        n = tokenizer.count(chunk)
+        if used + n >= limit:
+            return len(text) - pos + tokenizer.suffix_chars(chunk, limit - used)
+        used += n
+        pos = start
+    return len(text)
+
+def truncate_stream(pieces: Union[str, Iterable[str]], limit: int, model_key: str = "default", mode: str = "head",
+                    marker: str = "\n\n[... truncated ...]\n\n") -> Tuple[str, bool]:
+    """Truncate streamed text to a token limit, stopping early where possible
+
+    Text is tokenized chunk by chunk. In "head" mode reading stops as soon
+    as the limit is reached. In "head_tail" mode the first and last halves
+    of the budget are kept, and only a rolling tail window is held while the
+    rest is read. Memory is bounded by the budget, not the input. A whole
+    string skips the middle entirely by reading its tail backwards.
+    Returns (text, was_truncated).
+    """
+    tokenizer = get_tokenizer(model_key)
+    if isinstance(pieces, str):
+        if mode == "head_tail":
+            head, truncated = truncate_stream([pieces], limit, model_key)
+            if not truncated:
+                return pieces, False
+            head = head[:tokenizer.prefix_chars(head, limit // 2)]
+            tail_start = max(len(head), len(pieces) - _tail_chars(pieces, limit - limit // 2, tokenizer))
+            return head + marker + pieces[tail_start:], True
+        pieces = [pieces]
+    chunks = _chunks(pieces, TRUNCATION_CHUNK_CHARS)
+
+    parts: List[Tuple[str, int]] = []
+    used = 0
+    overflow = None
+    for chunk in chunks:
+        n = tokenizer.count(chunk)
+        if used + n > limit:
+            overflow = (chunk, n)
+            break
+        parts.append((chunk, n))
+        used += n
+
+    if overflow is None:
+        return "".join(c for c, _ in parts), False
+
+    if mode != "head_tail":
+        chunk = overflow[0]
+        return "".join(c for c, _ in parts) + chunk[:tokenizer.prefix_chars(chunk, limit - used)], True
+
+    head_limit = limit // 2
+    tail_limit = limit - head_limit
+
+    # Split what was read so far into the head and the start of the tail
+    head: List[str] = []
+    head_used = 0
+    tail: Deque[Tuple[str, int]] = deque()
+    for chunk, n in chain(parts, [overflow]):
+        if tail or head_used + n > head_limit:
+            if not tail and head_used < head_limit:
+                cut = tokenizer.prefix_chars(chunk, head_limit - head_used)
+                head.append(chunk[:cut])
+                head_used = head_limit
+                chunk = chunk[cut:]
+                n = tokenizer.count(chunk)
+            tail.append((chunk, n))
+        else:
+            head.append(chunk)
+            head_used += n
+
+    # Read the rest, keeping only enough trailing chunks to fill the tail
+    tail_used = sum(n for _, n in tail)
+    for chunk in chain([None], chunks):
+        if chunk is not None:
+            n = tokenizer.count(chunk)
+            tail.append((chunk, n))
+            tail_used += n
+        while len(tail) > 1 and tail_used - tail[0][1] >= tail_limit:
+            tail_used -= tail.popleft()[1]
+
+    tail_text = "".join(c for c, _ in tail)
+    if tail_used > tail_limit:
+        tail_text = tail_text[len(tail_text) - tokenizer.suffix_chars(tail_text, tail_limit):]
+    return "".join(head) + marker + tail_text, True
+
+def split_by_tokens(pieces: Union[str, Iterable[str]], limit: int, model_key: str = "default",
+                    step_chars: int = 4096) -> Iterator[str]:
+    """Cut streamed text into consecutive parts of at most about `limit` tokens"""
+    tokenizer = get_tokenizer(model_key)
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    part: List[str] = []
+    used = 0
+    for chunk in _chunks(pieces, step_chars):
+        n = tokenizer.count(chunk)
+        if part and used + n > limit:
+            yield "".join(part)
+            part, used = [], 0
+        part.append(chunk)
+        used += n
+    if part:
+        yield "".join(part)
+
+def truncate_head_tail(text: str, limit: int, marker: str = "\n\n[... truncated ...]\n\n",
+                       model_key: str = "default") -> str:
+    """Keep the first and last tokens of a text within a token limit
+
+    Not memoized: a cache keyed by the text would keep whole documents
+    alive, and the cut only tokenizes the head and tail it keeps.
+    """
+    return truncate_stream(text, limit, model_key, mode="head_tail", marker=marker)[0]
+
+def truncate_to_model_context(text: str, model_key: str, mode: str = "head") -> str:
+    return truncate_stream(text, model_token_limit(model_key), model_key, mode=mode)[0]
+
+def model_token_limit(model_key: str) -> int:
+    """Context limit in tokens for a model family key"""
+    return MODEL_TOKEN_LIMITS.get((model_key or "default").lower(), MODEL_TOKEN_LIMITS["default"])
@@ -0,0 +1,151 @@
+# services/tokenizer_registry.py - Lazily loaded tokenizers per model family
+import os
+import math
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bundled tokenizer.json files, looked up as <dir>/<model_key>.json then <dir>/default.json
+TOKENIZER_DIR = os.getenv("TOKENIZER_DIR", "") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "tokenizers")
+
+# Average characters per token when no tokenizer file is available
+DEFAULT_CHARS_PER_TOKEN = {
+    "claude": 3.5,
+    "llama": 3.8,
+    "gemma": 4.0,
+    "gpt": 4.0,
+    "default": 4.0,
+}
+
+def _parse_sources(csv: str) -> Dict[str, str]:
+    """Parse "model_key=path-or-hub-id,..." tokenizer overrides"""
+    sources = {}
+    for token in [x.strip() for x in csv.split(",") if x.strip()]:
+        if "=" in token:
+            key, value = token.split("=", 1)
+            sources[key.strip().lower()] = value.strip()
+    return sources
+
+class EstimatedTokenizer:
+    """Character-ratio token estimator, calibrated from observed usage"""
+
+    # Cheap to recompute and changes as it is calibrated, so never memoized
+    cacheable = False
+
+    def __init__(self, model_key: str, chars_per_token: float):
+        self.name = f"estimate:{model_key}"
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [self.count(t) for t in texts]
+
+    def prefix_chars(self, text: str, limit: int) -> int:
+        """Characters covering the first `limit` tokens of text"""
+        return min(len(text), int(limit * self.chars_per_token))
+
+    def suffix_chars(self, text: str, limit: int) -> int:
+        """Characters covering the last `limit` tokens of text"""
+        return min(len(text), int(limit * self.chars_per_token))
+
+    def observe(self, chars: int, tokens: int, weight: float = 0.2):
+        """Move the ratio toward one measured by the endpoint (chars sent, prompt_tokens)"""
+        if chars > 0 and tokens > 0:
+            self.chars_per_token += weight * (chars / tokens - self.chars_per_token)
+
+class HFTokenizer:
+    """Wrapper around a `tokenizers` Tokenizer (no transformers or torch needed)"""
+
+    cacheable = True
+
+    def __init__(self, name: str, tokenizer):
+        self.name = name
+        self._tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids) if text else 0
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        encodings = self._tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(e.ids) for e in encodings]
+
+    def prefix_chars(self, text: str, limit: int) -> int:
+        offsets = self._tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= limit:
+            return len(text)
+        return offsets[limit - 1][1] if limit > 0 else 0
+
+    def suffix_chars(self, text: str, limit: int) -> int:
+        offsets = self._tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= limit:
+            return len(text)
+        return len(text) - offsets[-limit][0] if limit > 0 else 0
+
+def _load_hf(model_key: str, source: str) -> Optional[HFTokenizer]:
+    # Named by family and full source, so cached and stored counts never mix tokenizers
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        return None
+    try:
+        if os.path.exists(source):
+            path = os.path.abspath(source)
+            return HFTokenizer(f"{model_key}:{path}", Tokenizer.from_file(path))
+        # Not a file: treat as a Hugging Face Hub id (needs network access)
+        return HFTokenizer(f"{model_key}:{source}", Tokenizer.from_pretrained(source))
+    except Exception as e:
+        logger.warning(f"Could not load tokenizer {source}: {e}")
+        return None
+
+class TokenizerRegistry:
+    """Resolves a tokenizer per model family on first use
+
+    Order: TOKENIZERS ("model_key=path-or-hub-id"), then TOKENIZER_DIR
+    files, then a calibrated EstimatedTokenizer.
+    """
+
+    def __init__(self, sources: Dict[str, str], directory: str):
+        self.sources = sources
+        self.directory = directory
+        self._tokenizers: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_key: str = "default"):
+        model_key = (model_key or "default").lower()
+        tokenizer = self._tokenizers.get(model_key)
+        if tokenizer is None:
+            with self._lock:
+                tokenizer = self._tokenizers.get(model_key)
+                if tokenizer is None:
+                    tokenizer = self._load(model_key)
+                    self._tokenizers[model_key] = tokenizer
+                    logger.info(f"Tokenizer for {model_key}: {tokenizer.name}")
+        return tokenizer
+
+    def _load(self, model_key: str):
+        candidates = []
+        for key in (model_key, "default"):
+            if key in self.sources:
+                candidates.append(self.sources[key])
+            candidates.append(os.path.join(self.directory, f"{key}.json"))
+        for source in candidates:
+            if source.endswith(".json") and not os.path.exists(source):
+                continue
+            tokenizer = _load_hf(model_key, source)
+            if tokenizer is not None:
+                return tokenizer
+        ratio = DEFAULT_CHARS_PER_TOKEN.get(model_key, DEFAULT_CHARS_PER_TOKEN["default"])
+        return EstimatedTokenizer(model_key, ratio)
+
+# Process-wide registry; nothing is loaded until a tokenizer is first needed
+registry = TokenizerRegistry(_parse_sources(os.getenv("TOKENIZERS", "")), TOKENIZER_DIR)
+
+def get_tokenizer(model_key: str = "default"):
+    """Tokenizer for a model family key (see token_truncation.model_key_for_endpoint)"""
+    return registry.get(model_key)
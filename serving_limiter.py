@@ -0,0 +1,116 @@
+# serving_limiter.py - Process-wide admission control for serving endpoints
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Deque, Dict
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("ENDPOINT_MAX_CONCURRENCY", "8") or "8")
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ENDPOINT_QUEUE_TIMEOUT", "60") or "60")
+
+def _parse_limits(csv: str) -> Dict[str, int]:
+    """Parse "endpoint=limit,endpoint2=limit" concurrency overrides"""
+    limits = {}
+    for token in [x.strip() for x in csv.split(",") if x.strip()]:
+        if "=" in token:
+            name, value = token.split("=", 1)
+            try:
+                limits[name.strip()] = max(1, int(value))
+            except ValueError:
+                continue
+    return limits
+
+class QueueTimeout(Exception):
+    """Raised when a request waits too long for an endpoint slot"""
+    pass
+
+class _EndpointQueue:
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.tickets: Deque[object] = deque()
+        self.cond = threading.Condition()
+        self.admitted = 0
+        self.timeouts = 0
+        self.waits: Deque[float] = deque(maxlen=500)
+
+class EndpointLimiter:
+    """Per-endpoint concurrency limit with a FIFO wait queue
+
+    Requests beyond an endpoint's limit wait in arrival order instead of
+    all hitting the endpoint at once. Queue depth and wait times are kept
+    so provisioned throughput can be sized from real demand.
+    """
+
+    def __init__(self, default_limit: int, limits: Dict[str, int], queue_timeout: float):
+        self.default_limit = default_limit
+        self.limits = limits
+        self.queue_timeout = queue_timeout
+        self._queues: Dict[str, _EndpointQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, endpoint_name: str) -> _EndpointQueue:
+        with self._lock:
+            q = self._queues.get(endpoint_name)
+            if q is None:
+                q = _EndpointQueue(self.limits.get(endpoint_name, self.default_limit))
+                self._queues[endpoint_name] = q
+            return q
+
+    def acquire(self, endpoint_name: str) -> float:
+        """Wait for a slot on the endpoint; returns the time spent waiting"""
+        q = self._queue(endpoint_name)
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with q.cond:
+            q.tickets.append(ticket)
+            while q.active >= q.max_concurrency or q.tickets[0] is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    q.tickets.remove(ticket)
+                    q.timeouts += 1
+                    q.cond.notify_all()
+                    raise QueueTimeout(f"Timed out after {self.queue_timeout:.0f}s waiting for {endpoint_name}")
+                q.cond.wait(remaining)
+            q.tickets.popleft()
+            q.active += 1
+            q.admitted += 1
+            waited = time.monotonic() - start
+            q.waits.append(waited)
+            # Let the next ticket check for a free slot
+            q.cond.notify_all()
+        return waited
+
+    def release(self, endpoint_name: str):
+        """Return a slot to the endpoint"""
+        q = self._queue(endpoint_name)
+        with q.cond:
+            q.active = max(0, q.active - 1)
+            q.cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Current queue depth and wait statistics per endpoint"""
+        with self._lock:
+            queues = dict(self._queues)
+        result = {}
+        for name, q in queues.items():
+            with q.cond:
+                waits = sorted(q.waits)
+                result[name] = {
+                    "max_concurrency": q.max_concurrency,
+                    "active": q.active,
+                    "queued": len(q.tickets),
+                    "admitted": q.admitted,
+                    "timeouts": q.timeouts,
+                    "avg_wait_s": sum(waits) / len(waits) if waits else 0.0,
+                    "p95_wait_s": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                }
+        return result
+
+# Process-wide limiter shared by all sessions in this replica
+limiter = EndpointLimiter(
+    DEFAULT_MAX_CONCURRENCY,
+    _parse_limits(os.getenv("ENDPOINT_CONCURRENCY_LIMITS", "")),
+    QUEUE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,98 @@
+import json
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+from tools import batch_inference
+
+db = batch_inference.db
+
+
+class FakeCursor:
+    def __init__(self, statements, fail):
+        self.statements = statements
+        self.fail = fail
+
+    def execute(self, statement, params=None):
+        if self.fail:
+            raise RuntimeError("warehouse down")
+        self.statements.append(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeWarehouse:
+    def __init__(self):
+        self.statements = []
+        self.fail = False
+
+    @contextmanager
+    def connection(self):
+        conn = type("Conn", (), {"cursor": lambda _: FakeCursor(self.statements, self.fail)})()
+        yield conn
+
+    def usage_rows(self):
+        return sum(s.count("'batch-") for s in self.statements if "usage_events" in s)
+
+
+@pytest.fixture
+def batch_run(tmp_path, monkeypatch):
+    rows = tmp_path / "rows.jsonl"
+    rows.write_text("".join(json.dumps({"id": f"q{i}", "prompt": "hi"}) + "\n" for i in range(5)))
+    output = tmp_path / "results.jsonl"
+    warehouse = FakeWarehouse()
+
+    def query(endpoint, messages, max_tokens=400):
+        return {"content": "ok"}, {"prompt_tokens": 3, "completion_tokens": 2}
+
+    monkeypatch.setattr(db, "ENABLE_LOGGING", True)
+    monkeypatch.setattr(db, "WAREHOUSE_ID", "wh")
+    monkeypatch.setattr(db, "get_db_connection", warehouse.connection)
+    monkeypatch.setattr(db, "current_user", lambda: "tester")
+    monkeypatch.setattr(batch_inference, "query_endpoint_with_usage", query)
+    monkeypatch.setattr(sys, "argv", ["batch_inference", "--input", str(rows), "--output", str(output), "--endpoint", "ep"])
+    return output, warehouse
+
+
+def test_usage_logged_for_every_checkpointed_row(batch_run):
+    output, warehouse = batch_run
+    batch_inference.main()
+    ids = {json.loads(line)["id"] for line in output.read_text().splitlines()}
+    assert ids == {f"q{i}" for i in range(5)}
+    assert warehouse.usage_rows() == 5
+    run_id = batch_inference.default_run_id(str(output))
+    assert all(f"'batch-{run_id}-{i}'" in warehouse.statements[0] for i in ids)
+
+
+def test_failed_usage_insert_leaves_rows_to_rerun(batch_run):
+    output, warehouse = batch_run
+    warehouse.fail = True
+    with pytest.raises(SystemExit) as exc:
+        batch_inference.main()
+    assert "not checkpointed" in str(exc.value.code)
+    assert batch_inference.completed_ids(str(output)) == set()
+
+    # The rerun logs the usage and checkpoints every row
+    warehouse.fail = False
+    batch_inference.main()
+    assert len(batch_inference.completed_ids(str(output))) == 5
+    assert warehouse.usage_rows() == 5
+
+
+def test_log_usage_batch_reports_shortfall(batch_run):
+    _, warehouse = batch_run
+    events = [{"conv_id": f"batch-x-{i}", "user_id": "u", "model": "ep", "tokens_in": 1, "tokens_out": 1} for i in range(3)]
+    assert db.log_usage_batch(events, chunk_size=2) == 3
+    warehouse.fail = True
+    assert db.log_usage_batch(events, chunk_size=2) == 0
+
+
+def test_default_run_id_is_stable_per_output(tmp_path):
+    first = batch_inference.default_run_id(str(tmp_path / "a.jsonl"))
+    assert first == batch_inference.default_run_id(str(tmp_path / "a.jsonl"))
+    assert first != batch_inference.default_run_id(str(tmp_path / "b.jsonl"))
@@ -0,0 +1,48 @@
+import pytest
+
+from services import token_truncation
+from services.context_builder import build_context_window
+from services.tokenizer_registry import EstimatedTokenizer
+
+
+@pytest.fixture(autouse=True)
+def fixed_tokenizer(monkeypatch):
+    tokenizer = EstimatedTokenizer("test", 4.0)
+    monkeypatch.setattr(token_truncation, "get_tokenizer", lambda model_key="default": tokenizer)
+    monkeypatch.setenv("CONTEXT_OLD_MESSAGE_TOKENS", "4000")
+    monkeypatch.delenv("CONTEXT_TOKEN_BUDGETS", raising=False)
+    monkeypatch.delenv("MAX_TURNS", raising=False)
+    return tokenizer
+
+
+def conversation(attachment):
+    return [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": attachment + "\n\nUser: summarize this"},
+        {"role": "assistant", "content": "It is a report."},
+        {"role": "user", "content": "What does section 3 say?"},
+    ]
+
+
+def test_large_old_attachment_is_kept_whole_when_it_fits():
+    attachment = "lorem ipsum " * 6_700  # about 20k tokens
+    messages = conversation(attachment)
+    window = build_context_window(messages, "databricks-claude-sonnet-4")
+    assert [m["content"] for m in window] == [m["content"] for m in messages]
+
+
+def test_old_attachment_is_cut_to_head_and_tail_when_over_budget(fixed_tokenizer):
+    attachment = "lorem ipsum " * 6_700
+    window = build_context_window(conversation(attachment), "databricks-llama-4", max_tokens=10_000)
+    assert len(window) == 4
+    kept = window[1]["content"]
+    assert "[... truncated ...]" in kept
+    assert fixed_tokenizer.count(kept) <= 4000 + 10  # plus the truncation marker
+    assert kept.endswith("User: summarize this")
+
+
+def test_turns_are_dropped_when_even_the_cut_does_not_fit(monkeypatch):
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGETS", "tiny=100")
+    window = build_context_window(conversation("lorem ipsum " * 6_700), "tiny")
+    assert [m["role"] for m in window] == ["system", "user"]
+    assert window[-1]["content"] == "What does section 3 say?"
@@ -0,0 +1,25 @@
+from services.context_meter import measure
+
+
+def test_large_old_attachment_is_measured_as_capped(monkeypatch):
+    monkeypatch.setenv("CONTEXT_OLD_MESSAGE_TOKENS", "4000")
+    history = [
+        {"role": "user", "content": "word " * 40_000 + "\n\nUser: summarize this"},
+        {"role": "assistant", "content": "It is about words."},
+        {"role": "user", "content": "Thanks, and what else?"},
+        {"role": "assistant", "content": "Nothing else."},
+    ]
+    meter = measure("databricks-llama", history)
+    assert meter["trimmed"]
+    assert meter["tokens"] < 4000 + 200
+    assert meter["tokens"] < meter["limit"]
+
+
+def test_short_history_is_measured_in_full():
+    history = [
+        {"role": "user", "content": "Hello there"},
+        {"role": "assistant", "content": "Hi! How can I help?"},
+    ]
+    meter = measure("databricks-llama", history, attachment="a small attached note")
+    assert not meter["trimmed"]
+    assert 0 < meter["tokens"] < 100
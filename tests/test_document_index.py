@@ -0,0 +1,43 @@
+from services.document_index import DocumentIndex, chunk_text
+
+
+def test_chunks_cover_text_with_overlap():
+    text = " ".join(f"word{i}" for i in range(2000))
+    pieces = [text[i:i + 700] for i in range(0, len(text), 700)]
+    chunks = chunk_text(pieces, size=400, overlap=80)
+    assert len(chunks) > 1
+    assert all(len(c) <= 400 for c in chunks)
+    assert chunks[0].startswith("word0 ") and chunks[-1].endswith("word1999")
+    # Consecutive passages share words, and no word is cut in half
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.split()[0] in prev.split()
+    assert set(" ".join(chunks).split()) == set(text.split())
+
+
+def test_search_ranks_matching_passage_first():
+    chunks = [
+        "The cat sat on the mat.",
+        "Quarterly revenue grew twelve percent on strong cloud demand.",
+        "Revenue guidance for next year was left unchanged.",
+        "Dogs and cats are common pets.",
+    ]
+    index = DocumentIndex("report.txt", chunks)
+    hits = index.search("cloud revenue growth", k=2)
+    assert [i for i, _ in hits] == [1, 2]
+    assert hits[0][1] > hits[1][1] > 0
+    assert index.search("zebra") == []
+
+
+def test_context_for_falls_back_to_opening_passages():
+    index = DocumentIndex("notes.txt", ["alpha beta", "gamma delta", "epsilon"])
+    assert "Passage 2 of 3" in index.context_for("delta", k=1)
+    context = index.context_for("zebra", k=2)
+    assert context.startswith("Opening excerpts from notes.txt")
+    assert "[Passage 1 of 3]" in context and "[Passage 2 of 3]" in context
+    assert "[Passage 3 of 3]" not in context
+
+
+def test_empty_index():
+    index = DocumentIndex("empty.txt", [])
+    assert len(index) == 0
+    assert index.search("anything") == []
@@ -0,0 +1,44 @@
+from services import endpoint_monitor
+from services.endpoint_monitor import EndpointMonitor, _parse_state
+
+
+def description(deployment="DEPLOYMENT_READY", scale_to_zero=True, ready="READY", message=""):
+    return {
+        "state": {"ready": ready, "config_update": "NOT_UPDATING"},
+        "config": {"served_entities": [{
+            "scale_to_zero_enabled": scale_to_zero,
+            "state": {"deployment": deployment, "deployment_state_message": message},
+        }]},
+    }
+
+
+def test_scale_to_zero_comes_from_structured_fields():
+    assert _parse_state(description())["scale_to_zero"]
+    assert not _parse_state(description(scale_to_zero=False))["scale_to_zero"]
+    assert not _parse_state(description(ready="NOT_READY"))["scale_to_zero"]
+
+
+def test_state_message_text_is_not_parsed():
+    state = _parse_state(description(
+        deployment="DEPLOYMENT_FAILED", ready="NOT_READY", message="Failed: zero replicas could be scheduled",
+    ))
+    assert not state["scale_to_zero"]
+    assert state["message"] == "Failed: zero replicas could be scheduled"
+
+
+def test_prewarm_logs_its_usage_once_per_cooldown(monkeypatch):
+    logged = []
+    monkeypatch.setattr(endpoint_monitor, "get_endpoint_state", lambda name: description())
+    monkeypatch.setattr(endpoint_monitor.background, "submit", lambda fn, *args, **kwargs: fn(*args, **kwargs))
+    monkeypatch.setattr(endpoint_monitor, "query_endpoint_with_usage",
+                        lambda **kwargs: ({"content": "pong"}, {"prompt_tokens": 8, "completion_tokens": 1}))
+    monkeypatch.setattr(endpoint_monitor.db, "log_usage_batch", lambda events: logged.extend(events) or len(events))
+
+    monitor = EndpointMonitor(0)
+    monitor._status["ep"] = monitor.probe("ep")
+    assert monitor.prewarm("ep")
+    assert not monitor.prewarm("ep")
+    assert len(logged) == 1
+    assert logged[0]["conv_id"] == endpoint_monitor.PREWARM_CONVERSATION_ID
+    assert (logged[0]["tokens_in"], logged[0]["tokens_out"]) == (8, 1)
+    assert logged[0]["meta"] == {"source": "prewarm"}
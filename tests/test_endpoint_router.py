@@ -0,0 +1,79 @@
+import pytest
+
+from services import endpoint_router
+from services.endpoint_router import AUTO_ENDPOINT, choose_endpoint, largest_context
+
+BUDGETS = {"small": 8_000, "medium": 32_000, "large": 200_000}
+# Dollars per 1K (prompt, completion, cached) tokens
+PRICES = {"small": (0.0001, 0.0002, 0.0), "medium": (0.001, 0.002, 0.0), "large": (0.003, 0.015, 0.0)}
+
+
+class FakeHealth:
+    def __init__(self):
+        self.degraded = set()
+        self.p50 = {}
+
+    def is_degraded(self, endpoint_name):
+        return endpoint_name in self.degraded
+
+    def latency_percentile(self, endpoint_name, pct):
+        return self.p50.get(endpoint_name)
+
+
+@pytest.fixture
+def health(monkeypatch):
+    fake = FakeHealth()
+    monkeypatch.setattr(endpoint_router, "context_budget", lambda endpoint, max_tokens: BUDGETS[endpoint])
+    monkeypatch.setattr(endpoint_router.db, "model_prices", lambda endpoint: PRICES[endpoint])
+    monkeypatch.setattr(endpoint_router, "health", fake)
+    return fake
+
+
+def test_cheapest_endpoint_that_fits(health):
+    assert choose_endpoint(["large", "medium", "small"], 1_000)[0] == "small"
+    assert choose_endpoint(["large", "medium", "small"], 20_000)[0] == "medium"
+    endpoint, reason = choose_endpoint(["large", "medium", "small"], 100_000)
+    assert endpoint == "large"
+    assert reason.startswith("100,000 tokens, est. $")
+
+
+def test_nothing_fits_uses_largest_context(health):
+    endpoint, reason = choose_endpoint(["small", "large", AUTO_ENDPOINT], 500_000)
+    assert endpoint == "large"
+    assert "exceeds every context" in reason
+
+
+def test_degraded_endpoints_rank_last(health):
+    health.degraded.add("small")
+    assert choose_endpoint(["small", "medium"], 1_000)[0] == "medium"
+    health.degraded.add("medium")
+    assert choose_endpoint(["small", "medium"], 1_000)[0] == "small"
+
+
+def test_latency_outweighs_small_price_gap(health, monkeypatch):
+    monkeypatch.setattr(endpoint_router, "ROUTER_LATENCY_WEIGHT", 0.01)
+    health.p50 = {"small": 5.0, "medium": 0.5}
+    assert choose_endpoint(["small", "medium"], 1_000)[0] == "medium"
+
+
+def test_no_candidates():
+    with pytest.raises(ValueError):
+        choose_endpoint([AUTO_ENDPOINT, ""], 100)
+
+
+def test_largest_context_ignores_auto(health):
+    assert largest_context([AUTO_ENDPOINT, "small", "large", "medium"]) == "large"
+    with pytest.raises(ValueError):
+        largest_context([AUTO_ENDPOINT])
+
+
+def test_uploads_for_auto_are_sized_for_the_largest_context(health, monkeypatch):
+    from services.model_service import ModelService
+
+    monkeypatch.setenv("ROUTER_ENDPOINTS", "small,large,medium")
+    service = ModelService()
+    assert service.upload_endpoint(AUTO_ENDPOINT) == "large"
+    assert service.upload_endpoint("small") == "small"
+    # A turn carrying a large staged document routes past the endpoints it would overflow
+    staged = [{"role": "user", "content": "word " * 40_000}]
+    assert service.resolve_endpoint(AUTO_ENDPOINT, staged)[0] == "large"
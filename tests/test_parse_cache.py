@@ -0,0 +1,84 @@
+import io
+import os
+
+import pytest
+
+from services import file_parser_service
+from services.parse_cache import ParseCache, content_hash
+
+
+class Upload(io.BytesIO):
+    def __init__(self, data: bytes, name: str, type: str = "text/plain"):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+
+
+def age(cache: ParseCache, key: str, mtime: float):
+    os.utime(cache._path(key), (mtime, mtime))
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=1 << 20)
+    for i in range(3):
+        cache.put(f"k{i}", {"blob": os.urandom(1500).hex()})
+        age(cache, f"k{i}", 1000 + i)
+    # Room for three and a half entries
+    cache.max_bytes = int(3.5 * os.path.getsize(cache._path("k0")))
+
+    # A hit refreshes k0, so k1 is now the least recently used
+    assert cache.get("k0") is not None
+    cache.put("k3", {"blob": os.urandom(1500).hex()})
+
+    assert cache.get("k1") is None
+    assert cache.get("k0") is not None
+    assert cache.get("k2") is not None
+    assert cache.get("k3") is not None
+    total = sum(e.stat().st_size for e in os.scandir(tmp_path))
+    assert total <= cache.max_bytes
+
+
+def test_entry_larger_than_limit_is_not_kept(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=100)
+    cache.put("big", {"blob": os.urandom(1000).hex()})
+    assert cache.get("big") is None
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ParseCache(str(tmp_path / "off"), max_bytes=0)
+    cache.put("k", {"x": 1})
+    assert cache.get("k") is None
+    assert not (tmp_path / "off").exists()
+
+
+def test_unreadable_entry_is_dropped(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=10_000)
+    cache.put("k", {"x": 1})
+    with open(cache._path("k"), "wb") as f:
+        f.write(b"not gzip")
+    assert cache.get("k") is None
+    assert not os.path.exists(cache._path("k"))
+
+
+def test_content_hash_rewinds():
+    upload = Upload(b"abc", "a.txt")
+    upload.read()
+    assert content_hash(upload) == content_hash(Upload(b"abc", "b.txt"))
+    assert upload.tell() == 0
+
+
+def test_key_covers_name_and_output_settings(monkeypatch):
+    key = file_parser_service.cache_key(Upload(b"a,b\n1,2\n", "one.csv"), "text")
+    assert key == file_parser_service.cache_key(Upload(b"a,b\n1,2\n", "one.csv"), "text")
+    assert key != file_parser_service.cache_key(Upload(b"a,b\n1,2\n", "two.csv"), "text")
+    monkeypatch.setattr(file_parser_service, "TABLE_SAMPLE_ROWS", 5)
+    assert key != file_parser_service.cache_key(Upload(b"a,b\n1,2\n", "one.csv"), "text")
+
+
+def test_parse_file_hits_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_parser_service, "parse_cache", ParseCache(str(tmp_path), 1 << 20))
+    stats = {}
+    first = file_parser_service.parse_file(Upload(b"hello world", "a.txt"), "default", stats)
+    assert "cached" not in stats
+    second = file_parser_service.parse_file(Upload(b"hello world", "a.txt"), "default", stats)
+    assert stats["cached"] and first == second == ("hello world", False)
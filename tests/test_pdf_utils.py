@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+import pdf_utils
+
+
+def open_paths():
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        pytest.skip("needs /proc")
+    paths = set()
+    for fd in os.listdir(fd_dir):
+        try:
+            paths.add(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            continue
+    return paths
+
+
+def test_extract_pages_leaves_no_open_document(tmp_path):
+    path = str(tmp_path / "doc.pdf")
+    doc = fitz.open()
+    for i in range(5):
+        doc.new_page().insert_text((72, 72), f"page {i}")
+    doc.save(path)
+    doc.close()
+
+    texts = pdf_utils._extract_pages(path, 1, 4)
+    assert [t.strip() for t in texts] == ["page 1", "page 2", "page 3"]
+    assert path not in open_paths()
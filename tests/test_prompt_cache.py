@@ -0,0 +1,42 @@
+import pytest
+
+from model_serving_utils import _request_messages
+from services import token_truncation
+from services.context_builder import build_context_window
+from services.tokenizer_registry import EstimatedTokenizer
+
+ENDPOINT = "databricks-claude-sonnet-4"
+
+
+@pytest.fixture(autouse=True)
+def fixed_tokenizer(monkeypatch):
+    tokenizer = EstimatedTokenizer("test", 4.0)
+    monkeypatch.setattr(token_truncation, "get_tokenizer", lambda model_key="default": tokenizer)
+    monkeypatch.delenv("CONTEXT_TOKEN_BUDGETS", raising=False)
+
+
+def marked_texts(messages):
+    return [
+        part["text"]
+        for m in messages if isinstance(m["content"], list)
+        for part in m["content"] if part.get("cache_control")
+    ]
+
+
+def test_uploaded_document_is_cached_on_upload_and_reread_next_turn():
+    upload = {"role": "user", "content": "Report text. " * 6_000 + "\n\nUser: summarize this"}
+    history = [{"role": "system", "content": "Be brief."}, upload]
+
+    first = _request_messages(ENDPOINT, build_context_window(history, ENDPOINT))
+    assert marked_texts(first) == [upload["content"]]
+
+    history += [{"role": "assistant", "content": "A report."}, {"role": "user", "content": "And section 3?"}]
+    second = _request_messages(ENDPOINT, build_context_window(history, ENDPOINT))
+    assert marked_texts(second) == [upload["content"]]
+    # Everything up to the breakpoint is byte-identical to the first request
+    assert second[:2] == first
+
+
+def test_short_messages_are_not_marked():
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    assert _request_messages(ENDPOINT, messages) == messages
@@ -0,0 +1,73 @@
+import pytest
+
+import model_serving_utils
+import response_cache
+from response_cache import ResponseCache, make_key
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(max_entries=10, ttl_seconds=30)
+    cache.put("a", 1)
+    now[0] += 29
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_key_normalizes_messages_but_not_params():
+    messages = [{"role": "User", "content": "Hi there\r\n"}]
+    same = [{"role": "user", "content": "  Hi there"}]
+    assert make_key("ep", messages, {"max_tokens": 10}) == make_key("ep", same, {"max_tokens": 10})
+    assert make_key("ep", messages, {"max_tokens": 10}) != make_key("ep", messages, {"max_tokens": 20})
+    assert make_key("ep", messages, {"max_tokens": 10}) != make_key("other", messages, {"max_tokens": 10})
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {
+            "choices": [{"message": {"role": "assistant", "content": "Hello"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1},
+        }
+
+
+@pytest.fixture
+def enabled_cache(monkeypatch):
+    calls = []
+
+    def post(endpoint_name, payload, stream=False):
+        calls.append(payload)
+        return FakeResponse()
+
+    monkeypatch.setattr(model_serving_utils, "_post_invocation", post)
+    monkeypatch.setattr(response_cache, "CACHE_ENDPOINTS", {"ep"})
+    monkeypatch.setattr(response_cache, "cache", ResponseCache(8, 60))
+    return calls
+
+
+def test_query_is_served_from_cache(enabled_cache):
+    messages = [{"role": "user", "content": "Hi"}]
+    first, usage = model_serving_utils.query_endpoint_with_usage("ep", messages, max_tokens=10)
+    second, cached_usage = model_serving_utils.query_endpoint_with_usage("ep", messages, max_tokens=10)
+    assert first == second
+    assert second["content"] == "Hello"
+    assert len(enabled_cache) == 1
+    assert not usage.get("cache_hit") and cached_usage["cache_hit"]
+    model_serving_utils.query_endpoint_with_usage("ep", messages, max_tokens=10, use_cache=False)
+    assert len(enabled_cache) == 2
@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+import model_serving_utils
+from model_serving_utils import EndpointError, _backoff_delay, stream_endpoint_with_usage
+from serving_limiter import EndpointLimiter, QueueTimeout, limiter
+
+
+class FakeStreamResponse:
+    status_code = 200
+
+    def __init__(self, lines):
+        self._lines = lines
+        self.closed = False
+
+    def iter_lines(self, decode_unicode=True):
+        yield from self._lines
+
+    def close(self):
+        self.closed = True
+
+
+SSE_LINES = [
+    'data: {"choices": [{"delta": {"content": "Hel"}}]}',
+    'data: {"choices": [{"delta": {"content": "lo"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 2}}',
+    "data: [DONE]",
+]
+
+
+@pytest.fixture
+def fake_post(monkeypatch):
+    responses = []
+
+    def post(endpoint_name, payload, stream=False):
+        resp = FakeStreamResponse(SSE_LINES)
+        responses.append(resp)
+        return resp
+
+    monkeypatch.setattr(model_serving_utils, "_post_invocation", post)
+    return responses
+
+
+def active(endpoint_name):
+    return limiter.stats()[endpoint_name]["active"]
+
+
+def test_limiter_admits_in_order_and_times_out():
+    lim = EndpointLimiter(1, {}, queue_timeout=0.2)
+    lim.acquire("ep")
+    with pytest.raises(QueueTimeout):
+        lim.acquire("ep")
+    lim.release("ep")
+    assert lim.acquire("ep") >= 0
+    assert lim.stats()["ep"]["timeouts"] == 1
+
+
+def test_limiter_release_wakes_waiter():
+    lim = EndpointLimiter(1, {}, queue_timeout=5)
+    lim.acquire("ep")
+    admitted = threading.Event()
+
+    def waiter():
+        lim.acquire("ep")
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not admitted.wait(0.1)
+    lim.release("ep")
+    assert admitted.wait(2)
+    thread.join()
+
+
+def test_stream_releases_slot_when_exhausted(fake_post):
+    stream = stream_endpoint_with_usage("limiter-exhausted", [{"role": "user", "content": "hi"}])
+    assert active("limiter-exhausted") == 1
+    assert "".join(stream) == "Hello"
+    assert stream.usage["prompt_tokens"] == 3
+    assert active("limiter-exhausted") == 0
+    assert fake_post[0].closed
+
+
+def test_stream_releases_slot_when_closed_unread(fake_post):
+    stream = stream_endpoint_with_usage("limiter-unread", [{"role": "user", "content": "hi"}])
+    assert active("limiter-unread") == 1
+    stream.close()
+    assert active("limiter-unread") == 0
+    assert fake_post[0].closed
+
+
+def test_stream_releases_slot_once(fake_post):
+    # Another request holds a slot; double release must not free it
+    limiter.acquire("limiter-once")
+    stream = stream_endpoint_with_usage("limiter-once", [{"role": "user", "content": "hi"}])
+    iterator = iter(stream)
+    next(iterator)
+    stream.close()
+    stream.close()
+    del iterator
+    assert active("limiter-once") == 1
+    limiter.release("limiter-once")
+
+
+def test_backoff_caps_retry_after():
+    assert _backoff_delay(0, model_serving_utils.BACKOFF_MAX_SECONDS + 1) is None
+    assert _backoff_delay(0, 0.1) <= model_serving_utils.BACKOFF_MAX_SECONDS
+    assert 0 <= _backoff_delay(10, None) <= model_serving_utils.BACKOFF_MAX_SECONDS
+
+
+def test_long_retry_after_raises_without_sleeping(monkeypatch):
+    def post(endpoint_name, payload, stream=False):
+        raise EndpointError(endpoint_name, 429, "slow down", retry_after=300)
+
+    monkeypatch.setattr(model_serving_utils, "_post_invocation", post)
+    monkeypatch.setattr(model_serving_utils.time, "sleep", lambda s: pytest.fail("slept for Retry-After"))
+    with pytest.raises(EndpointError):
+        model_serving_utils._invoke("limiter-retry-after", {})
+    assert active("limiter-retry-after") == 0
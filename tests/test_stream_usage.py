@@ -0,0 +1,70 @@
+import pytest
+
+import model_serving_utils
+import response_cache
+from services.model_service import ModelService
+
+NO_USAGE_LINES = [
+    'data: {"choices": [{"delta": {"content": "Hello "}}]}',
+    'data: {"choices": [{"delta": {"content": "there"}}]}',
+    "data: [DONE]",
+]
+USAGE_LINES = NO_USAGE_LINES[:2] + [
+    'data: {"choices": [], "usage": {"prompt_tokens": 12, "completion_tokens": 2}}',
+    "data: [DONE]",
+]
+
+
+class FakeStreamResponse:
+    status_code = 200
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def iter_lines(self, decode_unicode=True):
+        yield from self._lines
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    payloads = []
+    lines = []
+
+    def post(endpoint_name, payload, stream=False):
+        payloads.append(payload)
+        return FakeStreamResponse(lines)
+
+    monkeypatch.setattr(model_serving_utils, "_post_invocation", post)
+    monkeypatch.setattr(response_cache, "CACHE_ENDPOINTS", set())
+    monkeypatch.setenv("STREAM_RESPONSES", "1")
+    return payloads, lines
+
+
+def consume(stream):
+    try:
+        return "".join(stream)
+    finally:
+        stream.close()
+
+
+def test_stream_asks_for_usage(serve):
+    payloads, lines = serve
+    lines.extend(USAGE_LINES)
+    stream = ModelService().stream_response("databricks-llama-4", [{"role": "user", "content": "Hi"}], failover=False)
+    assert consume(stream) == "Hello there"
+    assert payloads[0]["stream_options"] == {"include_usage": True}
+    assert stream.usage["prompt_tokens"] == 12 and not stream.usage.get("estimated")
+
+
+def test_missing_usage_is_estimated_and_flagged(serve):
+    _, lines = serve
+    lines.extend(NO_USAGE_LINES)
+    service = ModelService()
+    stream = service.stream_response("databricks-llama-4", [{"role": "user", "content": "Hi " * 100}], failover=False)
+    consume(stream)
+    assert stream.usage["estimated"]
+    tokens_in, tokens_out = service.usage_tokens(stream.usage)
+    assert tokens_in > 0 and tokens_out > 0
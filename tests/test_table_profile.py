@@ -0,0 +1,60 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from services import table_profile
+from services.table_profile import ColumnProfile, TableProfile, profile_csv
+
+
+def test_reservoir_sample_size_and_uniformity():
+    rows, k, trials = 100, 10, 400
+    hits = np.zeros(rows)
+    for seed in range(trials):
+        profile = TableProfile("t", sample_rows=k, seed=seed)
+        for start in range(0, rows, 7):
+            profile.update(pd.DataFrame({"i": range(start, min(start + 7, rows))}))
+        assert len(profile.sample) == k
+        assert len({r["i"] for r in profile.sample}) == k
+        for r in profile.sample:
+            hits[r["i"]] += 1
+    # Each row is kept with probability k / rows; allow a generous band around the expectation
+    expected = trials * k / rows
+    assert hits.min() > expected * 0.4
+    assert hits.max() < expected * 1.8
+    assert abs(hits[: rows // 2].sum() - hits[rows // 2:].sum()) < 0.15 * hits.sum()
+
+
+def test_sample_keeps_all_rows_of_small_table():
+    profile = TableProfile("t", sample_rows=20)
+    profile.update(pd.DataFrame({"i": range(5)}))
+    assert [r["i"] for r in profile.sample] == list(range(5))
+
+
+def test_mean_and_variance_merge_across_chunks():
+    data = np.random.default_rng(1).normal(50, 12, 10_001)
+    column = ColumnProfile("x")
+    for chunk in np.array_split(data, [3, 1000, 1001, 7000]):
+        column.update(pd.Series(chunk))
+    assert column.numeric_count == len(data)
+    assert np.isclose(column.mean, data.mean())
+    assert np.isclose(column.m2 / (column.numeric_count - 1), data.var(ddof=1))
+    assert column.min == data.min() and column.max == data.max()
+
+
+def test_header_only_csv_keeps_columns():
+    text = profile_csv(io.BytesIO(b"id,name,score\n"), "empty.csv")
+    assert "0 rows x 3 columns" in text
+    for column in ("id", "name", "score"):
+        assert f"- {column} (" in text
+
+
+def test_top_values_survive_distinct_cap(monkeypatch):
+    monkeypatch.setattr(table_profile, "TABLE_DISTINCT_CAP", 10)
+    column = ColumnProfile("city")
+    column.update(pd.Series(["Oslo"] * 50 + [f"town{i}" for i in range(30)]))
+    column.update(pd.Series(["Oslo"] * 10 + [f"village{i}" for i in range(30)]))
+    assert column.distinct_capped
+    assert len(column.top) <= 10
+    assert "10+ distinct" in column.describe()
+    assert "top (approx.): Oslo" in column.describe()
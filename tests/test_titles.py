@@ -0,0 +1,20 @@
+from conversations import extractive_title
+
+
+def test_attached_document_does_not_outweigh_the_question():
+    boilerplate = "Confidential draft. Internal use only. Copyright Contoso Corporation. " * 300
+    messages = [
+        {"role": "user", "content": f"{boilerplate}\n\nUser: What are the payment terms in this invoice?"},
+        {"role": "assistant", "content": "Payment is due within 30 days of the invoice date."},
+    ]
+    title, count = extractive_title(messages)
+    assert count > 0
+    words = title.lower().split()
+    assert "payment" in words and "invoice" in words
+    assert not {"confidential", "contoso", "copyright", "corporation"} & set(words)
+
+
+def test_plain_question_titles_from_its_keywords():
+    title, count = extractive_title([{"role": "user", "content": "How do I tune Spark shuffle partitions?"}])
+    assert count >= 2
+    assert "Spark" in title and "Shuffle" in title
@@ -0,0 +1,71 @@
+import pytest
+
+from services import token_truncation
+from services.token_truncation import split_by_tokens, truncate_stream
+from services.tokenizer_registry import EstimatedTokenizer
+
+MARKER = "\n\n[... truncated ...]\n\n"
+
+
+@pytest.fixture(autouse=True)
+def fixed_tokenizer(monkeypatch):
+    # 4 characters per token, with chunks small enough to cross several boundaries
+    tokenizer = EstimatedTokenizer("test", 4.0)
+    monkeypatch.setattr(token_truncation, "get_tokenizer", lambda model_key="default": tokenizer)
+    monkeypatch.setattr(token_truncation, "TRUNCATION_CHUNK_CHARS", 64)
+    return tokenizer
+
+
+def words(n):
+    return " ".join(f"w{i:05d}" for i in range(n))
+
+
+def pieces(text, size=50):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_short_text_is_returned_unchanged():
+    text = words(20)
+    assert truncate_stream(text, 1000) == (text, False)
+    assert truncate_stream(pieces(text), 1000) == (text, False)
+
+
+def test_head_keeps_prefix_within_limit(fixed_tokenizer):
+    text = words(2000)
+    head, truncated = truncate_stream(pieces(text), 300)
+    assert truncated
+    assert text.startswith(head)
+    assert fixed_tokenizer.count(head) <= 300
+    assert len(head) > 300 * 4 - 64
+
+
+def test_head_stops_reading_at_limit():
+    consumed = []
+
+    def source():
+        for piece in pieces(words(20000)):
+            consumed.append(piece)
+            yield piece
+
+    truncate_stream(source(), 100)
+    assert len(consumed) < 10
+
+
+@pytest.mark.parametrize("as_stream", [False, True])
+def test_head_tail_keeps_both_ends(fixed_tokenizer, as_stream):
+    text = words(5000)
+    result, truncated = truncate_stream(pieces(text) if as_stream else text, 400, mode="head_tail", marker=MARKER)
+    assert truncated
+    head, tail = result.split(MARKER)
+    assert text.startswith(head) and text.endswith(tail)
+    assert fixed_tokenizer.count(head) <= 200
+    assert fixed_tokenizer.count(tail) <= 200
+    assert fixed_tokenizer.count(head + tail) > 400 - 40
+
+
+def test_split_by_tokens_covers_text_in_bounded_parts(fixed_tokenizer):
+    text = words(3000)
+    parts = list(split_by_tokens(pieces(text), 500, step_chars=256))
+    assert "".join(parts) == text
+    assert len(parts) > 1
+    assert all(fixed_tokenizer.count(p) <= 500 for p in parts)
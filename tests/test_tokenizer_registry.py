@@ -0,0 +1,40 @@
+import pytest
+
+from services.token_truncation import TokenCountCache
+from services.tokenizer_registry import EstimatedTokenizer, TokenizerRegistry
+
+tokenizers = pytest.importorskip("tokenizers")
+
+
+def write_tokenizer(path, vocab):
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    tokenizer = tokenizers.Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(path))
+
+
+def test_same_basename_gets_distinct_names(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    write_tokenizer(tmp_path / "a" / "tokenizer.json", {"[UNK]": 0, "hello": 1})
+    write_tokenizer(tmp_path / "b" / "tokenizer.json", {"[UNK]": 0, "world": 1})
+    registry = TokenizerRegistry(
+        {"claude": str(tmp_path / "a" / "tokenizer.json"), "llama": str(tmp_path / "b" / "tokenizer.json")},
+        str(tmp_path / "missing"),
+    )
+
+    claude, llama = registry.get("claude"), registry.get("llama")
+    assert claude.cacheable and llama.cacheable
+    assert claude.name != llama.name
+    assert claude.name.startswith("claude:") and llama.name.startswith("llama:")
+    assert TokenCountCache.key(claude.name, "hello") != TokenCountCache.key(llama.name, "hello")
+    assert claude.count("hello world") == 2
+
+
+def test_missing_files_fall_back_to_estimate(tmp_path):
+    registry = TokenizerRegistry({}, str(tmp_path))
+    tokenizer = registry.get("gemma")
+    assert isinstance(tokenizer, EstimatedTokenizer)
+    assert tokenizer.count("x" * 40) == 10
@@ -0,0 +1,41 @@
+import pytest
+
+import db
+from model_serving_utils import _normalize_usage, usage_breakdown
+
+
+@pytest.fixture(autouse=True)
+def prices(monkeypatch):
+    # Per 1K tokens: prompt $1, completion $2, cache read $0.10, cache write 1.25x prompt
+    monkeypatch.setattr(db, "MODEL_PRICES", {"ep": (1.0, 2.0, 0.1)})
+    monkeypatch.setattr(db, "PRICE_CACHE_WRITE_MULTIPLIER", 1.25)
+
+
+def cost(usage):
+    normalized = _normalize_usage(usage)
+    return db.estimate_cost(
+        normalized["prompt_tokens"], normalized["completion_tokens"], normalized["cached_tokens"],
+        model="ep", cache_write_tokens=normalized["cache_write_tokens"],
+    )
+
+
+def test_openai_usage_counts_cache_reads_inside_prompt_tokens():
+    usage = {"prompt_tokens": 3000, "completion_tokens": 500, "prompt_tokens_details": {"cached_tokens": 2000}}
+    assert usage_breakdown(usage) == (1000, 2000, 0, 500)
+    assert _normalize_usage(usage)["prompt_tokens"] == 3000
+    assert cost(usage) == pytest.approx(1.0 + 0.2 + 1.0)
+
+
+def test_anthropic_usage_adds_cache_reads_and_writes_to_input_tokens():
+    usage = {"input_tokens": 1000, "output_tokens": 500,
+             "cache_read_input_tokens": 2000, "cache_creation_input_tokens": 4000}
+    assert usage_breakdown(usage) == (1000, 2000, 4000, 500)
+    normalized = _normalize_usage(usage)
+    assert (normalized["prompt_tokens"], normalized["completion_tokens"]) == (7000, 500)
+    assert cost(usage) == pytest.approx(1.0 + 0.2 + 5.0 + 1.0)
+
+
+def test_normalizing_twice_changes_nothing():
+    usage = _normalize_usage({"input_tokens": 10, "output_tokens": 5, "cache_creation_input_tokens": 40})
+    assert _normalize_usage(usage) == usage
+    assert usage_breakdown(usage) == (10, 0, 40, 5)
@@ -0,0 +1 @@
+# tools/__init__.py - Developer and operations tools (run with python -m tools.<name>)
@@ -0,0 +1,241 @@
+# tools/batch_inference.py - Headless batch inference over the configured serving endpoints
+"""
+Runs a file of conversations through query_endpoint_with_usage with bounded
+concurrency and a request-rate limit, writes one result per conversation and
+logs usage to usage_events in bulk.
+
+    python -m tools.batch_inference --input evals.jsonl --output results.jsonl \\
+        --endpoint databricks-claude-sonnet-4 --concurrency 8 --rps 4
+
+Input rows (JSONL, or CSV with the same column names):
+    {"id": "q1", "prompt": "...", "system": "...", "endpoint": "...", "max_tokens": 400}
+    {"id": "q2", "messages": [{"role": "user", "content": "..."}]}
+
+Results are appended to a JSONL checkpoint in batches, each written only
+after its usage has been logged, so an interrupted run resumes by skipping
+ids already present without losing or repeating usage. The default run id is
+derived from the output path, so a resumed run keeps its tag. With a
+.parquet output the checkpoint is <output>.jsonl and the Parquet file is
+written at the end.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Set
+
+import db
+from model_serving_utils import query_endpoint_with_usage
+
+# Results per usage flush; below log_usage_batch's chunk size, so each flush is one INSERT that succeeds or fails whole
+USAGE_FLUSH_EVERY = 200
+
+class RateLimiter:
+    """Spaces request starts to at most `rate` per second across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield input rows from a JSONL or CSV file, assigning ids where missing"""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                row.setdefault("id", None)
+                row["id"] = row["id"] or str(i)
+                yield row
+    else:
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    row = json.loads(line)
+                    row["id"] = str(row.get("id") or i)
+                    yield row
+
+def row_messages(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Chat messages for an input row"""
+    messages = row.get("messages")
+    if isinstance(messages, str):
+        messages = json.loads(messages)
+    if messages:
+        return messages
+    messages = []
+    if row.get("system"):
+        messages.append({"role": "system", "content": row["system"]})
+    messages.append({"role": "user", "content": row.get("prompt") or ""})
+    return messages
+
+def completed_ids(checkpoint: str) -> Set[str]:
+    """Ids already written to the checkpoint by an earlier run"""
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written last line of an interrupted run
+                if not result.get("error"):
+                    done.add(str(result.get("id")))
+    return done
+
+def run_row(row: Dict[str, Any], default_endpoint: str, default_max_tokens: int, rate: RateLimiter) -> Dict[str, Any]:
+    """Query the endpoint for one row and return its result record"""
+    endpoint = row.get("endpoint") or default_endpoint
+    max_tokens = int(row.get("max_tokens") or default_max_tokens)
+    rate.wait()
+    start = time.perf_counter()
+    try:
+        reply_msg, usage = query_endpoint_with_usage(endpoint, row_messages(row), max_tokens=max_tokens)
+        return {
+            "id": row["id"],
+            "endpoint": endpoint,
+            "response": reply_msg.get("content", "") if isinstance(reply_msg, dict) else str(reply_msg),
+            "tokens_in": int(usage.get("prompt_tokens", 0) or 0),
+            "tokens_out": int(usage.get("completion_tokens", 0) or 0),
+            "cached_tokens": int(usage.get("cached_tokens", 0) or 0),
+            "cache_write_tokens": int(usage.get("cache_write_tokens", 0) or 0),
+            "cache_hit": bool(usage.get("cache_hit")),
+            "latency_s": round(time.perf_counter() - start, 3),
+            "error": None,
+        }
+    except Exception as e:
+        return {
+            "id": row["id"],
+            "endpoint": endpoint,
+            "response": None,
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "cached_tokens": 0,
+            "cache_write_tokens": 0,
+            "cache_hit": False,
+            "latency_s": round(time.perf_counter() - start, 3),
+            "error": str(e),
+        }
+
+def _usage_event(result: Dict[str, Any], run_id: str, user_id: str) -> Dict[str, Any]:
+    return {
+        "conv_id": f"batch-{run_id}-{result['id']}",
+        "user_id": user_id,
+        "model": result["endpoint"],
+        "tokens_in": result["tokens_in"],
+        "tokens_out": result["tokens_out"],
+        "cache_hit": result["cache_hit"],
+        "cached_tokens": result["cached_tokens"],
+        "cache_write_tokens": result.get("cache_write_tokens", 0),
+        "meta": {"source": "batch", "batch_run_id": run_id},
+    }
+
+def default_run_id(output: str) -> str:
+    """Run id for an output file, stable across resumes of the same run"""
+    return hashlib.sha256(os.path.abspath(output).encode("utf-8")).hexdigest()[:12]
+
+def write_parquet(checkpoint: str, output: str):
+    """Convert the JSONL checkpoint to a Parquet file"""
+    import pandas as pd
+    df = pd.read_json(checkpoint, lines=True, dtype={"id": str})
+    df = df.drop_duplicates("id", keep="last")
+    df.to_parquet(output, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch inference over serving endpoints")
+    parser.add_argument("--input", required=True, help="JSONL or CSV of conversations")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl or .parquet)")
+    parser.add_argument("--endpoint", default=os.getenv("SERVING_ENDPOINT", ""), help="Default endpoint for rows without one")
+    parser.add_argument("--max-tokens", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--rps", type=float, default=0, help="Maximum request starts per second (0 for no limit)")
+    parser.add_argument("--run-id", default="", help="Tag for usage events (default: derived from --output)")
+    parser.add_argument("--no-usage", action="store_true", help="Do not log usage to the database")
+    args = parser.parse_args()
+
+    parquet = args.output.lower().endswith(".parquet")
+    checkpoint = args.output + ".jsonl" if parquet else args.output
+    done = completed_ids(checkpoint)
+    rows = [r for r in read_rows(args.input) if r["id"] not in done]
+    if any(not (r.get("endpoint") or args.endpoint) for r in rows):
+        parser.error("--endpoint (or SERVING_ENDPOINT) is required for rows without an endpoint")
+
+    run_id = args.run_id or default_run_id(args.output)
+    log_usage = not args.no_usage and db.ENABLE_LOGGING and bool(db.WAREHOUSE_ID)
+    user_id = db.current_user() if log_usage else "unknown_user"
+    print(f"Run {run_id}: {len(rows)} rows to process, {len(done)} already done")
+
+    rate = RateLimiter(args.rps)
+    pending: List[Dict[str, Any]] = []
+    flush_every = USAGE_FLUSH_EVERY if log_usage else 1
+    ok = failed = 0
+    usage_failed = False
+    start = time.perf_counter()
+
+    def flush(out) -> bool:
+        """Log usage for the pending results, then checkpoint them; False if usage could not be logged"""
+        # Usage first: a result in the checkpoint is never re-run, so its usage must already be logged
+        nonlocal pending
+        if not pending:
+            return True
+        if log_usage:
+            events = [_usage_event(r, run_id, user_id) for r in pending if not r["error"]]
+            if events and db.log_usage_batch(events) < len(events):
+                return False
+        out.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in pending))
+        out.flush()
+        pending = []
+        return True
+
+    with open(checkpoint, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_row, row, args.endpoint, args.max_tokens, rate) for row in rows]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                pending.append(result)
+                if result["error"]:
+                    failed += 1
+                else:
+                    ok += 1
+                if len(pending) >= flush_every and not flush(out):
+                    usage_failed = True
+                    break
+                if (ok + failed) % 50 == 0:
+                    print(f"  {ok + failed}/{len(rows)} done ({failed} failed)")
+        except KeyboardInterrupt:
+            print("Interrupted; rerun the same command to resume")
+        finally:
+            for f in futures:
+                f.cancel()
+            if not usage_failed and not flush(out):
+                usage_failed = True
+
+    if usage_failed:
+        sys.exit(f"Could not log usage for {len(pending)} results; they were not checkpointed. "
+                 "Rerun the same command to retry them")
+
+    elapsed = time.perf_counter() - start
+    print(f"Finished {ok} ok, {failed} failed in {elapsed:.1f}s ({ok / elapsed if elapsed else 0:.2f} rows/s)")
+
+    if parquet:
+        try:
+            write_parquet(checkpoint, args.output)
+            print(f"Wrote {args.output}")
+        except ImportError:
+            print(f"Parquet output needs pyarrow; results are in {checkpoint}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# tools/load_harness.py - End-to-end chat load test against a real or mock endpoint
+"""
+Drives ModelService.generate_response plus ConversationService.log_conversation
+at a fixed concurrency and reports throughput and latency percentiles.
+
+    python -m tools.load_harness --mock --concurrency 32 --requests 500
+    python -m tools.load_harness --endpoint databricks-claude-sonnet-4 --concurrency 8 --requests 100
+
+With --mock a local mock endpoint is started in-process and SERVING_BASE_URL
+points at it, so the reported overhead is the app's own cost per request.
+Conversation logging only writes to the database when DATABRICKS_WAREHOUSE_ID is set.
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100.0 * len(values)))]
+
+def _run_one(model_service, conversation_service, endpoint: str, prompt: str) -> Dict[str, Any]:
+    conv_id = str(uuid.uuid4())
+    messages = [{"role": "user", "content": prompt}]
+    start = time.perf_counter()
+    try:
+        reply, tokens_in, tokens_out = model_service.generate_response(endpoint, messages)
+        model_done = time.perf_counter()
+        messages.append({"role": "assistant", "content": reply})
+        conversation_service.log_conversation(conv_id, messages, endpoint, tokens_in, tokens_out)
+        end = time.perf_counter()
+        return {"ok": True, "latency_s": end - start, "log_s": end - model_done, "tokens_out": tokens_out}
+    except Exception as e:
+        return {"ok": False, "latency_s": time.perf_counter() - start, "log_s": 0.0, "tokens_out": 0, "error": str(e)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat load harness")
+    parser.add_argument("--endpoint", default="mock-chat", help="Serving endpoint name")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous chatters")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests to send")
+    parser.add_argument("--prompt-chars", type=int, default=2000, help="Size of each prompt")
+    parser.add_argument("--mock", action="store_true", help="Start a local mock endpoint and target it")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--mock-latency-ms", type=float, default=200)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.mock:
+        from tools.mock_serving_endpoint import MockConfig, serve
+        serve(MockConfig(latency_ms=args.mock_latency_ms, error_rate=args.mock_error_rate),
+              port=args.mock_port, background=True)
+        # Must be set before model_serving_utils is imported
+        os.environ["SERVING_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}"
+        os.environ.setdefault("ENDPOINT_MAX_CONCURRENCY", str(max(args.concurrency, 1)))
+        os.environ.setdefault("MODEL_POOL_SIZE", str(max(args.concurrency, 10)))
+
+    from services.model_service import ModelService
+    from services.conversation_service import ConversationService
+
+    model_service = ModelService()
+    conversation_service = ConversationService()
+    prompt = ("Summarize the quarterly results. " * (args.prompt_chars // 33 + 1))[:args.prompt_chars]
+
+    print(f"Sending {args.requests} requests to {args.endpoint} at concurrency {args.concurrency}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda _: _run_one(model_service, conversation_service, args.endpoint, prompt),
+            range(args.requests),
+        ))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency_s"] for r in ok]
+    errors = [r for r in results if not r["ok"]]
+
+    print(f"\nCompleted {len(ok)}/{len(results)} in {elapsed:.2f}s")
+    print(f"Throughput: {len(ok) / elapsed:.1f} req/s, {sum(r['tokens_out'] for r in ok) / elapsed:.0f} output tokens/s")
+    for pct in (50, 90, 95, 99):
+        print(f"p{pct}: {_percentile(latencies, pct) * 1000:.0f} ms")
+    if ok:
+        print(f"Avg logging time: {sum(r['log_s'] for r in ok) / len(ok) * 1000:.1f} ms")
+    if args.mock and latencies:
+        overhead = _percentile(latencies, 50) * 1000 - args.mock_latency_ms
+        print(f"App overhead (p50 - mock latency): {overhead:.0f} ms")
+    if errors:
+        print(f"Errors: {len(errors)} (first: {errors[0]['error']})")
+
+if __name__ == "__main__":
+    main()
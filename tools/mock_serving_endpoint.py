@@ -0,0 +1,171 @@
+# tools/mock_serving_endpoint.py - Local mock of a Databricks/OpenAI chat serving endpoint
+"""
+Serves chat completions with configurable latency, token counts, streaming
+and errors so the app's own overhead can be measured without a real model.
+
+    python -m tools.mock_serving_endpoint --port 8765 --latency-ms 300 --error-rate 0.05
+    SERVING_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+Routes:
+    POST /serving-endpoints/<name>/invocations   Databricks chat API
+    POST /v1/chat/completions                    OpenAI chat API
+    GET  /api/2.0/serving-endpoints/<name>       Endpoint readiness (always READY)
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+class MockConfig:
+    """Behaviour of the mock endpoint"""
+
+    def __init__(self, latency_ms: float = 200, ttft_ms: float = 100, tokens_per_second: float = 50,
+                 completion_tokens: int = 64, error_rate: float = 0.0, error_status: int = 429,
+                 retry_after: float = 1.0, chars_per_token: float = 4.0):
+        self.latency_ms = latency_ms
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.chars_per_token = chars_per_token
+
+def _prompt_tokens(messages: List[Dict[str, Any]], chars_per_token: float) -> int:
+    chars = 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            chars += sum(len(p.get("text", "")) for p in content if isinstance(p, dict))
+        else:
+            chars += len(str(content or ""))
+    return max(1, int(chars / chars_per_token))
+
+def make_handler(config: MockConfig):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/api/2.0/serving-endpoints/"):
+                name = self.path.rsplit("/", 1)[-1]
+                self._send_json(200, {
+                    "name": name,
+                    "state": {"ready": "READY", "config_update": "NOT_UPDATING"},
+                    "config": {"served_entities": [{"state": {"deployment": "DEPLOYMENT_READY"}}]},
+                })
+            else:
+                self._send_json(404, {"message": "Not found"})
+
+        def do_POST(self):
+            if not (self.path.endswith("/invocations") or self.path == "/v1/chat/completions"):
+                self._send_json(404, {"message": "Not found"})
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0") or "0")) or b"{}")
+
+            if random.random() < config.error_rate:
+                time.sleep(config.ttft_ms / 1000.0)
+                self._send_json(config.error_status, {"error_code": "MOCK_ERROR", "message": "Injected mock error"},
+                                {"Retry-After": str(config.retry_after)} if config.error_status == 429 else None)
+                return
+
+            prompt_tokens = _prompt_tokens(body.get("messages", []), config.chars_per_token)
+            completion_tokens = min(config.completion_tokens, int(body.get("max_tokens") or config.completion_tokens))
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            words = [f"tok{i}" for i in range(completion_tokens)]
+
+            if body.get("stream"):
+                self._stream(words, usage)
+            else:
+                time.sleep(config.latency_ms / 1000.0)
+                self._send_json(200, {
+                    "id": str(uuid.uuid4()),
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        def _stream(self, words: List[str], usage: Dict[str, Any]):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(payload: str):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            time.sleep(config.ttft_ms / 1000.0)
+            delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+            for i, word in enumerate(words):
+                chunk = {"object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                if i == len(words) - 1:
+                    chunk["usage"] = usage
+                send(json.dumps(chunk))
+                time.sleep(delay)
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return MockHandler
+
+def serve(config: MockConfig, host: str = "127.0.0.1", port: int = 8765, background: bool = False) -> ThreadingHTTPServer:
+    """Start the mock server; with background=True it runs on a daemon thread"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name="mock-serving-endpoint", daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock chat serving endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Latency of non-streaming replies")
+    parser.add_argument("--ttft-ms", type=float, default=100, help="Time to first token when streaming")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Streaming speed")
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+    )
+    print(f"Mock serving endpoint on http://{args.host}:{args.port}")
+    serve(config, args.host, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,18 @@ import streamlit as st
 import os
 import db
 from .base_page import BasePage
-from services.file_parser_service import parse_file  # ⬅️ New import
-from services.token_truncation import truncate_to_model_context
+from services import background
+from services.context_meter import measure
+from services.endpoint_monitor import monitor
+from services.endpoint_router import AUTO_ENDPOINT
+from services.inflight import inflight, turn_key
+from services.document_digest import DIGEST_CHUNK_TOKENS, DIGEST_SUMMARY_TOKENS, digest_document
+from services.document_index import RETRIEVAL_CHUNK_CHARS, RETRIEVAL_CHUNK_OVERLAP, DocumentIndex, chunk_text
+from services.file_parser_service import cache_key, extract_text, parse_file  # ⬅️ New import
+from services.parse_cache import parse_cache
+from services.token_truncation import model_key_for_endpoint, truncate_to_model_context
 from auth_utils import debug_auth_info
+from conversations import default_title_from_prompt
 
 
 class ChatPage(BasePage):
@@ -24,12 +33,24 @@ class ChatPage(BasePage):
             self._render_endpoint_not_configured()
             return
 
+        # Wake a scaled-to-zero endpoint while the user is still typing
+        monitor.prewarm(endpoint)
+
         self._render_file_uploader()  # ⬅️ New
-        self._render_chat_history()
-        self._handle_chat_input()
 
-        if self.state_manager.should_generate_response():
-            self._handle_assistant_response()
+        compare_endpoints = self._render_compare_controls()
+        if compare_endpoints:
+            self._render_compare_mode(compare_endpoints)
+        else:
+            self._render_chat_history()
+            self._render_context_meter(endpoint)
+            self._handle_chat_input()
+
+            if self.state_manager.should_generate_response():
+                self._handle_assistant_response()
+
+        if self.state_manager.has_pending_title():
+            self._await_conversation_title()
         
         with st.expander("Debug Auth Info"):
             st.json(debug_auth_info())
@@ -64,30 +85,191 @@ class ChatPage(BasePage):
     #             with st.expander("Preview file content"):
     #                 st.text_area("Document Content", st.session_state["file_context"], height=200)
     def _render_file_uploader(self):
-        file = st.file_uploader("Upload a document", type=["pdf", "csv", "xlsx", "txt", "py", "md"])
+        file = st.file_uploader("Upload a document", type=["pdf", "csv", "xlsx", "txt", "py", "md"],
+                                key=f"document_upload_{st.session_state.upload_generation}")
+        upload_modes = {
+            "truncate": "Include the document (truncated to fit)",
+            "retrieve": "Retrieve relevant passages per question",
+            "summarize": "Summarize if too long",
+        }
+        default_mode = os.getenv("UPLOAD_MODE", "truncate")
+        mode = st.radio(
+            "Document handling",
+            options=list(upload_modes),
+            index=list(upload_modes).index(default_mode) if default_mode in upload_modes else 0,
+            format_func=lambda m: upload_modes[m],
+            horizontal=True,
+            key="upload_mode"
+        )
 
         if file:
-            file_key = f"uploaded_{file.name}"
+            file_key = f"uploaded_{file.name}_{mode}"
             if not st.session_state.get(file_key):
+                if mode == "retrieve":
+                    self._index_document(file, file_key)
+                    return
+
                 with st.spinner("Parsing document..."):
-                    model_key = self.state_manager.get_model_key().lower()
-                    extracted_text, was_truncated = parse_file(file, model_key)
+                    # "auto" is sized for the largest context it may route to
+                    endpoint = self.model_service.upload_endpoint(self.state_manager.get_selected_endpoint())
+                    model_key = model_key_for_endpoint(endpoint)
+                    stats = {}
+                    extracted_text, was_truncated = parse_file(file, model_key, stats)
+                    st.session_state["file_parse_stats"] = stats
+
+                if was_truncated and mode == "summarize":
+                    extracted_text, was_truncated = self._digest_document(file, extracted_text)
 
-                    if extracted_text:
-                        st.session_state["file_context"] = extracted_text
-                        st.session_state[file_key] = True
-                        st.success("File uploaded successfully.")
+                if extracted_text:
+                    self.state_manager.clear_document_index()
+                    st.session_state["file_context"] = extracted_text
+                    st.session_state[file_key] = True
+                    st.success("File uploaded successfully.")
 
-                        if was_truncated:
-                            st.warning("⚠️ The file content was truncated to fit the model’s input limit.")
+                    if was_truncated:
+                        st.warning("⚠️ The file content was truncated to fit the model’s input limit.")
 
-                        st.rerun()
+                    st.rerun()
 
             elif "file_context" in st.session_state:
                 st.success("File uploaded.")
+                self._render_parse_stats()
                 with st.expander("Preview file content"):
                     st.text_area("Document Content", st.session_state["file_context"], height=200)
 
+        index = self.state_manager.get_document_index()
+        if index is not None:
+            col1, col2 = st.columns([4, 1])
+            col1.caption(f"Answering from the {len(index)} passages of {index.name} most relevant to each question.")
+            self._render_parse_stats()
+            if col2.button("Remove document", key="remove_document_index"):
+                self.state_manager.reset_upload()
+                st.rerun()
+
+    def _render_parse_stats(self):
+        # PDF extraction throughput of the last upload, and why its digest fell back to truncation
+        stats = st.session_state.get("file_parse_stats")
+        if stats and stats.get("digest_error"):
+            st.error(stats["digest_error"])
+        if stats and stats.get("cached"):
+            st.caption("Loaded from the parse cache (this file was processed before).")
+        elif stats and stats.get("total_pages"):
+            st.caption(
+                f"Extracted {stats['pages']:,} of {stats['total_pages']:,} pages "
+                f"in {stats['seconds']:.1f}s ({stats['pages_per_s']:.0f} pages/s)"
+            )
+
+    def _index_document(self, file, file_key: str):
+        # Chunk and index the whole document; each question then gets its top passages
+        with st.spinner("Indexing document..."):
+            stats = {}
+            key = cache_key(file, "passages", RETRIEVAL_CHUNK_CHARS, RETRIEVAL_CHUNK_OVERLAP)
+            cached = parse_cache.get(key)
+            if cached is not None:
+                chunks = cached["chunks"]
+                stats["cached"] = True
+            else:
+                chunks = chunk_text(extract_text(file, stats))
+                parse_cache.put(key, {"chunks": chunks})
+            st.session_state["file_parse_stats"] = stats
+            if not chunks:
+                st.warning("No text could be extracted from this file.")
+                return
+            st.session_state.pop("file_context", None)
+            self.state_manager.set_document_index(DocumentIndex(file.name, chunks), file_key)
+            st.session_state[file_key] = True
+        st.rerun()
+
+    def _digest_document(self, file, truncated_text: str):
+        # Map-reduce the whole document into a summary on the selected endpoint, logging every call
+        endpoint = self.state_manager.get_selected_endpoint()
+        if endpoint == AUTO_ENDPOINT:
+            # Routed as the turn that will carry the document
+            staged = self.state_manager.get_messages() + [{"role": "user", "content": truncated_text}]
+            endpoint, _ = self.model_service.resolve_endpoint(endpoint, staged)
+        key = cache_key(file, "digest", endpoint, DIGEST_CHUNK_TOKENS, DIGEST_SUMMARY_TOKENS)
+        cached = parse_cache.get(key)
+        if cached is not None:
+            st.session_state["file_parse_stats"] = {"cached": True}
+            return cached["text"], False
+
+        conv_id = self.state_manager.get_conversation_id()
+        progress = st.progress(0.0, text="Summarizing document...")
+
+        def on_progress(stage: str, done: int, total: int):
+            progress.progress(done / total, text=f"{stage}: {done}/{total}")
+
+        def on_usage(usage: dict):
+            tokens_in, tokens_out = self.model_service.usage_tokens(usage)
+            background.submit(
+                self.conversation_service.log_usage_event, conv_id, endpoint, tokens_in, tokens_out,
+                cache_hit=bool(usage.get("cache_hit")), cached_tokens=int(usage.get("cached_tokens", 0) or 0),
+                cache_write_tokens=int(usage.get("cache_write_tokens", 0) or 0),
+            )
+
+        try:
+            file.seek(0)
+            digest, parts = digest_document(endpoint, file.name, extract_text(file), on_progress, on_usage)
+        except Exception as e:
+            progress.empty()
+            # Kept with the parse stats so the message survives the rerun after upload
+            st.session_state.setdefault("file_parse_stats", {})["digest_error"] = (
+                f"Could not summarize the document, using the truncated text instead: {e}"
+            )
+            return truncated_text, True
+        progress.empty()
+        if not digest:
+            return truncated_text, True
+        text = f"Summary of {file.name} (condensed from {parts} parts):\n\n{digest}"
+        parse_cache.put(key, {"text": text})
+        return text, False
+
+    def _model_messages(self, messages: list) -> list:
+        # Passages retrieved for the latest question go to the model with it; earlier questions are sent bare
+        latest = messages[-1] if messages else {}
+        if latest.get("retrieved_context"):
+            content = f"{latest['retrieved_context']}\n\nUser: {latest['content']}"
+            return messages[:-1] + [{"role": "user", "content": content}]
+        return messages
+
+    def _with_document_context(self, prompt: str, consume: bool = True) -> str:
+        # Staged file text is injected once; an indexed document adds its best passages every turn
+        file_context = st.session_state.pop("file_context", None) if consume else st.session_state.get("file_context")
+        if file_context:
+            return f"{file_context}\n\nUser: {prompt}"
+        index = self.state_manager.get_document_index()
+        if index is not None:
+            return f"{index.context_for(prompt)}\n\nUser: {prompt}"
+        return prompt
+
+    def _render_context_meter(self, endpoint: str):
+        # Estimated size of the next request (history plus staged attachment) against the limit
+        messages = self.state_manager.get_messages()
+        summary = self.state_manager.get_summary()
+        if summary and summary.get("text") and summary.get("covered", 0) > 0:
+            messages = [{"role": "system", "content": summary["text"]}] + messages[summary["covered"]:]
+        if endpoint == AUTO_ENDPOINT:
+            endpoint, _ = self.model_service.resolve_endpoint(endpoint, messages)
+
+        meter = measure(endpoint, messages, st.session_state.get("file_context"))
+        if not meter["limit"] or not meter["tokens"]:
+            return
+        approx = "" if meter["exact"] else "~"
+        st.progress(
+            min(1.0, meter["tokens"] / meter["limit"]),
+            text=f"Context: {approx}{meter['tokens']:,} / {meter['limit']:,} tokens · next reply ≈ ${meter['cost']:.4f}"
+        )
+        if meter["trimmed"]:
+            st.caption("Older turns and attachments are shortened to fit the model's context.")
+
+    def _served_by_caption(self, message: dict) -> str:
+        # Which endpoint answered, when it was not simply the selected one
+        served_by = message.get("served_by")
+        if message.get("routing_reason"):
+            return f"Auto-routed to {served_by} ({message['routing_reason']})"
+        if message.get("failover_from"):
+            return f"Answered by {served_by} (failover from {message['failover_from']})"
+        return ""
 
     def _render_chat_history(self):
         messages = self.state_manager.get_messages()
@@ -103,6 +285,9 @@ class ChatPage(BasePage):
             for message in messages:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
+                    caption = self._served_by_caption(message)
+                    if caption:
+                        st.caption(caption)
         # st.markdown(
         #     """
         #     <div style="text-align: center; margin-top: 3rem; opacity: 0.6;">
@@ -120,15 +305,12 @@ class ChatPage(BasePage):
         if not prompt or not prompt.strip():
             return
 
-        file_context = st.session_state.pop("file_context", None)
-
-        if file_context:
-            # Inject file context only once
-            full_prompt = f"{file_context}\n\nUser: {prompt}"
+        index = self.state_manager.get_document_index()
+        if index is not None and "file_context" not in st.session_state:
+            # Stored and shown as asked, so passages do not pile up in the history
+            self.state_manager.add_message("user", prompt, retrieved_context=index.context_for(prompt))
         else:
-            full_prompt = prompt
-
-        self.state_manager.add_message("user", full_prompt)
+            self.state_manager.add_message("user", self._with_document_context(prompt))
         st.rerun()
 
     # def _handle_chat_input(self):
@@ -143,6 +325,103 @@ class ChatPage(BasePage):
     #         st.rerun()
 
 
+    def _render_compare_controls(self) -> list:
+        """Render the compare-mode toggle and return the endpoints to compare"""
+        endpoints, _ = self.model_service.get_available_endpoints()
+        names = {m["id"]: m["name"] for m in endpoints if m["id"]}
+        if len(names) < 2:
+            return []
+
+        if not st.toggle("Compare endpoints", key="compare_mode",
+                         help="Send the same prompt to several endpoints side by side"):
+            return []
+
+        return st.multiselect(
+            "Endpoints to compare",
+            options=list(names),
+            default=list(names)[:2],
+            format_func=lambda e: names.get(e, e),
+            max_selections=4,
+            key="compare_endpoints"
+        )
+
+    def _render_compare_mode(self, endpoints: list):
+        if "compare_runs" not in st.session_state:
+            st.session_state.compare_runs = []
+
+        for run in st.session_state.compare_runs:
+            with st.chat_message("user"):
+                st.markdown(run["prompt"])
+            cols = st.columns(len(run["results"]))
+            for col, (endpoint, result) in zip(cols, run["results"].items()):
+                with col:
+                    st.markdown(f"**{endpoint}**")
+                    if result["error"]:
+                        st.error(result["error"])
+                    else:
+                        st.markdown(result["text"])
+                    st.caption(self._format_compare_metrics(result))
+
+        prompt = st.chat_input("Ask all selected endpoints...", key="compare_input")
+        if prompt and prompt.strip():
+            self._run_comparison(endpoints, prompt)
+
+    def _run_comparison(self, endpoints: list, prompt: str):
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Staged file context is kept so several questions can be compared on it
+        content = self._with_document_context(prompt, consume=False)
+
+        placeholders, captions, texts, results = {}, {}, {}, {}
+        for col, endpoint in zip(st.columns(len(endpoints)), endpoints):
+            with col:
+                st.markdown(f"**{endpoint}**")
+                placeholders[endpoint] = st.empty()
+                captions[endpoint] = st.empty()
+                placeholders[endpoint].info("Waiting for first token...")
+
+        # Usage is logged in the background so warehouse writes never stall the streaming columns
+        conv_id = self.state_manager.get_conversation_id()
+        background.submit(self.conversation_service.ensure_conversation, conv_id, endpoints[0],
+                          title=default_title_from_prompt(f"Compare: {prompt}"))
+        events = self.model_service.compare_responses(endpoints, [{"role": "user", "content": content}])
+        for kind, endpoint, payload in events:
+            if kind == "delta":
+                texts[endpoint] = texts.get(endpoint, "") + payload
+                placeholders[endpoint].markdown(texts[endpoint])
+                continue
+
+            payload["cost"] = 0.0 if payload["cache_hit"] else db.estimate_cost(
+                payload["tokens_in"], payload["tokens_out"], payload["cached_tokens"], model=endpoint,
+                cache_write_tokens=payload["cache_write_tokens"],
+            )
+            results[endpoint] = payload
+            if payload["error"]:
+                placeholders[endpoint].error(payload["error"])
+            else:
+                placeholders[endpoint].markdown(payload["text"])
+            captions[endpoint].caption(self._format_compare_metrics(payload))
+
+            background.submit(
+                self.conversation_service.log_usage_event, conv_id, endpoint, payload["tokens_in"], payload["tokens_out"],
+                cache_hit=payload["cache_hit"], cached_tokens=payload["cached_tokens"],
+                cache_write_tokens=payload["cache_write_tokens"], estimated=payload["estimated"]
+            )
+
+        st.session_state.compare_runs.append({
+            "prompt": prompt,
+            "results": {e: results[e] for e in endpoints if e in results},
+        })
+
+    def _format_compare_metrics(self, result: dict) -> str:
+        parts = [f"{result['latency_s']:.2f}s total"]
+        if result.get("first_token_s") is not None:
+            parts.append(f"{result['first_token_s']:.2f}s to first token")
+        parts.append(f"{result['tokens_in']}+{result['tokens_out']} tokens")
+        parts.append(f"${result.get('cost', 0.0):.4f}")
+        return " · ".join(parts)
+
     def _handle_assistant_response(self):
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
@@ -151,41 +430,100 @@ class ChatPage(BasePage):
                 st.info(f"Processing with {endpoint}...")
 
             try:
-                reply_text, tokens_in, tokens_out = self.model_service.generate_response(
-                    endpoint,
-                    self.state_manager.get_messages()
+                # Reruns and other tabs asking for the same turn join the running generation
+                conv_id = self.state_manager.get_conversation_id()
+                messages = list(self.state_manager.get_messages())
+                summary = self.state_manager.get_summary()
+                turn, _ = inflight.start(
+                    turn_key(conv_id, endpoint, messages),
+                    lambda turn: self._generate_turn(turn, conv_id, endpoint, messages, summary)
+                )
+                # Replaces the processing notice as soon as the first token arrives
+                message_placeholder.write_stream(turn.iter_deltas())
+                turn.wait()
+                if turn.error:
+                    raise turn.error
+                if turn.log_error:
+                    st.error(f"Logging error: {turn.log_error}")
+
+                served_by = turn.endpoint_name or endpoint
+                self.state_manager.add_message(
+                    "assistant",
+                    turn.text,
+                    served_by=served_by,
+                    routing_reason=turn.routing_reason,
+                    failover_from=endpoint if served_by != endpoint and not turn.routing_reason else None,
                 )
-                message_placeholder.markdown(reply_text)
-                self.state_manager.add_message("assistant", reply_text)
-                self._log_conversation(tokens_in, tokens_out)
 
                 if self.state_manager.is_new_conversation():
-                    self._generate_conversation_title()
+                    self._generate_conversation_title(served_by)
+
+                if not self.state_manager.has_pending_summary():
+                    self._update_conversation_summary(served_by)
             except Exception as e:
                 message_placeholder.error(f"Unable to process request: {e}")
                 self.state_manager.add_message("assistant", f"System error: {e}")
 
         st.rerun()
 
-    def _log_conversation(self, tokens_in: int, tokens_out: int):
+    def _generate_turn(self, turn, conv_id: str, endpoint: str, messages: list, summary: dict):
+        # Runs once per turn on a background thread: one model call, one usage event
+        stream = self.model_service.stream_response(endpoint, self._model_messages(messages), summary=summary)
+        try:
+            for delta in stream:
+                turn.append(delta)
+        finally:
+            stream.close()
+        self.model_service.calibrate(stream)
+        turn.text = stream.text
+        turn.usage = stream.usage
+        turn.endpoint_name = stream.endpoint_name or endpoint
+        turn.routing_reason = stream.routing_reason
+
+        tokens_in, tokens_out = self.model_service.usage_tokens(stream.usage)
         try:
             self.conversation_service.log_conversation(
-                self.state_manager.get_conversation_id(),
-                self.state_manager.get_messages()[-2:],
-                self.state_manager.get_selected_endpoint(),
+                conv_id,
+                [messages[-1], {"role": "assistant", "content": stream.text}],
+                turn.endpoint_name,
                 tokens_in,
-                tokens_out
+                tokens_out,
+                cache_hit=bool(stream.usage.get("cache_hit")),
+                cached_tokens=int(stream.usage.get("cached_tokens", 0) or 0),
+                cache_write_tokens=int(stream.usage.get("cache_write_tokens", 0) or 0),
+                estimated=bool(stream.usage.get("estimated"))
             )
         except Exception as e:
-            st.error(f"Logging error: {e}")
+            turn.log_error = str(e)
 
-    def _generate_conversation_title(self):
+    def _generate_conversation_title(self, endpoint: str):
         try:
             messages = self.state_manager.get_messages()
-            endpoint = self.state_manager.get_selected_endpoint()
-            new_title = self.conversation_service.generate_title(endpoint, messages[:3])
-            self.state_manager.set_chat_title(new_title)
-            if os.getenv("DATABRICKS_WAREHOUSE_ID"):
-                db.update_conversation_title(self.state_manager.get_conversation_id(), new_title)
+            conv_id = self.state_manager.get_conversation_id()
+            future = self.conversation_service.generate_title_async(conv_id, endpoint, messages[:3])
+            self.state_manager.set_pending_title(conv_id, future)
         except Exception as e:
             st.error(f"Title generation failed: {e}")
+
+    def _update_conversation_summary(self, endpoint: str):
+        # Compacts older turns in the background; used from the next turn on
+        if int(os.getenv("SUMMARY_TRIGGER_TOKENS", "0") or "0") <= 0:
+            return
+        try:
+            conv_id = self.state_manager.get_conversation_id()
+            future = self.conversation_service.summarize_history_async(
+                conv_id,
+                endpoint,
+                self.state_manager.get_messages(),
+                self.state_manager.get_summary()
+            )
+            self.state_manager.set_pending_summary(conv_id, future)
+        except Exception as e:
+            st.error(f"Summary update failed: {e}")
+
+    @st.fragment(run_every=1)
+    def _await_conversation_title(self):
+        # Poll the background title and rerun the app once it has settled
+        self.state_manager.apply_pending_title()
+        if not self.state_manager.has_pending_title():
+            st.rerun()
@@ -185,7 +185,8 @@ class HistoryPage(BasePage):
         """Load a conversation from history"""
         try:
             messages = self.conversation_service.load_conversation_messages(conv_id)
-            self.state_manager.load_conversation(conv_id, title, messages)
+            summary = self.conversation_service.load_conversation_summary(conv_id)
+            self.state_manager.load_conversation(conv_id, title, messages, summary)
             st.success(f"Loaded conversation: **{title}**")
         except Exception as e:
             st.error(f"Failed to load conversation: {e}")
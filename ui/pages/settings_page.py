@@ -5,6 +5,9 @@ import json
 from conversations import export_conversation_json
 from auth_utils import get_user_identity
 import db
+from services.context_builder import context_budget
+from services import endpoint_router
+from serving_limiter import limiter
 from .base_page import BasePage
 
 class SettingsPage(BasePage):
@@ -30,6 +33,9 @@ class SettingsPage(BasePage):
             self._render_no_endpoints_configured()
             return
         
+        if endpoint_router.is_enabled():
+            endpoints = [{"id": endpoint_router.AUTO_ENDPOINT, "name": "Auto (size and cost aware)"}] + endpoints
+        
         names = [m["name"] for m in endpoints]
         display_to_id = {m["name"]: m["id"] for m in endpoints}
         
@@ -159,7 +165,8 @@ class SettingsPage(BasePage):
             "SQL Warehouse": os.getenv("DATABRICKS_WAREHOUSE_ID", "Not configured"),
             "Data Catalog": os.getenv("CATALOG", "shared"),
             "Schema": os.getenv("SCHEMA", "app"),
-            "Context Window": f"{os.getenv('MAX_TURNS', '12')} turns",
+            "Context Budget": f"{context_budget(self.state_manager.get_selected_endpoint())} tokens",
+            "Max Turns": os.getenv("MAX_TURNS", "0") if os.getenv("MAX_TURNS", "0") != "0" else "Unlimited",
             "Data Logging": "Enabled" if os.getenv("ENABLE_LOGGING", "1") == "1" else "Disabled",
             "User SQL Execution": "Enabled" if os.getenv("RUN_SQL_AS_USER", "0") == "1" else "Disabled"
         }
@@ -169,4 +176,31 @@ class SettingsPage(BasePage):
             with col1:
                 st.write(f"**{key}:**")
             with col2:
-                st.code(value)
\ No newline at end of file
+                st.code(value)
+        
+        self._render_serving_admission()
+    
+    def _render_serving_admission(self):
+        """Render per-endpoint admission queue statistics for this replica"""
+        stats = limiter.stats()
+        if not stats:
+            return
+        
+        st.markdown("**Serving Admission (this replica)**")
+        st.dataframe(
+            [
+                {
+                    "Endpoint": name,
+                    "Limit": s["max_concurrency"],
+                    "Active": s["active"],
+                    "Queued": s["queued"],
+                    "Admitted": s["admitted"],
+                    "Timeouts": s["timeouts"],
+                    "Avg Wait (s)": round(s["avg_wait_s"], 3),
+                    "P95 Wait (s)": round(s["p95_wait_s"], 3),
+                }
+                for name, s in stats.items()
+            ],
+            use_container_width=True,
+            hide_index=True
+        )
\ No newline at end of file
@@ -1,6 +1,8 @@
 # ui/sidebar.py - Sidebar navigation component
 import streamlit as st
 from auth_utils import get_user_identity
+from services.endpoint_monitor import monitor
+from services.endpoint_router import AUTO_ENDPOINT
 import os
 
 class SidebarRenderer:
@@ -82,10 +84,12 @@ class SidebarRenderer:
         # Endpoint status
         endpoint = self.state_manager.get_selected_endpoint()
         if endpoint:
+            status_class, status_text = self._endpoint_status(endpoint)
             st.markdown(f"""
-            <div class="status-card status-success">
+            <div class="status-card {status_class}">
                 <strong>Model Endpoint</strong><br>
-                <small>{endpoint}</small>
+                <small>{endpoint}</small><br>
+                <small>{status_text}</small>
             </div>
             """, unsafe_allow_html=True)
         else:
@@ -127,6 +131,23 @@ class SidebarRenderer:
         </div>
         """, unsafe_allow_html=True)
     
+    def _endpoint_status(self, endpoint: str):
+        """Map the monitor's cached readiness to a status card class and label"""
+        if endpoint == AUTO_ENDPOINT:
+            return "status-success", "Routed per request"
+        status = monitor.status(endpoint)
+        if status is None:
+            return "status-warning", "Checking status..."
+        if status["error"]:
+            return "status-warning", "Status unavailable"
+        if not status["ready"]:
+            return "status-error", "Not ready"
+        if status["config_update"] == "IN_PROGRESS":
+            return "status-warning", "Ready (updating)"
+        if status["scale_to_zero"]:
+            return "status-success", "Ready (scales to zero)"
+        return "status-success", "Ready"
+    
     def _test_model_endpoint(self):
         """Test the currently selected model endpoint"""
         endpoint = self.state_manager.get_selected_endpoint()